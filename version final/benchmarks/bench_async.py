@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: muchas generaciones a la vez (un hilo por stream vs asyncio)
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_async.py
+#    py benchmarks/bench_async.py --streams 100 --tokens 300 --retardo 0.005
+#
+#  Arranca el Ollama falso (mock_ollama.py) en OTRO proceso, para que el
+#  servidor no compita por el GIL con el cliente, y lanza --streams
+#  generaciones a la vez de tres formas:
+#
+#  hilos:     copia del cliente anterior, un hilo con requests +
+#             iter_lines bloqueante por cada stream
+#  síncrono:  un hilo por stream llamando a ollama_generate_stream
+#             (ahora un envoltorio: todas corren en el loop compartido)
+#  asyncio:   asyncio.gather de ollama_generate_async en un solo hilo
+#
+#  Mide tiempo total, CPU del proceso cliente, hilos vivos como máximo y
+#  si todas las salidas son exámenes válidos.
+# ==========================================================
+
+import argparse
+import asyncio
+import json
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+PROMPT = "Verdadero/Falso: 3\nRespuesta corta: 7"
+
+
+def legacy_stream(host: str, num_predict: int) -> str:
+    """Copia del cliente anterior: requests.post + iter_lines, bloqueante."""
+    payload = {
+        "model": "mock", "prompt": PROMPT, "stream": True,
+        "options": {"num_predict": num_predict, "temperature": 0.2},
+    }
+    chunks = []
+    response = requests.post(f"{host}/api/generate", json=payload, stream=True, timeout=(10, None))
+    try:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            data = json.loads(line)
+            chunks.append(data.get("response", ""))
+            if data.get("done") is True:
+                break
+    finally:
+        response.close()
+    return "".join(chunks).strip()
+
+
+def sync_stream(host: str, num_predict: int) -> str:
+    return otg.ollama_generate_stream(
+        PROMPT, model="mock", host=host, num_predict=num_predict, temperature=0.2,
+        cancel_event=threading.Event(),
+    )
+
+
+def with_threads(fn, host: str, n: int, num_predict: int) -> list:
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(lambda _i: fn(host, num_predict), range(n)))
+
+
+def with_asyncio(host: str, n: int, num_predict: int) -> list:
+    async def main():
+        cancel = threading.Event()
+        return await asyncio.gather(*(
+            otg.ollama_generate_async(
+                PROMPT, host=host, model="mock", num_predict=num_predict, temperature=0.2, cancel_event=cancel,
+            )
+            for _ in range(n)
+        ))
+    return asyncio.run(main())
+
+
+def measure(fn, *args) -> tuple:
+    """(segundos, cpu_segundos, hilos_max, resultado)."""
+    peak = [threading.active_count()]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.01):
+            peak[0] = max(peak[0], threading.active_count())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    t0, c0 = time.perf_counter(), time.process_time()
+    result = fn(*args)
+    secs, cpu = time.perf_counter() - t0, time.process_time() - c0
+    stop.set()
+    sampler.join()
+    return secs, cpu, peak[0] - 1, result  # -1: el hilo que mide
+
+
+def wait_for(host: str):
+    for _ in range(100):
+        try:
+            requests.get(f"{host}/api/version", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.05)
+    raise SystemExit(f"El Ollama falso no arrancó en {host}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="N generaciones a la vez: hilos vs asyncio")
+    ap.add_argument("--streams", type=int, default=100)
+    ap.add_argument("--tokens", type=int, default=300, help="Tokens de cada respuesta")
+    ap.add_argument("--retardo", type=float, default=0.005, help="Segundos entre token y token (servidor)")
+    ap.add_argument("--puerto", type=int, default=11439)
+    args = ap.parse_args()
+
+    otg.OLLAMA_MAX_STREAMS = max(otg.OLLAMA_MAX_STREAMS, args.streams)
+    otg.OLLAMA_POOL_SIZE = max(otg.OLLAMA_POOL_SIZE, args.streams)
+    host = f"http://127.0.0.1:{args.puerto}"
+    server = subprocess.Popen([
+        sys.executable, str(HERE / "mock_ollama.py"), "--puerto", str(args.puerto),
+        "--retardo", str(args.retardo), "--tokens", str(args.tokens),
+    ], stdout=subprocess.DEVNULL)
+    try:
+        wait_for(host)
+        num_predict = args.tokens + 100
+        print(f"{args.streams} streams a la vez, ~{args.tokens} tokens cada uno, {args.retardo * 1000:.0f} ms/token")
+        print(f"{'cliente':>10} {'seg':>7} {'CPU s':>7} {'hilos':>6} {'válidos':>8}")
+        runs = (
+            ("hilos", lambda: with_threads(legacy_stream, host, args.streams, num_predict)),
+            ("síncrono", lambda: with_threads(sync_stream, host, args.streams, num_predict)),
+            ("asyncio", lambda: with_asyncio(host, args.streams, num_predict)),
+        )
+        for label, fn in runs:
+            secs, cpu, threads, results = measure(fn)
+            ok = sum(otg.validate_output(r, 3, 7) for r in results)
+            print(f"{label:>10} {secs:>7.2f} {cpu:>7.2f} {threads:>6} {ok:>4}/{len(results)}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: coste de montar cada petición a Ollama (conexión nueva vs pool)
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_conexiones.py
+#    py benchmarks/bench_conexiones.py --peticiones 500 --hilos 8
+#
+#  Contra el Ollama falso de mock_ollama.py (arranca solo, en un puerto
+#  libre), así se mide el cliente y no el modelo:
+#
+#  antes:  requests.post() a secas -> una conexión TCP nueva por llamada
+#  ahora:  lo que usa el script: /api/show por ollama_client(host)
+#          (Session con pool keep-alive) y las generaciones por
+#          ollama_generate_stream (cliente asyncio, con su propio pool
+#          keep-alive)
+#
+#  Se mide con peticiones cortas (/api/show y generaciones de 1 token)
+#  en serie y desde varios hilos a la vez (como el examen por secciones).
+#  "conexiones" cuenta las TCP abiertas por los dos clientes.
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3.connection
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import ollama_test_gen as otg  # noqa: E402
+from mock_ollama import start_mock  # noqa: E402
+
+_connects = [0]
+_connects_lock = threading.Lock()
+_original_connect = urllib3.connection.HTTPConnection.connect
+_original_async_connect = otg.AsyncOllamaClient._connect
+
+
+def _counting_connect(self):
+    with _connects_lock:
+        _connects[0] += 1
+    return _original_connect(self)
+
+
+async def _counting_async_connect(self):
+    with _connects_lock:
+        _connects[0] += 1
+    return await _original_async_connect(self)
+
+
+urllib3.connection.HTTPConnection.connect = _counting_connect
+otg.AsyncOllamaClient._connect = _counting_async_connect
+
+GENERATE = {
+    "model": "mock", "prompt": "Di hola.", "stream": True,
+    "options": {"num_predict": 1, "temperature": 0.0},
+}
+
+
+def legacy_request(host: str):
+    """Copia del camino anterior: requests.post a secas, sin sesión."""
+    r = requests.post(f"{host}/api/show", json={"model": "mock"}, timeout=(3, 10))
+    r.raise_for_status()
+    r.json()
+    r = requests.post(f"{host}/api/generate", json=GENERATE, stream=True, timeout=(10, None))
+    for _line in r.iter_lines():
+        pass
+    r.close()
+
+
+def pooled_request(host: str):
+    """Lo mismo como lo hace el script: Session compartida + cliente asyncio."""
+    client = otg.ollama_client(host)
+    r = client.post("/api/show", json={"model": "mock"}, timeout=(3, 10))
+    r.raise_for_status()
+    r.json()
+    otg.ollama_generate_stream(
+        "Di hola.", model="mock", host=host, num_predict=1, temperature=0.0, cancel_event=threading.Event()
+    )
+
+
+def run(fn, host: str, n: int, threads: int) -> tuple:
+    """Ejecuta fn(host) n veces con `threads` hilos. Devuelve (segundos, conexiones abiertas)."""
+    _connects[0] = 0
+    t0 = time.perf_counter()
+    if threads == 1:
+        for _ in range(n):
+            fn(host)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _i: fn(host), range(n)))
+    return time.perf_counter() - t0, _connects[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Coste por petición: conexión nueva vs pool keep-alive")
+    ap.add_argument("--peticiones", type=int, default=300)
+    ap.add_argument("--hilos", nargs="+", type=int, default=[1, 4])
+    args = ap.parse_args()
+
+    server, host = start_mock()
+    run(pooled_request, host, 5, 1)  # calentar (imports, primer connect)
+
+    print(f"{args.peticiones} x (/api/show + /api/generate de 1 token) contra {host}")
+    print(f"{'cliente':>10} {'hilos':>6} {'seg':>7} {'ms/petición':>12} {'conexiones':>11} {'speedup':>8}")
+    for threads in args.hilos:
+        base = None
+        for label, fn in (("antes", legacy_request), ("ahora", pooled_request)):
+            secs, conns = run(fn, host, args.peticiones, threads)
+            base = base or secs
+            per = secs / args.peticiones * 1000
+            print(f"{label:>10} {threads:>6} {secs:>7.2f} {per:>12.2f} {conns:>11} {base / secs:>7.2f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
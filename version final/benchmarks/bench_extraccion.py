@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: extracción de texto PDF (páginas/segundo vs procesos)
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_extraccion.py
+#    py benchmarks/bench_extraccion.py --workers 1 2 4 --repetir 60
+#
+#  - Por defecto usa los PDFs de ../iteracion/*.pdf
+#  - Esos PDFs son cortos (4-7 páginas), así que con --repetir N se
+#    construye un PDF temporal con sus páginas repetidas N veces para
+#    simular un dossier de cientos de páginas.
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+from pypdf import PdfReader, PdfWriter
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+
+def build_repeated_pdf(src: pathlib.Path, times: int, dst: pathlib.Path) -> int:
+    """Crea dst con las páginas de src repetidas `times` veces. Devuelve nº de páginas."""
+    reader = PdfReader(str(src))
+    writer = PdfWriter()
+    for _ in range(times):
+        for page in reader.pages:
+            writer.add_page(page)
+    with open(dst, "wb") as f:
+        writer.write(f)
+    return len(reader.pages) * times
+
+
+def bench_one(path_pdf: str, workers: int) -> tuple:
+    """Extrae todas las páginas y devuelve (n_paginas, segundos, chars)."""
+    t0 = time.perf_counter()
+    n = 0
+    chars = 0
+    for _num, text in otg.iter_pages_text(path_pdf, workers=workers):
+        n += 1
+        chars += len(text)
+    return n, time.perf_counter() - t0, chars
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Páginas/segundo vs procesos en la extracción PDF")
+    ap.add_argument("pdfs", nargs="*", help="PDFs a medir (por defecto ../iteracion/*.pdf)")
+    ap.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    ap.add_argument("--repetir", type=int, default=40, help="Repite las páginas N veces (1 = PDF original)")
+    args = ap.parse_args()
+
+    pdfs = [pathlib.Path(p) for p in args.pdfs] or sorted((HERE.parent.parent / "iteracion").glob("*.pdf"))
+    if not pdfs:
+        print("No hay PDFs que medir.")
+        return
+
+    # Forzamos el modo paralelo aunque el PDF sea corto
+    otg.MIN_PAGES_PARALLEL = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in pdfs:
+            path = src
+            if args.repetir > 1:
+                path = pathlib.Path(tmp) / f"{src.stem}_x{args.repetir}.pdf"
+                build_repeated_pdf(src, args.repetir, path)
+
+            print(f"\n{src.name} (x{args.repetir})")
+            print(f"{'procesos':>9} {'páginas':>8} {'seg':>8} {'pág/s':>9} {'speedup':>8}")
+            base = None
+            ref_chars = None
+            for w in args.workers:
+                n, secs, chars = bench_one(str(path), w)
+                if ref_chars is None:
+                    ref_chars = chars
+                elif chars != ref_chars:
+                    print(f"  ⚠️ workers={w} extrajo {chars} chars (esperado {ref_chars})")
+                pps = n / secs if secs > 0 else float("inf")
+                base = base or pps
+                print(f"{w:>9} {n:>8} {secs:>8.2f} {pps:>9.1f} {pps / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: examen con un solo prompt vs por secciones (map-reduce)
+# ==========================================================
+#  Uso (con Ollama arrancado y el modelo descargado):
+#    py benchmarks/bench_map_reduce.py
+#    py benchmarks/bench_map_reduce.py --modelo qwen2.5-coder:7b --concurrencia 1 2 4
+#
+#  - Por defecto usa los PDFs de ../iteracion/*.pdf
+#  - Mide la latencia de principio a fin (prompt -> examen listo) de:
+#      * el camino clásico: un único prompt con todos los apuntes
+#      * generate_exam_by_sections con cada nivel de concurrencia
+#  - Para que las peticiones paralelas se atiendan de verdad a la vez,
+#    Ollama tiene que arrancarse con OLLAMA_NUM_PARALLEL >= concurrencia.
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+
+def single_prompt(doc, args) -> str:
+    """Camino clásico: un prompt con todos los apuntes (+1 reintento estricto)."""
+    num_predict = args.num_predict or otg.predict_num_predict(args.modelo, args.vf, args.cortas)
+    prompt, budget = otg.fit_prompt(doc, args.vf, args.cortas, args.modelo, num_predict, args.host)
+    call = dict(
+        model=args.modelo, host=args.host, num_predict=num_predict,
+        cancel_event=threading.Event(), num_ctx=budget["num_ctx"],
+    )
+    result = otg.ollama_generate_stream(prompt, temperature=otg.DEFAULT_TEMPERATURE, **call)
+    if not otg.validate_output(result, args.vf, args.cortas):
+        result = otg.ollama_generate_stream(prompt + otg.STRICT_RETRY_RULE, temperature=0.0, **call)
+    return result
+
+
+def by_sections(doc, args, concurrency: int) -> str:
+    return otg.generate_exam_by_sections(
+        doc,
+        args.vf,
+        args.cortas,
+        model=args.modelo,
+        host=args.host,
+        num_predict=args.num_predict,
+        temperature=otg.DEFAULT_TEMPERATURE,
+        cancel_event=threading.Event(),
+        concurrency=concurrency,
+    )
+
+
+def timed(fn, *args) -> tuple:
+    """Ejecuta fn(*args) y devuelve (segundos, resultado)."""
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - t0, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Latencia: prompt único vs examen por secciones")
+    ap.add_argument("pdfs", nargs="*", help="PDFs a medir (por defecto ../iteracion/*.pdf)")
+    ap.add_argument("--host", default=otg.DEFAULT_HOST)
+    ap.add_argument("--modelo", default=otg.MODELOS_DISPONIBLES[0])
+    ap.add_argument("--vf", type=int, default=3)
+    ap.add_argument("--cortas", type=int, default=7)
+    ap.add_argument("--num-predict", type=int, default=None, help="Fijo (por defecto se calcula como en la app)")
+    ap.add_argument("--concurrencia", nargs="+", type=int, default=[1, 2, 4])
+    args = ap.parse_args()
+
+    try:
+        requests.get(f"{args.host}/api/version", timeout=3).raise_for_status()
+    except requests.RequestException:
+        print(f"No se puede conectar con Ollama en {args.host}. Arráncalo antes de medir.")
+        return
+
+    pdfs = [pathlib.Path(p) for p in args.pdfs] or sorted((HERE.parent.parent / "iteracion").glob("*.pdf"))
+    if not pdfs:
+        print("No hay PDFs que medir.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in pdfs:
+            doc = otg.pdf_to_doc(str(src), str(pathlib.Path(tmp) / f"{src.stem}.md"), strip_headers=True)
+            plan = otg.plan_sections(doc, args.vf, args.cortas)
+
+            print(f"\n{src.name}: {len(doc.text)} chars, {len(plan)} trozos")
+            print(f"{'modo':>16} {'seg':>8} {'speedup':>8} {'válido':>7}")
+
+            base, result = timed(single_prompt, doc, args)
+            ok = otg.validate_output(result, args.vf, args.cortas)
+            print(f"{'prompt único':>16} {base:>8.1f} {1:>7.2f}x {'sí' if ok else 'NO':>7}")
+
+            for c in args.concurrencia:
+                secs, result = timed(by_sections, doc, args, c)
+                ok = otg.validate_output(result, args.vf, args.cortas)
+                print(f"{f'secciones x{c}':>16} {secs:>8.1f} {base / secs:>7.2f}x {'sí' if ok else 'NO':>7}")
+
+
+if __name__ == "__main__":
+    main()
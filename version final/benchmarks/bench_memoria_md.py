@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: memoria de la reconstrucción PDF-texto -> Markdown
+# ==========================================================
+#  Compara el conversor clásico (join global + fix_hyphenation +
+#  split + join + re.sub) con el pipeline por streaming
+#  (ollama_test_gen.write_md_stream) sobre un documento sintético.
+#
+#  Uso:
+#    py benchmarks/bench_memoria_md.py
+#    py benchmarks/bench_memoria_md.py --paginas 1000
+#
+#  Mide el pico de memoria con tracemalloc y comprueba que las dos
+#  salidas son idénticas byte a byte.
+# ==========================================================
+
+import argparse
+import pathlib
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+PALABRAS = (
+    "jornada horario descanso contrato convenio trabajador empresa salario "
+    "actividad comercial prevención riesgos laborales seguridad social "
+    "vacaciones permiso excedencia despido indemnización nómina"
+).split()
+
+
+def synthetic_pages(n_pages: int, seed: int = 1234):
+    """
+    Genera (num, texto) de un documento sintético "tipo apuntes":
+    títulos, viñetas, párrafos partidos en varias líneas, palabras
+    cortadas con guión, \\r\\n, espacios al final y alguna página vacía.
+    """
+    rnd = random.Random(seed)
+    for num in range(1, n_pages + 1):
+        if num % 97 == 0:
+            yield num, ""
+            continue
+        lines = [f"Tema {num // 50 + 1}", f"{num % 9 + 1}. APARTADO {num}"]
+        for _ in range(rnd.randint(8, 16)):
+            words = [rnd.choice(PALABRAS) for _ in range(rnd.randint(6, 14))]
+            kind = rnd.random()
+            if kind < 0.2:
+                lines.append("• " + " ".join(words))
+            elif kind < 0.3:
+                w = rnd.choice(PALABRAS)
+                lines.append(" ".join(words) + f" {w[:3]}-")
+                lines.append(f"{w[3:]} fin de frase.   ")
+            elif kind < 0.35:
+                lines.append("")
+            else:
+                lines.append(" ".join(words))
+        sep = "\r\n" if num % 5 == 0 else "\n"
+        yield num, sep.join(lines)
+
+
+def legacy_convert(pages, path_md: str) -> str:
+    """Copia del conversor clásico (antes del streaming), como referencia."""
+    full_text = []
+    for i, text in pages:
+        text = otg.normalize_newlines(text)
+        full_text.append(f"\n\n<!-- page: {i} -->\n\n")
+        full_text.append(text)
+
+    text = "".join(full_text)
+    text = otg.fix_hyphenation(text)
+
+    lines = text.split("\n")
+    out = []
+    paragraph = []
+
+    def flush_paragraph():
+        nonlocal paragraph
+        if paragraph:
+            out.append(" ".join(paragraph).strip())
+            out.append("")
+            paragraph = []
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            flush_paragraph()
+            continue
+        lvl = otg.is_heading(line)
+        if lvl:
+            flush_paragraph()
+            out.append("#" * lvl + " " + line)
+            out.append("")
+            continue
+        if otg.is_bullet(line):
+            flush_paragraph()
+            line = re.sub(r"^\s*[•\-\*]\s+", "- ", line)
+            out.append(line)
+            continue
+        paragraph.append(line)
+
+    flush_paragraph()
+
+    md_text = "\n".join(out)
+    md_text = re.sub(r"\n{3,}", "\n\n", md_text).strip() + "\n"
+    pathlib.Path(path_md).write_text(md_text, encoding="utf-8")
+    return md_text
+
+
+def measure(fn, *args):
+    """Ejecuta fn(*args) y devuelve (segundos, pico_bytes)."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(*args)
+    secs = time.perf_counter() - t0
+    _cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return secs, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pico de memoria: conversor clásico vs streaming")
+    ap.add_argument("--paginas", type=int, default=1000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_md = pathlib.Path(tmp) / "clasico.md"
+        new_md = pathlib.Path(tmp) / "streaming.md"
+
+        t_old, peak_old = measure(legacy_convert, synthetic_pages(args.paginas), str(old_md))
+        t_new, peak_new = measure(otg.write_md_stream, synthetic_pages(args.paginas), str(new_md))
+
+        same = old_md.read_bytes() == new_md.read_bytes()
+        size = new_md.stat().st_size
+
+        print(f"Documento sintético: {args.paginas} páginas -> {size / 1024:.0f} KiB de Markdown")
+        print(f"{'conversor':>10} {'seg':>7} {'pico MiB':>9}")
+        print(f"{'clásico':>10} {t_old:>7.2f} {peak_old / 2**20:>9.2f}")
+        print(f"{'streaming':>10} {t_new:>7.2f} {peak_new / 2**20:>9.2f}")
+        print(f"Salida idéntica byte a byte: {'sí' if same else 'NO'}")
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
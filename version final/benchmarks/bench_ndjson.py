@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: leer el stream NDJSON de Ollama (líneas por segundo)
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_ndjson.py
+#    py benchmarks/bench_ndjson.py --lineas 500000 --tokens 50000
+#
+#  1) Solo el decodificador, con líneas como las que manda Ollama (un
+#     token por línea) cortadas en trozos como los del socket: uno por
+#     línea (chunked de Ollama) o de 64 KiB.
+#
+#     antes:   buf += trozo; buf.split(b"\n"); json.loads por línea
+#     json:    NDJSONDecoder sin orjson (regex para las líneas de token)
+#     orjson:  NDJSONDecoder con orjson (si está instalado)
+#
+#  2) De punta a punta: ollama_generate_stream contra el Ollama falso
+#     (mock_ollama.py, en OTRO proceso y sin retardo) con una salida de
+#     --tokens tokens; "antes" vuelve a poner la lectura anterior
+#     (readline + readexactly por chunk y el parseo de arriba).
+#
+#  Mide líneas/s y CPU del cliente, y que el texto sale igual.
+# ==========================================================
+
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import ollama_test_gen as otg  # noqa: E402
+from bench_async import wait_for  # noqa: E402
+
+ORJSON = otg.orjson
+PROMPT = "Verdadero/Falso: 3\nRespuesta corta: 7"
+
+
+class LegacyDecoder:
+    """Copia del parseo anterior de AsyncOllamaClient.stream."""
+
+    def __init__(self):
+        self.buf = b""
+
+    def feed(self, data: bytes) -> list:
+        self.buf += data
+        *lines, self.buf = self.buf.split(b"\n")
+        out = []
+        for line in lines:
+            if line.strip():
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    continue
+        return out
+
+    def close(self) -> list:
+        return [json.loads(self.buf)] if self.buf.strip() else []
+
+
+async def legacy_body(reader, headers: dict):
+    """Copia de la lectura anterior: readline + readexactly por cada chunk."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            data = await reader.readexactly(size + 2)
+            yield data[:-2]
+    elif "content-length" in headers:
+        size = int(headers["content-length"])
+        if size:
+            yield await reader.readexactly(size)
+    else:
+        while data := await reader.read(65536):
+            yield data
+
+
+def ollama_lines(n: int) -> list:
+    """Líneas NDJSON como las de Ollama (Go: sin espacios) + la final con estadísticas."""
+    lines = [
+        json.dumps({
+            "model": "qwen2.5-coder:7b", "created_at": "2024-05-01T10:00:00.123456789Z",
+            "response": f" palabra{i % 97}" if i % 50 else "\n", "done": False,
+        }, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+        for i in range(n)
+    ]
+    lines.append(json.dumps({
+        "model": "qwen2.5-coder:7b", "response": "", "done": True, "done_reason": "stop",
+        "eval_count": n, "context": list(range(4000)),
+    }, separators=(",", ":")).encode() + b"\n")
+    return lines
+
+
+def decode_all(make, chunks: list) -> tuple:
+    decoder = make()
+    texts = []
+    for chunk in chunks:
+        texts += [obj.get("response", "") for obj in decoder.feed(chunk)]
+    texts += [obj.get("response", "") for obj in decoder.close()]
+    return len(texts), "".join(texts)
+
+
+def decoder_only(n: int):
+    lines = ollama_lines(n)
+    raw = b"".join(lines)
+    cuts = {
+        "1 línea": lines,
+        "64 KiB": [raw[i:i + 65536] for i in range(0, len(raw), 65536)],
+    }
+    modes = [("antes", LegacyDecoder, None), ("json", otg.NDJSONDecoder, None)]
+    if ORJSON is not None:
+        modes.append(("orjson", otg.NDJSONDecoder, ORJSON))
+
+    print(f"Solo decodificador: {len(lines)} líneas ({len(raw) / 1e6:.1f} MB)")
+    print(f"{'trozos':>9} {'modo':>7} {'líneas/s':>12} {'speedup':>8} {'igual':>6}")
+    for label, chunks in cuts.items():
+        base = expected = None
+        for mode, make, lib in modes:
+            otg.orjson = lib
+            t0 = time.perf_counter()
+            count, text = decode_all(make, chunks)
+            rate = count / (time.perf_counter() - t0)
+            base = base or rate
+            expected = expected if expected is not None else text
+            print(f"{label:>9} {mode:>7} {rate:>12,.0f} {rate / base:>7.2f}x {str(text == expected):>6}")
+    otg.orjson = ORJSON
+
+
+def generate(host: str, tokens: int) -> str:
+    return otg.ollama_generate_stream(
+        PROMPT, model="mock", host=host, num_predict=tokens + 100, temperature=0.2,
+        cancel_event=threading.Event(),
+    )
+
+
+def end_to_end(tokens: int, port: int, repeat: int):
+    host = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([
+        sys.executable, str(HERE / "mock_ollama.py"), "--puerto", str(port), "--tokens", str(tokens),
+    ], stdout=subprocess.DEVNULL)
+    body, decoder = otg.AsyncOllamaClient._body, otg.NDJSONDecoder
+    try:
+        wait_for(host)
+        generate(host, 10)  # calentar (conexión, loop)
+        modes = [("antes", legacy_body, LegacyDecoder, None), ("json", body, decoder, None)]
+        if ORJSON is not None:
+            modes.append(("orjson", body, decoder, ORJSON))
+
+        print(f"\nDe punta a punta: {repeat} x {tokens} tokens contra el Ollama falso ({host})")
+        print(f"{'modo':>7} {'seg':>7} {'CPU s':>7} {'líneas/s':>12} {'speedup':>8} {'igual':>6}")
+        base = expected = None
+        for mode, body_fn, make, lib in modes:
+            otg.AsyncOllamaClient._body = staticmethod(body_fn)
+            otg.NDJSONDecoder = make
+            otg.orjson = lib
+            t0, c0 = time.perf_counter(), time.process_time()
+            texts = [generate(host, tokens) for _ in range(repeat)]
+            secs, cpu = time.perf_counter() - t0, time.process_time() - c0
+            rate = repeat * (tokens + 1) / secs
+            base = base or rate
+            expected = expected or texts[0]
+            same = all(t == expected for t in texts)
+            print(f"{mode:>7} {secs:>7.2f} {cpu:>7.2f} {rate:>12,.0f} {rate / base:>7.2f}x {str(same):>6}")
+    finally:
+        otg.AsyncOllamaClient._body, otg.NDJSONDecoder, otg.orjson = staticmethod(body), decoder, ORJSON
+        server.terminate()
+        server.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Líneas/s leyendo el stream NDJSON de Ollama")
+    ap.add_argument("--lineas", type=int, default=200000, help="Líneas para el decodificador solo")
+    ap.add_argument("--tokens", type=int, default=20000, help="Tokens por generación (punta a punta)")
+    ap.add_argument("--repeticiones", type=int, default=3)
+    ap.add_argument("--puerto", type=int, default=11441)
+    args = ap.parse_args()
+
+    print(f"orjson: {'sí' if ORJSON is not None else 'no (py -m pip install orjson)'}")
+    decoder_only(args.lineas)
+    end_to_end(args.tokens, args.puerto, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
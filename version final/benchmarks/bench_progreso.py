@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: coste de los avisos de progreso con salidas largas
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_progreso.py
+#    py benchmarks/bench_progreso.py --tokens 1000 4000 16000 --hz 10
+#
+#  1) Solo el lado del cliente, con trozos sintéticos llegando al ritmo
+#     de --tok-s tokens/s (sin dormir: el reloj se simula):
+#
+#     antes:  on_progress("".join(chunks), elapsed) en cada token
+#             -> se rehace el texto entero cada vez (O(n²)) y la GUI
+#             recibe un mensaje por token
+#     ahora:  ProgressChannel -> delta agrupado, como mucho --hz avisos/s
+#
+#  2) De punta a punta contra el Ollama falso (mock_ollama.py) con
+#     ollama_generate_stream y una salida de --tokens[-1] tokens.
+#
+#  Mide CPU, nº de avisos y µs por token, y que con los deltas se
+#  reconstruye exactamente la misma salida.
+# ==========================================================
+
+import argparse
+import pathlib
+import queue
+import sys
+import threading
+import time
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import ollama_test_gen as otg  # noqa: E402
+from mock_ollama import start_mock  # noqa: E402
+
+
+class FakeClock:
+    """Sustituye a time.time en el script: avanza 1/tok_s por token."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def pieces_for(n: int) -> list:
+    return [f"palabra{i % 97} " for i in range(n)]
+
+
+def legacy(pieces: list, clock: FakeClock, step: float) -> tuple:
+    """Copia del camino anterior: texto entero + mensaje a la cola por token."""
+    q = queue.Queue()
+    chunks = []
+    start = clock()
+    for piece in pieces:
+        clock.now += step
+        chunks.append(piece)
+        text = "".join(chunks)
+        q.put(("elapsed", f"Tiempo: {clock() - start:0.1f}s"))
+    return q.qsize(), text
+
+
+def channel(pieces: list, clock: FakeClock, step: float, hz: float) -> tuple:
+    """Lo mismo con ProgressChannel: la GUI solo ve los avisos agrupados."""
+    q = queue.Queue()
+    parts = []
+
+    def on_prog(ev):
+        parts.append(ev.delta)
+        q.put(("elapsed", f"Tiempo: {ev.elapsed:0.1f}s | {ev.tokens} tokens ({ev.tokens_per_s:0.1f}/s)"))
+
+    progress = otg.ProgressChannel(on_prog, hz, clock())
+    for piece in pieces:
+        clock.now += step
+        progress.feed(piece)
+    progress.close()
+    return q.qsize(), "".join(parts)
+
+
+def client_side(sizes: list, hz: float, tok_s: float):
+    clock = FakeClock()
+    real_time = otg.time.time
+    otg.time.time = clock  # ProgressChannel lee el reloj del script
+    try:
+        print(f"Solo cliente, {tok_s:.0f} tokens/s simulados, {hz:g} avisos/s")
+        print(f"{'tokens':>7} {'modo':>7} {'CPU ms':>8} {'µs/token':>9} {'avisos':>7} {'speedup':>8} {'igual':>6}")
+        for n in sizes:
+            pieces = pieces_for(n)
+            expected = "".join(pieces)
+            base = None
+            for label, fn in (("antes", legacy), ("ahora", channel)):
+                args = (pieces, clock, 1.0 / tok_s) + ((hz,) if fn is channel else ())
+                c0 = time.process_time()
+                events, text = fn(*args)
+                cpu = time.process_time() - c0
+                base = base or cpu
+                speedup = base / cpu if cpu else float("inf")
+                print(
+                    f"{n:>7} {label:>7} {cpu * 1000:>8.1f} {cpu / n * 1e6:>9.2f} {events:>7}"
+                    f" {speedup:>7.1f}x {str(text == expected):>6}"
+                )
+    finally:
+        otg.time.time = real_time
+
+
+def end_to_end(tokens: int, hz: float):
+    server, host = start_mock(tokens=tokens)
+    try:
+        events = []
+        c0 = time.process_time()
+        t0 = time.perf_counter()
+        text = otg.ollama_generate_stream(
+            "Verdadero/Falso: 3\nRespuesta corta: 7", model="mock", host=host,
+            num_predict=tokens + 100, temperature=0.2, cancel_event=threading.Event(),
+            on_progress=events.append, progress_hz=hz,
+        )
+        secs, cpu = time.perf_counter() - t0, time.process_time() - c0
+        last = events[-1]
+        rebuilt = "".join(ev.delta for ev in events).strip()
+        print(
+            f"\nDe punta a punta (mock, {last.tokens} tokens): {secs:.2f} s, CPU {cpu:.2f} s,"
+            f" {len(events)} avisos, {last.tokens_per_s:.0f} tok/s, deltas = salida: {rebuilt == text}"
+        )
+    finally:
+        server.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Avisos de progreso: texto entero por token vs deltas agrupados")
+    ap.add_argument("--tokens", nargs="+", type=int, default=[1000, 4000, 16000])
+    ap.add_argument("--hz", type=float, default=otg.DEFAULT_PROGRESS_HZ)
+    ap.add_argument("--tok-s", type=float, default=40.0, help="Ritmo simulado del modelo (tokens/s)")
+    args = ap.parse_args()
+
+    client_side(args.tokens, args.hz, args.tok_s)
+    end_to_end(args.tokens[-1], args.hz)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: tokens de los apuntes en el prompt (Markdown vs forma compacta)
+# ==========================================================
+#  Uso:
+#    py benchmarks/bench_prompt_compacto.py
+#    py benchmarks/bench_prompt_compacto.py --paginas 200 --modelo qwen2.5-coder:7b
+#
+#  - Por defecto usa los PDFs de ../iteracion/*.pdf y, además, un
+#    documento sintético de --paginas páginas (el de bench_memoria_md).
+#  - Compara los tokens estimados (estimate_tokens, con la calibración
+#    del modelo si se pasa --modelo) del Markdown tal cual y de
+#    serialize_notes, y comprueba que el mapa de páginas aparte sigue
+#    citando cada párrafo en su página.
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import ollama_test_gen as otg  # noqa: E402
+from bench_memoria_md import synthetic_pages  # noqa: E402
+
+
+def wrong_pages(doc, notes) -> int:
+    """Párrafos cuya página según el mapa aparte no coincide con la del Markdown."""
+    bad = 0
+    for a, b in doc.iter_paragraphs():
+        frag = otg.serialize_notes(doc.text[a:b]).text[:60]
+        if frag and not frag.startswith("#") and notes.cite(frag) != doc.page_at(a):
+            bad += 1
+    return bad
+
+
+def row(label: str, doc, model: str):
+    info = {}
+    t0 = time.perf_counter()
+    notes = otg.serialize_notes(doc, model, info=info)
+    ms = (time.perf_counter() - t0) * 1000
+    before, after = info["notes_tokens_before"], info["notes_tokens_after"]
+    saved = 1 - after / before if before else 0.0
+    print(
+        f"{label:>32} {info['page_markers']:>7} {before:>8} {after:>8} {saved:>7.1%} {ms:>7.1f}"
+        f" {wrong_pages(doc, notes):>6}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tokens de los apuntes: Markdown vs forma compacta")
+    ap.add_argument("pdfs", nargs="*", help="PDFs a medir (por defecto ../iteracion/*.pdf)")
+    ap.add_argument("--paginas", type=int, default=200, help="Páginas del documento sintético (0 = ninguno)")
+    ap.add_argument("--modelo", default=None)
+    args = ap.parse_args()
+
+    pdfs = [pathlib.Path(p) for p in args.pdfs] or sorted((HERE.parent.parent / "iteracion").glob("*.pdf"))
+
+    print(f"{'apuntes':>32} {'páginas':>7} {'antes':>8} {'ahora':>8} {'ahorro':>7} {'ms':>7} {'citas!':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in pdfs:
+            doc = otg.pdf_to_doc(str(src), str(pathlib.Path(tmp) / f"{src.stem}.md"), strip_headers=True)
+            row(src.name, doc, args.modelo)
+
+        if args.paginas:
+            path_md = pathlib.Path(tmp) / "sintetico.md"
+            builder = otg.write_md_stream(synthetic_pages(args.paginas), str(path_md))
+            row(f"sintético ({args.paginas} págs.)", builder.build(path_md.read_text(encoding="utf-8")), args.modelo)
+
+
+if __name__ == "__main__":
+    main()
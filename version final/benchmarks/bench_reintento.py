@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Benchmark: prefill del reintento (y de otra petición sobre los mismos apuntes)
+# ==========================================================
+#  Uso (con Ollama arrancado y el modelo descargado):
+#    py benchmarks/bench_reintento.py
+#    py benchmarks/bench_reintento.py --modelo qwen2.5-coder:7b apuntes.pdf
+#
+#  Compara, con las estadísticas que devuelve Ollama
+#  (prompt_eval_count / prompt_eval_duration):
+#
+#  antes:  prompt con los requisitos delante de los apuntes; el reintento
+#          reenvía prompt + "REGLA FINAL..." entero.
+#  ahora:  apuntes delante (prefijo estable); el reintento sigue sobre el
+#          "context" de la primera llamada con una instrucción corta.
+#
+#  Los dos usan los mismos apuntes (serialize_notes), así solo cambia
+#  la disposición del prompt.
+#
+#  Además mide una segunda petición sobre los mismos apuntes con otras
+#  cantidades de preguntas (con los apuntes delante, el prefijo se reutiliza).
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import threading
+from textwrap import dedent
+
+import requests
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+
+def legacy_prompt(apuntes_md: str, n_vf: int, n_short: int) -> str:
+    """Copia de la disposición anterior (requisitos primero, apuntes al final)."""
+    total = n_vf + n_short
+    fmt = otg.build_prompt("", n_vf, n_short).split("Formato obligatorio (Markdown):\n", 1)[1]
+    return dedent(f"""
+    Eres profesor/a. Crea un examen basado SOLO en los apuntes.
+
+    Requisitos:
+    - Total preguntas: {total}
+    - Verdadero/Falso: {n_vf}
+    - Respuesta corta: {n_short}
+    - Reparte las preguntas entre distintos temas/secciones del texto (no te centres en un solo apartado).
+    - NO uses internet ni conocimientos externos.
+    - En `## Examen` SOLO van preguntas/enunciados. En `## Respuestas` SOLO van respuestas.
+
+    Formato obligatorio (Markdown):
+    {fmt}
+
+    APUNTES:
+    ---
+    {apuntes_md}
+    ---
+    """).strip()
+
+
+def call(prompt: str, args, num_ctx: int, **extra) -> dict:
+    """Una generación; devuelve las estadísticas de Ollama."""
+    info = {}
+    otg.ollama_generate_stream(
+        prompt,
+        model=args.modelo,
+        host=args.host,
+        num_predict=args.num_predict,
+        temperature=0.0,
+        cancel_event=threading.Event(),
+        num_ctx=num_ctx,
+        info=info,
+        **extra,
+    )
+    return info
+
+
+def flush_cache(args, num_ctx: int):
+    """Una petición sin relación para que Ollama olvide el prefijo anterior."""
+    otg.ollama_generate_stream(
+        "Di solo: hola.", model=args.modelo, host=args.host, num_predict=5, temperature=0.0,
+        cancel_event=threading.Event(), num_ctx=num_ctx,
+    )
+
+
+def row(label: str, info: dict):
+    secs = info.get("prompt_eval_duration", 0) / 1e9
+    print(f"{label:>34} {info.get('prompt_eval_count', 0):>8} {secs:>9.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prefill del reintento: antes vs ahora")
+    ap.add_argument("pdfs", nargs="*", help="PDFs a medir (por defecto ../iteracion/*.pdf)")
+    ap.add_argument("--host", default=otg.DEFAULT_HOST)
+    ap.add_argument("--modelo", default=otg.MODELOS_DISPONIBLES[0])
+    ap.add_argument("--num-predict", type=int, default=None, help="Fijo (por defecto se calcula como en la app)")
+    args = ap.parse_args()
+    if args.num_predict is None:
+        args.num_predict = otg.predict_num_predict(args.modelo, 3, 7)
+
+    try:
+        requests.get(f"{args.host}/api/version", timeout=3).raise_for_status()
+    except requests.RequestException:
+        print(f"No se puede conectar con Ollama en {args.host}. Arráncalo antes de medir.")
+        return
+
+    pdfs = [pathlib.Path(p) for p in args.pdfs] or sorted((HERE.parent.parent / "iteracion").glob("*.pdf"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in pdfs:
+            doc = otg.pdf_to_doc(str(src), str(pathlib.Path(tmp) / f"{src.stem}.md"), strip_headers=True)
+            _prompt, budget = otg.fit_prompt(doc, 3, 7, args.modelo, args.num_predict, args.host)
+            # sitio para prompt + 2 respuestas (la del reintento va detrás del context)
+            num_ctx = budget["num_ctx"] * 2
+
+            print(f"\n{src.name}: ~{budget['prompt_tokens']} tokens de prompt, num_ctx {num_ctx}")
+            print(f"{'':>34} {'tokens':>8} {'prefill s':>9}")
+
+            notes = otg.serialize_notes(doc)  # mismos apuntes en los dos
+            flush_cache(args, num_ctx)
+            old = legacy_prompt(notes.text, 3, 7)
+            row("antes: 1ª llamada", call(old, args, num_ctx))
+            row("antes: reintento (prompt entero)", call(old + otg.STRICT_RETRY_RULE, args, num_ctx))
+            row("antes: otra petición (5+5)", call(legacy_prompt(notes.text, 5, 5), args, num_ctx))
+
+            flush_cache(args, num_ctx)
+            first = call(otg.build_prompt(notes, 3, 7), args, num_ctx)
+            row("ahora: 1ª llamada", first)
+            if first.get("context"):
+                row("ahora: reintento (context)", call(
+                    otg.STRICT_RETRY_FOLLOWUP, args, num_ctx, context=first["context"]
+                ))
+            else:
+                print(f"{'ahora: reintento (context)':>34}   (Ollama no devolvió context)")
+            row("ahora: otra petición (5+5)", call(otg.build_prompt(notes, 5, 5), args, num_ctx))
+
+
+if __name__ == "__main__":
+    main()
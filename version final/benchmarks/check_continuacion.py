@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Comprobación: unir una salida cortada con su continuación
+# ==========================================================
+#  Uso:
+#    py benchmarks/check_continuacion.py
+#
+#  Casos de join_continuation (salidas tal cual, sin strip): corte a
+#  mitad de palabra, el modelo vuelve a empezar la línea a medias,
+#  repite el final, o sigue en una línea nueva. Sale con código 1 si
+#  alguno no da lo esperado.
+# ==========================================================
+
+import pathlib
+import sys
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+CASES = [
+    # (salida cortada, continuación, esperado)
+    ("1. ¿Qué es el merca", "do de valores?", "1. ¿Qué es el mercado de valores?"),
+    ("1. V\n2.", "2. F\n3. F", "1. V\n2. F\n3. F"),
+    ("1. V\n2. ", "2. F\n3. F", "1. V\n2. F\n3. F"),
+    ("## Examen\n### Verdadero o f", "### Verdadero o falso\n1. (V/F) A", "## Examen\n### Verdadero o falso\n1. (V/F) A"),
+    ("1. ¿Qué es el", " mercado?", "1. ¿Qué es el mercado?"),
+    ("1. ¿Qué es el ", "mercado?", "1. ¿Qué es el mercado?"),
+    ("1. ¿Qué es el mercado", "el mercado de valores?", "1. ¿Qué es el mercado de valores?"),
+    ("1. ¿Pregunta uno?", "2. ¿Pregunta dos?", "1. ¿Pregunta uno?\n2. ¿Pregunta dos?"),
+    ("1. ¿Pregunta uno?\n", "2. ¿Pregunta dos?", "1. ¿Pregunta uno?\n2. ¿Pregunta dos?"),
+    ("## Respuestas\n1. V", "\n2. F", "## Respuestas\n1. V\n2. F"),
+    ("1. V", "   ", "1. V"),
+]
+
+
+def main():
+    bad = 0
+    for prev, more, want in CASES:
+        got = otg.join_continuation(prev, more)
+        ok = got == want
+        bad += not ok
+        print(f"{'OK ' if ok else 'MAL'} {prev!r} + {more!r}" + ("" if ok else f"\n    -> {got!r}\n    esperado {want!r}"))
+    if bad:
+        print(f"{bad} casos mal")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Comprobación: páginas de cada sección en un PDF con índice
+# ==========================================================
+#  Uso:
+#    py benchmarks/check_indice.py
+#    py benchmarks/check_indice.py libro_con_indice.pdf
+#
+#  Sin argumentos junta los PDFs de ../iteracion/*.pdf en uno solo y le
+#  pone un índice (un "Tema N" al principio de cada PDF). Convierte con
+#  pdf_to_doc y comprueba que las páginas de cada sección (page_start,
+#  page_end) son las del índice (outline_spans): si la siguiente sección
+#  empieza arriba de una página, esa página ya no es de esta.
+#  Sale con código 1 si alguna no cuadra.
+# ==========================================================
+
+import argparse
+import pathlib
+import sys
+import tempfile
+
+from pypdf import PdfReader, PdfWriter
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ollama_test_gen as otg  # noqa: E402
+
+
+def build_outlined_pdf(sources: list, dst: pathlib.Path):
+    """Une los PDFs y añade una entrada "Tema N" en la primera página de cada uno."""
+    writer = PdfWriter()
+    for n, src in enumerate(sources, 1):
+        first = len(writer.pages)
+        for page in PdfReader(str(src)).pages:
+            writer.add_page(page)
+        writer.add_outline_item(f"Tema {n}", first)
+    with open(dst, "wb") as f:
+        writer.write(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Páginas de cada sección frente al índice del PDF")
+    ap.add_argument("pdf", nargs="?", help="PDF con índice (por defecto uno hecho con ../iteracion/*.pdf)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.pdf:
+            path_pdf = pathlib.Path(args.pdf)
+        else:
+            path_pdf = pathlib.Path(tmp) / "con_indice.pdf"
+            build_outlined_pdf(sorted((HERE.parent.parent / "iteracion").glob("*.pdf")), path_pdf)
+
+        reader = PdfReader(str(path_pdf))
+        outline = otg.read_outline(reader)
+        doc = otg.pdf_to_doc(str(path_pdf), str(pathlib.Path(tmp) / "apuntes.md"))
+        # lo que da el índice (outline_spans, base 0 inclusive) -> páginas base 1
+        expected = {t: (a + 1, b + 1) for _lvl, t, a, b in otg.outline_spans(outline, len(reader.pages))}
+
+        bad = 0
+        print(f"{path_pdf.name}: {len(reader.pages)} páginas, {len(outline)} entradas en el índice")
+        print(f"{'sección':>30} {'esperado':>10} {'obtenido':>10}")
+        for sec in doc.sections:
+            if sec.title not in expected:
+                continue
+            want, got = expected[sec.title], (sec.page_start, sec.page_end)
+            bad += want != got
+            print(f"{sec.title[:30]:>30} {'%d-%d' % want:>10} {'%d-%d' % got:>10} {'' if want == got else '  <- MAL'}")
+    if bad:
+        print(f"{bad} secciones con páginas mal")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
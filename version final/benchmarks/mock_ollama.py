@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# ==========================================================
+#  Servidor falso de Ollama para los benchmarks del cliente HTTP
+# ==========================================================
+#  Uso (suelto):
+#    py benchmarks/mock_ollama.py --puerto 11435
+#
+#  O desde otro benchmark:
+#    server, host = start_mock()   # puerto libre, en un hilo
+#    ...
+#    server.shutdown()
+#
+#  Imita lo justo de /api/generate: responde en streaming (NDJSON,
+#  chunked, keep-alive) un examen con el nº de preguntas que pida el
+#  prompt ("Verdadero/Falso: N", "Respuesta corta: M"), un token por
+#  línea, y un último mensaje con done/done_reason/eval_count/context.
+#  /api/version y /api/show también contestan. Sin modelo ni GPU: lo
+#  que se mide es el coste del cliente (conexiones, parseo, progreso).
+# ==========================================================
+
+import argparse
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_exam(prompt: str, tokens: int = 0) -> list:
+    """Trozos ("tokens") de un examen con el formato que espera el script."""
+    m_vf = re.search(r"Verdadero/Falso: (\d+)", prompt)
+    m_short = re.search(r"Respuesta corta: (\d+)", prompt)
+    n_vf = int(m_vf.group(1)) if m_vf else 3
+    n_short = int(m_short.group(1)) if m_short else 7
+    total = n_vf + n_short
+
+    lines = ["## Examen"]
+    if n_vf:
+        lines.append("### Verdadero o falso")
+        lines += [f"{i}. (V/F) Enunciado número {i} sobre los apuntes." for i in range(1, n_vf + 1)]
+    if n_short:
+        lines.append("### Respuesta corta")
+        lines += [f"{i}. ¿Pregunta número {i} sobre los apuntes?" for i in range(n_vf + 1, total + 1)]
+    lines.append("## Respuestas")
+    lines += [f"{i}. V" for i in range(1, n_vf + 1)]
+    lines += [f"{i}. Respuesta corta número {i}." for i in range(n_vf + 1, total + 1)]
+    pieces = re.findall(r"\S+\s*", "\n".join(lines))
+    # relleno antes de "## Respuestas" si se pide una salida más larga
+    if tokens > len(pieces):
+        k = next(i for i, p in enumerate(pieces) if p.startswith("Respuestas"))
+        pieces[k - 1:k - 1] = ["relleno "] * (tokens - len(pieces))
+    return pieces
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # muchas conexiones a la vez en los benchmarks
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # como el servidor de Ollama (Go): sin Nagle, cada trozo sale al momento
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *_args):
+        pass
+
+    def _send_json(self, obj, status: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json({"version": "mock"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.requests += 1
+        if self.path == "/api/show":
+            self._send_json({"model_info": {"mock.context_length": 32768}})
+            return
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        options = body.get("options") or {}
+        limit = int(options.get("num_predict", 10 ** 9))
+        pieces = fake_exam(body.get("prompt", ""), self.server.tokens)
+        done_reason = "length" if limit < len(pieces) else "stop"
+        pieces = pieces[:max(limit, 0)]
+
+        if not body.get("stream", True):
+            self._send_json({
+                "response": "".join(pieces), "done": True, "done_reason": done_reason,
+                "total_duration": 1, "load_duration": 1, "eval_count": len(pieces),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(obj):
+            data = (json.dumps(obj) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        try:
+            for piece in pieces:
+                send({"model": body.get("model"), "response": piece, "done": False})
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+            n_prompt = len(body.get("prompt", "")) // 4
+            send({
+                "model": body.get("model"), "response": "", "done": True, "done_reason": done_reason,
+                "total_duration": 1, "load_duration": 1, "prompt_eval_count": n_prompt,
+                "prompt_eval_duration": 1, "eval_count": len(pieces), "eval_duration": 1,
+                "context": list(range(n_prompt + len(pieces))),
+            })
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente cortó el stream (cancelar / corte anticipado)
+
+
+def start_mock(port: int = 0, delay: float = 0.0, tokens: int = 0):
+    """
+    Arranca el servidor en un hilo. Devuelve (server, host).
+    - delay: segundos entre token y token (0 = lo más rápido posible)
+    - tokens: alarga cada examen hasta ~ese nº de tokens
+    """
+    server = MockOllamaServer(("127.0.0.1", port), MockOllamaHandler)
+    server.delay = delay
+    server.tokens = tokens
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Servidor falso de Ollama (solo para benchmarks)")
+    ap.add_argument("--puerto", type=int, default=11435)
+    ap.add_argument("--retardo", type=float, default=0.0, help="Segundos entre token y token")
+    ap.add_argument("--tokens", type=int, default=0, help="Alarga cada examen hasta ~N tokens")
+    args = ap.parse_args()
+
+    server, host = start_mock(args.puerto, args.retardo, args.tokens)
+    print(f"Ollama falso escuchando en {host} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
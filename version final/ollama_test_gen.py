@@ -29,17 +29,30 @@
 #  - Si no lo tienes, funciona igual con tkinter/ttk estándar.
 # ==========================================================
 
+import os
+import argparse
 import pathlib
 import sys
 import re
 import json
 import time
+import bisect
+import math
+import hashlib
+import importlib.util
+import tempfile
 import shutil
+import subprocess
 import threading
 import queue
+import asyncio
+import weakref
 import requests
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from textwrap import dedent
+from urllib.parse import urlsplit
 from pypdf import PdfReader
 
 import tkinter as tk
@@ -76,6 +89,14 @@ except Exception:
     tb = None                  # por si el resto del código referencia tb
     import tkinter.ttk as ttk  # fallback estándar
 
+# JSON rápido para leer el stream de Ollama (opcional):
+#   py -m pip install orjson
+# Sin él se usa el módulo json de la librería estándar.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # ============================
 #  CONFIG BASE
@@ -83,6 +104,36 @@ except Exception:
 # Host por defecto de Ollama
 DEFAULT_HOST = "http://localhost:11434"
 
+# Conexiones HTTP con Ollama (OllamaClient): una sesión por host con un
+# pool de conexiones abiertas (keep-alive) que comparten todos los hilos.
+# OLLAMA_POOL_SIZE ~ nº máximo de peticiones a la vez al mismo host.
+OLLAMA_POOL_SIZE = 16
+
+# Generaciones en streaming (AsyncOllamaClient, asyncio)
+# - Todas van por un mismo event loop; OLLAMA_MAX_STREAMS a la vez como mucho
+# - Cancelar se comprueba cada CANCEL_POLL_SECONDS aunque Ollama no mande nada
+OLLAMA_MAX_STREAMS = 64
+OLLAMA_CONNECT_TIMEOUT = 10
+CANCEL_POLL_SECONDS = 0.2
+# Bytes que se leen del socket de una vez (pueden ser muchas líneas NDJSON)
+OLLAMA_READ_SIZE = 65536
+
+# Avisos de progreso (on_progress) como mucho DEFAULT_PROGRESS_HZ veces
+# por segundo: los trozos que llegan entre medias se juntan en uno
+DEFAULT_PROGRESS_HZ = 10
+
+# Modelo cargado en memoria (keep_alive de Ollama)
+# - La GUI lo precarga en segundo plano al abrirse y al cambiar de modelo,
+#   así la primera generación no espera 10-40 s a que se cargue.
+# - keep_alive: cuánto lo deja Ollama en memoria tras la última petición
+#   ("5m", "30m", "2h"...; -1 = siempre; 0 = descargarlo al terminar)
+# - Se precarga con el último num_ctx pedido a ese modelo (se guarda en
+#   DEFAULT_CTX_PROFILE): si no coincide, Ollama recarga el modelo en la
+#   primera generación y la precarga no sirve de nada.
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_CTX_PROFILE = pathlib.Path.home() / ".ollama_test_gen" / "contexto.json"
+KEEP_ALIVE_OPTIONS = ["5m", "30m", "2h", "-1", "0"]
+
 # Modelos que quieres ofrecer en el combo (los puedes editar libremente)
 MODELOS_DISPONIBLES = [
     "qwen2.5-coder:7b",
@@ -95,12 +146,103 @@ MODELOS_DISPONIBLES = [
 MAX_PREGUNTAS = 10
 
 # Parámetros por defecto para /api/generate
-DEFAULT_NUM_PREDICT = 950
+# (num_predict se calcula en cada examen: predict_num_predict, ver
+# "num_predict adaptativo"; solo es fijo si se escribe en la GUI)
 DEFAULT_TEMPERATURE = 0.2
 
 # Tema por defecto (solo aplica si ttkbootstrap está instalado)
 DEFAULT_THEME = "flatly"
 
+# Extracción de texto del PDF en paralelo (procesos)
+# - 1 = modo secuencial clásico (una página detrás de otra)
+# - Con PDFs cortos no compensa arrancar procesos, por eso hay un mínimo de páginas
+DEFAULT_EXTRACT_WORKERS = max(1, min(4, os.cpu_count() or 1))
+MIN_PAGES_PARALLEL = 40
+PAGES_PER_TASK = 8
+
+# Caché de conversiones PDF -> Markdown (por contenido del PDF)
+# - Sube CONVERTER_VERSION cada vez que cambie la salida de pdf_to_md
+DEFAULT_CACHE_DIR = pathlib.Path.home() / ".ollama_test_gen" / "cache_md"
+DEFAULT_CACHE_MAX_MB = 200
+DEFAULT_PAGE_STORE_DIR = pathlib.Path.home() / ".ollama_test_gen" / "paginas"
+
+# Extractor de texto: "auto" mide la velocidad de cada extractor instalado
+# (una vez, sobre unas pocas páginas) y usa el más rápido de esta máquina
+DEFAULT_EXTRACTOR = "auto"
+DEFAULT_EXTRACTOR_PROFILE = pathlib.Path.home() / ".ollama_test_gen" / "extractores.json"
+EXTRACTOR_SAMPLE_PAGES = 5
+CONVERTER_VERSION = "md6"
+
+# Cabeceras/pies repetidos (títulos de curso, nº de página, centro...)
+# - Se miran las N primeras/últimas líneas con texto de cada página
+# - Se quitan si aparecen en >= 50% de las páginas (y al menos en 3)
+HEADER_EDGE_LINES = 3
+HEADER_MIN_FRACTION = 0.5
+HEADER_MIN_PAGES = 3
+
+# Páginas sin texto (PDF escaneado)
+# - Una página con menos de EMPTY_PAGE_CHARS letras/números cuenta como vacía
+# - Se aborta antes de llamar al modelo si el texto útil total no llega a
+#   MIN_USABLE_CHARS, o si >= SCANNED_PAGE_FRACTION de las páginas están vacías
+#   (salvo que el usuario haya pedido excluirlas)
+EMPTY_PAGE_CHARS = 40
+MIN_USABLE_CHARS = 400
+SCANNED_PAGE_FRACTION = 0.5
+
+# Presupuesto de tokens (ventana de contexto, num_ctx)
+# - Ollama corta el prompt EN SILENCIO si no cabe en num_ctx, y reservar
+#   de más gasta memoria (KV cache). Se pide lo justo para prompt + salida.
+# - El límite de cada modelo se pregunta a Ollama (/api/show); si no
+#   responde, se usa MODEL_CTX_LIMITS (o DEFAULT_MODEL_CTX).
+# - MAX_NUM_CTX es un tope por memoria aunque el modelo admita más.
+# - num_ctx se redondea a potencias de 2: cada num_ctx distinto obliga a
+#   Ollama a recargar el modelo, así se repite el mismo entre ejecuciones.
+MODEL_CTX_LIMITS = {
+    "qwen2.5-coder:7b": 32768,
+    "mistral:instruct": 32768,
+    "llama3:latest": 8192,
+    "deepseek-r1:latest": 131072,
+}
+DEFAULT_MODEL_CTX = 8192
+MAX_NUM_CTX = 16384
+MIN_NUM_CTX = 2048
+CTX_SAFETY_MARGIN = 0.10
+DEFAULT_TOKEN_PROFILE = pathlib.Path.home() / ".ollama_test_gen" / "tokens.json"
+
+# num_predict adaptativo
+# - Se guardan los tokens de salida reales (eval_count) de cada examen
+#   válido por modelo y nº de preguntas de cada tipo, y se ajusta
+#   tokens ~ base + vf * n_vf + short * n_short (últimos OUTPUT_HISTORY).
+# - OUTPUT_TOKENS_PRIOR es el punto de partida de un modelo sin historial;
+#   OUTPUT_PRIOR_WEIGHT, cuánto pesa frente a los datos.
+# - num_predict = predicción + NUM_PREDICT_MARGIN, entre MIN y MAX.
+DEFAULT_OUTPUT_PROFILE = pathlib.Path.home() / ".ollama_test_gen" / "salida.json"
+OUTPUT_TOKENS_PRIOR = {"base": 50, "vf": 35, "short": 85}
+OUTPUT_PRIOR_WEIGHT = 3.0
+OUTPUT_HISTORY = 40
+NUM_PREDICT_MARGIN = 0.25
+MIN_NUM_PREDICT = 200
+MAX_NUM_PREDICT = 4096
+
+# Examen por secciones (map-reduce)
+# - Los apuntes se parten en hasta MAP_MAX_PARTS trozos (por temas, o por
+#   páginas si no hay títulos) y se pide un mini-examen de cada uno
+# - DEFAULT_MAP_CONCURRENCY peticiones a la vez (Ollama atiende en paralelo
+#   hasta OLLAMA_NUM_PARALLEL; más que eso solo hace cola)
+# - Cada trozo recibe num_predict proporcional a sus preguntas + un extra
+#   para los títulos del formato
+MAP_MAX_PARTS = 5
+DEFAULT_MAP_CONCURRENCY = 2
+MAP_PART_EXTRA_PREDICT = 120
+
+# Regeneración parcial: si solo fallan unas pocas preguntas (como mucho
+# esta fracción del total), se piden SOLO esas en vez del examen entero
+PARTIAL_MAX_FRACTION = 0.5
+
+# Compresión extractiva de apuntes (opcional, antes del prompt)
+# - Fracción de tokens que se conserva (0.6 = se queda el 60%)
+DEFAULT_COMPRESS_KEEP = 0.6
+
 
 # ============================
 #  Helpers GUI (seguro)
@@ -185,258 +327,3266 @@ def is_bullet(line: str) -> bool:
     """
     return bool(re.match(r"^\s*[•\-\*]\s+\S+", line))
 
-def pdf_to_md(path_pdf: str, path_md: str) -> str:
+# ----------------------------------------------------------
+#  Extractores de texto (backends)
+# ----------------------------------------------------------
+#  pypdf es el de siempre (puro Python, siempre disponible).
+#  Si están instalados, se pueden usar otros más rápidos:
+#   - pdfminer.six   (py -m pip install pdfminer.six)
+#   - pdftotext      (binario de poppler-utils / xpdf en el PATH)
+#
+#  Todos tienen la misma interfaz:
+#   - available() -> bool          (¿se puede usar en esta máquina?)
+#   - Clase(path_pdf).extract(indices) -> [texto, ...]  (índices base 0)
+# ----------------------------------------------------------
+class PypdfExtractor:
+    """Extractor por defecto: pypdf.PdfReader.extract_text()."""
+
+    name = "pypdf"
+
+    @staticmethod
+    def available() -> bool:
+        return True
+
+    def __init__(self, path_pdf: str):
+        self.reader = PdfReader(path_pdf)
+
+    def extract(self, indices: list) -> list:
+        return [(self.reader.pages[i].extract_text() or "") for i in indices]
+
+
+class PdfminerExtractor:
+    """Extractor con pdfminer.six (solo si está instalado)."""
+
+    name = "pdfminer"
+
+    @staticmethod
+    def available() -> bool:
+        return importlib.util.find_spec("pdfminer") is not None
+
+    def __init__(self, path_pdf: str):
+        self.path_pdf = path_pdf
+
+    def extract(self, indices: list) -> list:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        texts = []
+        # extract_pages devuelve las páginas pedidas en orden del documento
+        for layout in extract_pages(self.path_pdf, page_numbers=set(indices)):
+            texts.append("".join(el.get_text() for el in layout if isinstance(el, LTTextContainer)))
+        return texts
+
+
+class PdftotextExtractor:
+    """Extractor con el binario `pdftotext` (poppler), solo si está en el PATH."""
+
+    name = "pdftotext"
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("pdftotext") is not None
+
+    def __init__(self, path_pdf: str):
+        self.path_pdf = path_pdf
+
+    def extract(self, indices: list) -> list:
+        texts = []
+        # Una llamada por tramo de páginas consecutivas
+        k = 0
+        while k < len(indices):
+            j = k
+            while j + 1 < len(indices) and indices[j + 1] == indices[j] + 1:
+                j += 1
+            first, last = indices[k] + 1, indices[j] + 1
+            out = subprocess.run(
+                ["pdftotext", "-q", "-enc", "UTF-8", "-f", str(first), "-l", str(last), self.path_pdf, "-"],
+                capture_output=True,
+                check=True,
+            ).stdout.decode("utf-8", errors="replace")
+            # pdftotext separa las páginas con \f (salto de página)
+            pages = out.split("\f")
+            texts.extend((pages + [""] * (last - first + 1))[: last - first + 1])
+            k = j + 1
+        return texts
+
+
+EXTRACTORES = {
+    cls.name: cls for cls in (PypdfExtractor, PdfminerExtractor, PdftotextExtractor)
+}
+
+def available_extractors() -> list:
+    """Nombres de los extractores que funcionan en esta máquina."""
+    return [name for name, cls in EXTRACTORES.items() if cls.available()]
+
+def _extract_pages_worker(path_pdf: str, indices: list, backend: str = "pypdf") -> list:
     """
-    Convierte un PDF a Markdown sencillo.
+    Trabajo de un proceso hijo: abre el PDF con SU PROPIO extractor y
+    saca el texto de las páginas indicadas (índices base 0).
 
-    - Extrae el texto página por página con pypdf.
-    - Inserta comentarios <!-- page: N --> para mantener referencia.
-    - Reconstituye párrafos (une líneas) y convierte:
-      - títulos detectados -> #, ##, ### ...
-      - bullets -> "- item"
+    Motivo:
+    - Un PdfReader no se puede compartir entre procesos.
+    - Abrir el PDF en cada proceso es barato comparado con extract_text().
 
-    Si el PDF no tiene texto seleccionable (escaneado), puede salir muy corto.
+    Si el extractor elegido falla (binario roto, PDF raro...), se
+    vuelve a pypdf para esas páginas en vez de abortar.
     """
-    pdf_path = pathlib.Path(path_pdf)
-    if not pdf_path.exists():
-        raise FileNotFoundError(f"No existe el PDF: {path_pdf}")
+    cls = EXTRACTORES.get(backend, PypdfExtractor)
+    try:
+        return cls(path_pdf).extract(indices)
+    except Exception:
+        if cls is PypdfExtractor:
+            raise
+        return PypdfExtractor(path_pdf).extract(indices)
+
+def measure_extractor(backend: str, path_pdf: str, indices: list) -> float:
+    """Páginas/segundo de un extractor sobre unas páginas concretas."""
+    t0 = time.perf_counter()
+    EXTRACTORES[backend](path_pdf).extract(indices)
+    secs = time.perf_counter() - t0
+    return len(indices) / secs if secs > 0 else float("inf")
+
+def choose_extractor(path_pdf: str, profile_path=None) -> str:
+    """
+    Elige el extractor más rápido EN ESTA MÁQUINA (modo "auto").
+
+    - Las velocidades medidas se guardan en profile_path (JSON), así que
+      solo se mide una vez por extractor (sobre unas pocas páginas del
+      primer PDF que se convierta).
+    - Si falta un extractor, simplemente no compite.
+    """
+    profile_path = pathlib.Path(profile_path or DEFAULT_EXTRACTOR_PROFILE)
+    try:
+        speeds = json.loads(profile_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        speeds = {}
+
+    names = available_extractors()
+    missing = [name for name in names if name not in speeds]
+    if missing:
+        n_pages = len(PdfReader(path_pdf).pages)
+        sample = list(range(min(EXTRACTOR_SAMPLE_PAGES, n_pages)))
+        for name in missing:
+            try:
+                speeds[name] = measure_extractor(name, path_pdf, sample) if sample else 0.0
+            except Exception:
+                speeds[name] = 0.0
+        try:
+            _atomic_write_text(profile_path, json.dumps(speeds, indent=2))
+        except OSError:
+            pass
+
+    return max(names, key=lambda name: speeds.get(name, 0.0))
+
+def _split_page_ranges(n_pages: int, n_chunks: int) -> list:
+    """
+    Parte [0, n_pages) en n_chunks rangos contiguos de tamaño parecido.
+    Ej: (10, 3) -> [(0, 4), (4, 7), (7, 10)]
+    """
+    n_chunks = max(1, min(n_chunks, n_pages))
+    size, extra = divmod(n_pages, n_chunks)
+    ranges = []
+    start = 0
+    for k in range(n_chunks):
+        end = start + size + (1 if k < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def iter_pages_text(path_pdf: str, workers: int = 1, indices: list = None, backend: str = "pypdf"):
+    """
+    Genera (num_pagina, texto) en orden, con num_pagina empezando en 1.
+
+    - indices: lista opcional de páginas (base 0, ordenadas) a extraer.
+      Por defecto, todas.
+    - backend: extractor a usar (ver EXTRACTORES).
+    - workers <= 1 (o pocas páginas): extracción secuencial en este proceso.
+    - workers > 1: reparte tandas de páginas entre procesos
+      (ProcessPoolExecutor) y las devuelve en orden de página.
+
+    Se crean más tandas que procesos (al menos 4 por proceso y como mucho
+    PAGES_PER_TASK páginas cada una) para repartir mejor la carga: hay
+    páginas (tablas, fórmulas) mucho más lentas que otras.
+    Solo se mantienen en vuelo unas pocas tandas a la vez para no
+    acumular todo el documento en memoria.
+    """
+    if indices is None:
+        indices = list(range(len(PdfReader(path_pdf).pages)))
+
+    if workers <= 1 or len(indices) < MIN_PAGES_PARALLEL:
+        if backend == "pypdf":
+            reader = PdfReader(path_pdf)
+            for i in indices:
+                yield i + 1, (reader.pages[i].extract_text() or "")
+            return
+        # Otros extractores: por tandas (pdftotext lanza un proceso por llamada)
+        for a in range(0, len(indices), PAGES_PER_TASK):
+            batch = indices[a:a + PAGES_PER_TASK]
+            for i, text in zip(batch, _extract_pages_worker(path_pdf, batch, backend)):
+                yield i + 1, text
+        return
+
+    n_chunks = max(workers * 4, -(-len(indices) // PAGES_PER_TASK))
+    batches = [indices[a:b] for a, b in _split_page_ranges(len(indices), n_chunks)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        next_batch = 0
+        max_in_flight = workers * 2
+
+        while next_batch < len(batches) or pending:
+            # Rellenar la ventana de trabajos en vuelo
+            while next_batch < len(batches) and len(pending) < max_in_flight:
+                batch = batches[next_batch]
+                pending.append((batch, pool.submit(_extract_pages_worker, path_pdf, batch, backend)))
+                next_batch += 1
+
+            # Consumir SIEMPRE la tanda más antigua => orden de página garantizado
+            batch, fut = pending.pop(0)
+            for i, text in zip(batch, fut.result()):
+                yield i + 1, text
+
+def page_fingerprint(page) -> str:
+    """
+    Huella de una página: SHA-256 de su content stream (ya descomprimido)
+    y de los Form XObjects que dibuja (muchos PDFs meten el texto ahí).
+
+    Leer el content stream es mucho más barato que extract_text():
+    no hay que interpretar fuentes ni posiciones.
+    """
+    h = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(contents.get_data())
+
+    try:
+        xobjects = page["/Resources"]["/XObject"]
+    except (KeyError, TypeError):
+        xobjects = {}
+    for name in sorted(xobjects):
+        xobj = xobjects[name].get_object()
+        if xobj.get("/Subtype") == "/Form":
+            h.update(name.encode("utf-8"))
+            h.update(xobj.get_data())
+
+    return h.hexdigest()
+
+# ----------------------------------------------------------
+#  Pipeline por streaming (memoria ~ 1 página)
+# ----------------------------------------------------------
+#  texto de página -> líneas normalizadas -> eventos (título/viñeta/párrafo)
+#  -> trozos Markdown -> disco
+#
+#  Cada etapa es un generador: nunca se junta el documento entero
+#  en un solo string. La salida es idéntica byte a byte a la del
+#  conversor clásico (join global + fix_hyphenation + re.sub final).
+# ----------------------------------------------------------
+def iter_md_lines(pages, outline: dict = None):
+    """
+    Etapa 1: (num_pagina, texto) -> eventos de línea.
+
+    Genera:
+    - ("page", N)     al empezar cada página
+    - ("line", texto) por cada línea de la página
+      (o eventos "outline"/"plain" si el PDF tiene índice, ver
+      iter_page_events; outline = outline_by_page(...))
+
+    La unión de guiones (fix_hyphenation) se hace por página. Entre dos
+    páginas siempre va el marcador <!-- page: N --> rodeado de líneas
+    vacías, así que un "acti-" al final de una página nunca se unía con
+    la siguiente en el conversor clásico: hacerlo por página da
+    exactamente el mismo resultado sin tener todo el texto en memoria.
+    """
+    for num, text in pages:
+        yield ("page", num)
+        entries = None if outline is None else outline.get(num - 1, [])
+        yield from iter_page_events(list(iter_page_lines(text)), entries)
+
+def iter_page_lines(text: str):
+    """Líneas de UNA página ya normalizadas y con los guiones unidos."""
+    text = fix_hyphenation(normalize_newlines(text))
+    yield from text.split("\n")
+
+def iter_page_events(lines: list, entries: list = None):
+    """
+    Eventos de línea de UNA página.
+
+    - entries None (el PDF no tiene índice): ("line", texto) y los
+      títulos se adivinan con is_heading.
+    - entries = [(nivel, título), ...] del índice del PDF para esta
+      página: cada título sale como ("outline", (nivel, título)) y el
+      resto como ("plain", texto), SIN heurísticas de títulos.
+      Si el título aparece como línea de la página, va en su sitio
+      (sustituye a esa línea); si no, va justo detrás del título
+      anterior del índice (o al principio de la página).
+    """
+    if entries is None:
+        for raw in lines:
+            yield ("line", raw)
+        return
+
+    # Buscar la línea de cada título, siempre por debajo del anterior
+    # encontrado, para respetar el orden del índice
+    norm = [_norm_title(line) for line in lines]
+    line_of = {}
+    start = 0
+    for k, (_lvl, title) in enumerate(entries):
+        target = _norm_title(title)
+        for i in range(start, len(norm)):
+            if norm[i] == target:
+                line_of[k] = i
+                start = i + 1
+                break
+
+    # Títulos agrupados por la línea detrás de la que van (-1 = arriba)
+    after = {}
+    anchor = -1
+    for k, entry in enumerate(entries):
+        if k in line_of:
+            anchor = line_of[k]
+        after.setdefault(anchor, []).append(entry)
+
+    for entry in after.get(-1, []):
+        yield ("outline", entry)
+    for i, raw in enumerate(lines):
+        group = after.get(i)
+        if group is None:
+            yield ("plain", raw)
+            continue
+        # group[0] es el título que estaba en esta línea
+        for entry in group:
+            yield ("outline", entry)
 
-    reader = PdfReader(str(pdf_path))
+def page_blocks(lines: list, entries: list = None) -> list:
+    """
+    Bloques Markdown de UNA página (sin su marcador <!-- page -->),
+    a partir de sus líneas (ver iter_page_lines) y, si el PDF tiene
+    índice, de sus títulos (ver iter_page_events).
 
-    full_text = []
-    for i, page in enumerate(reader.pages, start=1):
-        text = page.extract_text() or ""
-        text = normalize_newlines(text)
-        full_text.append(f"\n\n<!-- page: {i} -->\n\n")
-        full_text.append(text)
+    Los párrafos nunca cruzan de página, así que los bloques de una
+    página solo dependen de sus líneas: se pueden guardar y reutilizar
+    tal cual (ver PageStore).
+    """
+    return list(iter_md_blocks(iter_page_events(lines, entries)))
 
-    text = "".join(full_text)
-    text = fix_hyphenation(text)
+# ----------------------------------------------------------
+#  Índice (outline / marcadores) del PDF
+# ----------------------------------------------------------
+#  Si el PDF trae índice, los títulos salen de ahí (nivel + página)
+#  en vez de adivinarlos línea a línea con is_heading: es más fiable
+#  y da una estructura de secciones limpia.
+# ----------------------------------------------------------
+def _norm_title(text: str) -> str:
+    """Título comparable: espacios colapsados y minúsculas."""
+    return " ".join(text.split()).casefold()
 
-    lines = text.split("\n")
+def read_outline(reader) -> list:
+    """
+    Lee el índice del PDF sin tocar el contenido de las páginas.
+    Devuelve [(nivel, título, índice_página_base_0), ...] en orden.
+    Si no hay índice (o está roto), devuelve [].
+    """
     out = []
+
+    def walk(items, depth):
+        for item in items:
+            # pypdf: una lista anidada son los hijos de la entrada anterior
+            if isinstance(item, list):
+                walk(item, depth + 1)
+                continue
+            title = " ".join(str(getattr(item, "title", "") or "").split())
+            try:
+                page_idx = reader.get_destination_page_number(item)
+            except Exception:
+                continue
+            if title and page_idx is not None and page_idx >= 0:
+                out.append((min(depth + 1, 4), title, page_idx))
+
+    try:
+        walk(reader.outline, 0)
+    except Exception:
+        return []
+    return out
+
+def outline_by_page(outline: list) -> dict:
+    """[(nivel, título, página)] -> {página: [(nivel, título), ...]}"""
+    by_page = {}
+    for lvl, title, page_idx in outline:
+        by_page.setdefault(page_idx, []).append((lvl, title))
+    return by_page
+
+# ----------------------------------------------------------
+#  Selección de páginas / temas
+# ----------------------------------------------------------
+#  Para un examen de los temas 3-5 de un libro de 600 páginas no hace
+#  falta extraer el libro entero: el nº de páginas y el índice se leen
+#  sin tocar el contenido, y solo se extraen las páginas elegidas.
+# ----------------------------------------------------------
+def outline_spans(outline: list, n_pages: int) -> list:
+    """
+    [(nivel, título, página)] -> [(nivel, título, primera, última)]
+    (base 0, inclusive). Una sección llega hasta la página anterior a la
+    siguiente entrada de su mismo nivel o superior.
+    """
+    spans = []
+    for k, (lvl, title, start) in enumerate(outline):
+        end = n_pages - 1
+        for lvl2, _title2, start2 in outline[k + 1:]:
+            if lvl2 <= lvl:
+                end = max(start, start2 - 1)
+                break
+        spans.append((lvl, title, start, min(end, n_pages - 1)))
+    return spans
+
+def parse_page_selection(spec: str, n_pages: int, outline: list = None) -> list:
+    """
+    Traduce lo que escribe el usuario a índices de página (base 0,
+    ordenados y sin repetir). Partes separadas por "," o ";":
+
+    - "12"      página 12 (base 1, como en el visor de PDF)
+    - "3-5"     páginas 3 a 5, ambas incluidas ("40-" = hasta el final)
+    - "Tema 4"  cualquier otro texto: las secciones del índice del PDF
+                cuyo título lo contiene (sin distinguir mayúsculas)
+
+    Lanza ValueError si una parte no se entiende o se sale del PDF.
+    """
+    spans = outline_spans(outline or [], n_pages)
+    picked = set()
+    for part in re.split(r"[,;]", spec or ""):
+        part = part.strip()
+        if not part:
+            continue
+
+        m = re.fullmatch(r"(\d+)\s*(?:-\s*(\d*))?", part)
+        if m:
+            first = int(m.group(1))
+            last = first if m.group(2) is None else (int(m.group(2)) if m.group(2) else n_pages)
+            if not 1 <= first <= last <= n_pages:
+                raise ValueError(f"Rango de páginas fuera del PDF (1-{n_pages}): '{part}'")
+            picked.update(range(first - 1, last))
+            continue
+
+        wanted = _norm_title(part)
+        found = [(a, b) for _lvl, title, a, b in spans if wanted in _norm_title(title)]
+        if not found:
+            if not spans:
+                raise ValueError(f"'{part}' no es un rango de páginas y el PDF no tiene índice.")
+            raise ValueError(f"Ninguna sección del índice contiene '{part}'.")
+        for a, b in found:
+            picked.update(range(a, b + 1))
+
+    return sorted(picked)
+
+# ----------------------------------------------------------
+#  Cabeceras / pies repetidos
+# ----------------------------------------------------------
+#  Los PDFs sacados de diapositivas repiten en cada página el título
+#  del curso, el nombre del centro y el número de página. Eso no
+#  aporta nada al examen y cuesta tokens de prompt en cada petición.
+#
+#  - Solo se miran las primeras/últimas HEADER_EDGE_LINES líneas con
+#    texto de cada página (donde viven cabeceras y pies).
+#  - Dos líneas "son la misma" si solo cambian los números
+#    ("Página 3 de 40" ~ "Página 4 de 40").
+#  - Se quitan las que salen en al menos HEADER_MIN_FRACTION de las
+#    páginas (y en HEADER_MIN_PAGES como mínimo).
+# ----------------------------------------------------------
+def _line_signature(line: str) -> str:
+    """Forma canónica de una línea: sin espacios extremos, dígitos -> #, minúsculas."""
+    return re.sub(r"\d+", "#", line.strip()).casefold()
+
+def _edge_indices(lines: list) -> list:
+    """
+    Índices de las primeras y últimas líneas con texto de una página.
+    En páginas cortas se miran menos líneas para no tratar todo el
+    contenido como "borde".
+    """
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    k = min(HEADER_EDGE_LINES, max(1, len(filled) // 4))
+    return sorted(set(filled[:k] + filled[-k:]))
+
+def edge_signatures(lines: list) -> set:
+    """Firmas de las líneas de borde (cabecera/pie) de una página."""
+    return {_line_signature(lines[i]) for i in _edge_indices(lines)}
+
+def detect_repeated_lines(edge_sets: list) -> set:
+    """
+    Recibe las firmas de borde de cada página y devuelve las que se
+    repiten en suficientes páginas como para ser cabecera/pie.
+    """
+    n_pages = len(edge_sets)
+    if n_pages < HEADER_MIN_PAGES:
+        return set()
+
+    counts = {}
+    for sigs in edge_sets:
+        for sig in sigs:
+            counts[sig] = counts.get(sig, 0) + 1
+
+    needed = max(HEADER_MIN_PAGES, HEADER_MIN_FRACTION * n_pages)
+    return {sig for sig, c in counts.items() if c >= needed}
+
+def strip_page_lines(lines: list, repeated: set) -> tuple:
+    """
+    Quita de una página las líneas de borde cuya firma está en `repeated`.
+    Devuelve (lineas_que_quedan, lineas_quitadas).
+    """
+    if not repeated:
+        return lines, []
+    drop = {i for i in _edge_indices(lines) if _line_signature(lines[i]) in repeated}
+    if not drop:
+        return lines, []
+    kept = [line for i, line in enumerate(lines) if i not in drop]
+    removed = [lines[i] for i in sorted(drop)]
+    return kept, removed
+
+def _note_removed(info: dict, removed: list):
+    """Acumula en info las estadísticas de líneas quitadas."""
+    if not removed:
+        return
+    info["header_lines_removed"] = info.get("header_lines_removed", 0) + len(removed)
+    info["header_chars_removed"] = info.get("header_chars_removed", 0) + sum(len(x) for x in removed)
+    info["header_tokens_removed"] = info.get("header_tokens_removed", 0) + sum(estimate_tokens(x) for x in removed)
+    samples = info.setdefault("header_samples", [])
+    for line in removed:
+        line = line.strip()
+        sig = _line_signature(line)
+        if len(samples) < 3 and all(_line_signature(x) != sig for x in samples):
+            samples.append(line)
+
+def iter_stripped_md_lines(pages, info: dict, outline: dict = None):
+    """
+    Igual que iter_md_lines, pero quitando cabeceras/pies repetidos.
+
+    Hace falta ver TODAS las páginas antes de saber qué se repite, así
+    que se hacen dos pasadas sin tener el documento en memoria:
+    1) Las líneas de cada página se vuelcan a un archivo temporal y se
+       guardan solo sus firmas de borde (poca cosa).
+    2) Se detectan las repetidas y se relee el temporal página a página.
+    """
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        edge_sets = []
+        for num, text in pages:
+            lines = list(iter_page_lines(text))
+            edge_sets.append(edge_signatures(lines))
+            spool.write(json.dumps([num, lines], ensure_ascii=False) + "\n")
+
+        repeated = detect_repeated_lines(edge_sets)
+        spool.seek(0)
+        for row in spool:
+            num, lines = json.loads(row)
+            kept, removed = strip_page_lines(lines, repeated)
+            _note_removed(info, removed)
+            yield ("page", num)
+            entries = None if outline is None else outline.get(num - 1, [])
+            yield from iter_page_events(kept, entries)
+
+def iter_md_blocks(line_events):
+    """
+    Etapa 2: eventos de línea -> bloques Markdown.
+
+    Genera (tipo, texto_md) con tipo en:
+    - "page"    -> "<!-- page: N -->"
+    - "heading" -> "## Título"
+    - "bullet"  -> "- item"
+    - "para"    -> párrafo ya unido en una línea
+    - "blank"   -> "" (separador)
+
+    Además de ("page", N) y ("line", texto) acepta:
+    - ("plain", texto): línea en la que NO se buscan títulos
+    - ("outline", (nivel, título)): título del índice del PDF
+    - ("blocks", lista): bloques ya calculados de una página
+      (ver page_blocks), que se insertan tal cual.
+
+    Solo guarda en memoria el párrafo en curso (que nunca cruza
+    de página, porque el marcador lo corta).
+    """
     paragraph = []
 
     def flush_paragraph():
         """Vuelca el párrafo acumulado en una sola línea (Markdown)."""
-        nonlocal paragraph
         if paragraph:
-            out.append(" ".join(paragraph).strip())
-            out.append("")
-            paragraph = []
+            text = " ".join(paragraph).strip()
+            paragraph.clear()
+            yield ("para", text)
+            yield ("blank", "")
+
+    for kind, value in line_events:
+        # marcador de página => siempre va en su propio bloque
+        if kind == "page":
+            yield from flush_paragraph()
+            yield ("page", f"<!-- page: {value} -->")
+            yield ("blank", "")
+            continue
+
+        # bloques ya hechos (página reutilizada)
+        if kind == "blocks":
+            yield from flush_paragraph()
+            yield from value
+            continue
+
+        # título sacado del índice del PDF
+        if kind == "outline":
+            lvl, title = value
+            yield from flush_paragraph()
+            yield ("heading", "#" * lvl + " " + title)
+            yield ("blank", "")
+            continue
 
-    for raw in lines:
-        line = raw.strip()
+        line = value.strip()
 
         # línea vacía => cortar párrafo
         if not line:
-            flush_paragraph()
+            yield from flush_paragraph()
             continue
 
-        # encabezado detectado
-        lvl = is_heading(line)
+        # encabezado detectado (solo si el PDF no trae índice)
+        lvl = is_heading(line) if kind == "line" else None
         if lvl:
-            flush_paragraph()
-            out.append("#" * lvl + " " + line)
-            out.append("")
+            yield from flush_paragraph()
+            yield ("heading", "#" * lvl + " " + line)
+            yield ("blank", "")
             continue
 
         # bullet detectado
         if is_bullet(line):
-            flush_paragraph()
-            line = re.sub(r"^\s*[•\-\*]\s+", "- ", line)
-            out.append(line)
+            yield from flush_paragraph()
+            yield ("bullet", re.sub(r"^\s*[•\-\*]\s+", "- ", line))
+            continue
+
+        # línea normal => acumular
+        paragraph.append(line)
+
+    yield from flush_paragraph()
+
+def iter_md_chunks(blocks):
+    """
+    Etapa 3: bloques -> trozos de texto listos para escribir.
+
+    Equivale a: "\\n".join(bloques) + re.sub(r"\\n{3,}", "\\n\\n") + strip() + "\\n"
+    pero sin construir el string completo:
+    - Entre dos bloques con contenido van 1 o 2 saltos (nunca más).
+    - Los "blank" del principio y del final desaparecen (el strip()).
+
+    Genera (tipo, trozo): el tipo del bloque permite a quien escribe
+    saber dónde empieza cada página (mapa de páginas).
+    """
+    started = False
+    blanks = 0
+    for kind, text in blocks:
+        if kind == "blank":
+            blanks += 1
+            continue
+        if started:
+            yield kind, "\n" * min(blanks + 1, 2) + text
+        else:
+            yield kind, text
+            started = True
+        blanks = 0
+    yield "end", "\n"
+
+def write_md_stream(pages, path_md: str, line_events=None):
+    """
+    Ejecuta el pipeline completo y escribe el Markdown en disco
+    trozo a trozo.
+
+    - pages: iterable (num_pagina, texto)
+    - line_events: alternativa a pages, eventos ya preparados
+      para iter_md_blocks (lo usa la reextracción incremental)
+
+    Devuelve un DocBuilder con los offsets de páginas, títulos y
+    párrafos (solo enteros: el texto no se guarda en memoria).
+    Con builder.build(texto) se obtiene el Documento.
+    """
+    n_chars = 0
+    builder = DocBuilder()
+    with open(path_md, "w", encoding="utf-8") as f:
+        if line_events is None:
+            line_events = iter_md_lines(pages)
+        for kind, chunk in iter_md_chunks(iter_md_blocks(line_events)):
+            if kind != "end":
+                # el trozo es "\n"* + texto del bloque
+                start = n_chars + len(chunk) - len(chunk.lstrip("\n"))
+                builder.add(kind, start, n_chars + len(chunk), chunk)
+            f.write(chunk)
+            n_chars += len(chunk)
+    return builder
+
+def _iter_incremental_events(
+    path_pdf: str,
+    workers: int,
+    page_store,
+    info: dict,
+    strip_headers: bool,
+    skip_empty: bool,
+    backend: str,
+    indices: list = None,
+    reader=None,
+):
+    """
+    Eventos para iter_md_blocks reutilizando páginas que no han cambiado.
+
+    1) Calcula la huella de cada página (content stream, sin extraer texto).
+    2) Las huellas que ya estaban en PageStore (versión anterior del PDF)
+       se reutilizan: sus bloques se insertan tal cual.
+    3) Solo las páginas nuevas/cambiadas pasan por extract_text(),
+       normalize_newlines y la detección de títulos.
+    4) Al terminar, PageStore queda con las páginas de ESTA versión.
+
+    Con strip_headers (o con índice en el PDF), una página reutilizada
+    solo se vuelve a trocear en bloques si cambian las cabeceras/pies
+    que hay que quitarle o sus títulos del índice (sus líneas están
+    guardadas, así que tampoco se reextrae).
+
+    Con indices (selección de páginas) solo se miran esas páginas y lo
+    guardado del resto del PDF se conserva para la próxima vez.
+    """
+    if reader is None:
+        reader = PdfReader(path_pdf)
+    if indices is None:
+        indices = range(len(reader.pages))
+    fingerprints = {i: page_fingerprint(reader.pages[i]) for i in indices}
+    outline = outline_by_page(read_outline(reader)) or None
+    if outline is not None:
+        outline = {i: v for i, v in outline.items() if i in fingerprints} or None
+    info["outline_sections"] = sum(len(v) for v in outline.values()) if outline else 0
+
+    doc_id = page_store.doc_id(path_pdf, backend)
+    previous = page_store.load(doc_id)
+    todo = [i for i, fp in fingerprints.items() if fp not in previous]
+
+    info["pages_reused"] = len(fingerprints) - len(todo)
+    info["pages_extracted"] = len(todo)
+
+    new_lines = {}
+    for num, text in iter_pages_text(path_pdf, workers=workers, indices=todo, backend=backend):
+        new_lines[fingerprints[num - 1]] = list(iter_page_lines(text))
+
+    def lines_of(fp):
+        return previous[fp]["lines"] if fp in previous else new_lines[fp]
+
+    repeated = set()
+    if strip_headers:
+        repeated = detect_repeated_lines([edge_signatures(lines_of(fp)) for fp in fingerprints.values()])
+
+    current = {}
+    for i, fp in fingerprints.items():
+        lines = lines_of(fp)
+        kept, removed = strip_page_lines(lines, repeated)
+        _note_removed(info, removed)
+
+        # títulos del índice para esta página (listas: así se comparan con el JSON)
+        entries = None if outline is None else [list(e) for e in outline.get(i, [])]
+
+        entry = previous.get(fp)
+        if entry is not None and entry["removed"] == removed and entry.get("outline") == entries:
+            blocks = entry["blocks"]
+        else:
+            blocks = page_blocks(kept, entries)
+
+        current[fp] = {"lines": lines, "removed": removed, "outline": entries, "blocks": blocks}
+        if not _note_page_density(info, i + 1, "\n".join(lines)) and skip_empty:
+            continue
+        yield ("page", i + 1)
+        yield ("blocks", blocks)
+
+    if len(fingerprints) < len(reader.pages):
+        current = {**previous, **current}
+    page_store.save(doc_id, current)
+
+# ----------------------------------------------------------
+#  Páginas sin texto (escaneadas / solo imagen)
+# ----------------------------------------------------------
+class TextoInsuficiente(Exception):
+    """
+    El PDF no tiene texto suficiente para hacer un examen
+    (típico de PDFs escaneados). Se lanza ANTES de llamar al modelo.
+    """
+    pass
+
+def _usable_chars(text: str) -> int:
+    """Caracteres "útiles" de un texto: letras y números."""
+    return len(re.sub(r"\W+", "", text))
+
+def _note_page_density(info: dict, num: int, text: str) -> bool:
+    """
+    Cuenta el texto útil de una página (en la misma pasada de extracción)
+    y la apunta en info["empty_pages"] si casi no tiene texto.
+    Devuelve True si la página tiene texto suficiente.
+    """
+    n = _usable_chars(text)
+    empty = info.setdefault("empty_pages", [])
+    if n < EMPTY_PAGE_CHARS:
+        empty.append(num)
+        return False
+    info["usable_chars"] = info.get("usable_chars", 0) + n
+    return True
+
+def iter_dense_pages(pages, info: dict, skip_empty: bool):
+    """
+    Filtro sobre (num_pagina, texto): mide la densidad de texto de cada
+    página al vuelo y, si skip_empty, se salta las que no tienen texto.
+    """
+    for num, text in pages:
+        if not _note_page_density(info, num, text) and skip_empty:
             continue
+        yield num, text
+
+def format_page_ranges(nums) -> str:
+    """[1, 2, 3, 7, 9, 10] -> "1-3, 7, 9-10" """
+    parts = []
+    nums = sorted(nums)
+    k = 0
+    while k < len(nums):
+        j = k
+        while j + 1 < len(nums) and nums[j + 1] == nums[j] + 1:
+            j += 1
+        parts.append(str(nums[k]) if j == k else f"{nums[k]}-{nums[j]}")
+        k = j + 1
+    return ", ".join(parts)
+
+def check_usable_text(doc, skip_empty: bool):
+    """
+    Corta ANTES de llamar al modelo si los apuntes no sirven:
+    - Menos de MIN_USABLE_CHARS de texto útil en total, o
+    - demasiadas páginas vacías (>= SCANNED_PAGE_FRACTION) y el usuario
+      no ha pedido excluirlas.
+    """
+    n_pages = len(doc.page_nums) + (len(doc.empty_pages) if skip_empty else 0)
+    empty = doc.empty_pages.tolist()
+
+    if doc.usable_chars < MIN_USABLE_CHARS:
+        raise TextoInsuficiente(
+            f"El PDF casi no tiene texto seleccionable ({doc.usable_chars} caracteres útiles). "
+            "¿Es un PDF escaneado? Pásalo por OCR antes."
+        )
+    if not skip_empty and n_pages and len(empty) / n_pages >= SCANNED_PAGE_FRACTION:
+        raise TextoInsuficiente(
+            f"{len(empty)} de {n_pages} páginas no tienen texto (págs. {format_page_ranges(empty)}). "
+            "Marca 'Excluir páginas sin texto' para generar solo con el resto, o pasa el PDF por OCR."
+        )
+
+def pdf_to_md(path_pdf: str, path_md: str, **kwargs) -> str:
+    """
+    Convierte un PDF a Markdown sencillo y devuelve el texto.
+    Mismos parámetros que pdf_to_doc (esta es la versión "solo texto").
+    """
+    return pdf_to_doc(path_pdf, path_md, **kwargs).text
+
+def pdf_to_doc(
+    path_pdf: str,
+    path_md: str,
+    workers: int = 1,
+    cache=None,
+    page_store=None,
+    strip_headers: bool = False,
+    skip_empty: bool = False,
+    backend: str = "pypdf",
+    page_spec: str = "",
+    info: dict = None,
+):
+    """
+    Convierte un PDF a Markdown sencillo y devuelve un Documento
+    (texto + secciones + páginas + párrafos), construido UNA vez
+    mientras se escribe el .md.
+
+    - Extrae el texto página por página con pypdf
+      (en paralelo si workers > 1, ver iter_pages_text).
+    - Inserta comentarios <!-- page: N --> para mantener referencia.
+    - Reconstituye párrafos (une líneas) y convierte:
+      - títulos detectados -> #, ##, ### ...
+      - bullets -> "- item"
+
+    La conversión va por streaming (write_md_stream): el .md se escribe
+    mientras se extraen las páginas. Solo al final se lee de vuelta,
+    porque el prompt necesita el texto completo.
+
+    cache:
+    - MdCache opcional. Si el mismo PDF (mismos bytes) ya se convirtió
+      con esta versión del conversor, no se extrae nada.
+
+    page_store:
+    - PageStore opcional. Si hay una versión anterior del mismo PDF
+      (mismo nombre), solo se reextraen las páginas que han cambiado.
+
+    strip_headers:
+    - Quita cabeceras/pies repetidos en muchas páginas antes de
+      reconstruir párrafos (ver detect_repeated_lines).
+
+    skip_empty:
+    - Excluye las páginas sin texto (escaneadas). Se detectan siempre,
+      en la misma pasada de extracción: Documento.empty_pages.
+
+    backend:
+    - Extractor de texto ("pypdf", "pdfminer", "pdftotext") o "auto"
+      para usar el más rápido de esta máquina (choose_extractor).
+      info["backend"] dice cuál se usó.
+
+    page_spec:
+    - Selección de páginas/temas ("3-5, 12, Tema 4", ver
+      parse_page_selection). Vacío = todo el PDF. Solo se extraen las
+      páginas elegidas; el nº de páginas y el índice se leen sin tocar
+      su contenido. info["pages_selected"] / info["pages_total"].
+
+    Títulos:
+    - Si el PDF tiene índice (marcadores), los títulos y su nivel salen
+      de ahí (read_outline). Solo si no lo tiene se adivinan con
+      is_heading. info["outline_sections"] dice cuántos se usaron.
+
+    info:
+    - dict opcional que se rellena con detalles: "cache" ("hit"/"miss"),
+      con page_store "pages_reused"/"pages_extracted" y con
+      strip_headers "header_lines_removed"/"header_chars_removed"/
+      "header_tokens_removed"/"header_samples".
+
+    Si el PDF no tiene texto seleccionable (escaneado), puede salir muy corto.
+    """
+    pdf_path = pathlib.Path(path_pdf)
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"No existe el PDF: {path_pdf}")
+    if info is None:
+        info = {}
+
+    if backend == "auto":
+        backend = choose_extractor(str(pdf_path))
+    elif not EXTRACTORES.get(backend, PypdfExtractor).available():
+        backend = "pypdf"
+    info["backend"] = backend
+
+    # Selección: solo metadatos (nº de páginas e índice), sin extraer texto
+    reader = None
+    indices = None
+    if (page_spec or "").strip():
+        reader = PdfReader(str(pdf_path))
+        outline = read_outline(reader)
+        indices = parse_page_selection(page_spec, len(reader.pages), outline)
+        if not indices:
+            raise ValueError("La selección de páginas está vacía.")
+        info["pages_selected"] = len(indices)
+        info["pages_total"] = len(reader.pages)
+
+    key = None
+    if cache is not None:
+        variant = ("h" if strip_headers else "") + ("e" if skip_empty else "")
+        if backend != "pypdf":
+            variant += "-" + backend
+        if indices is not None and len(indices) < len(reader.pages):
+            pages_id = format_page_ranges([i + 1 for i in indices]).replace(", ", "_")
+            variant += "-p" + hashlib.sha256(pages_id.encode("ascii")).hexdigest()[:12]
+        key = cache.key_for(str(pdf_path), variant=variant)
+        doc = cache.get(key)
+        if doc is not None:
+            pathlib.Path(path_md).write_text(doc.text, encoding="utf-8")
+            info["cache"] = "hit"
+            return doc
+        info["cache"] = "miss"
+
+    if reader is None:
+        reader = PdfReader(str(pdf_path))
+        outline = read_outline(reader)
+
+    if page_store is not None:
+        events = _iter_incremental_events(
+            str(pdf_path), workers, page_store, info, strip_headers, skip_empty, backend,
+            indices=indices, reader=reader,
+        )
+    else:
+        # El índice se lee sin tocar el contenido de las páginas
+        outline = outline_by_page(outline) or None
+        if outline is not None and indices is not None:
+            wanted = set(indices)
+            outline = {i: v for i, v in outline.items() if i in wanted} or None
+        info["outline_sections"] = sum(len(v) for v in outline.values()) if outline else 0
+        pages = iter_pages_text(str(pdf_path), workers=workers, indices=indices, backend=backend)
+        pages = iter_dense_pages(pages, info, skip_empty)
+        if strip_headers:
+            events = iter_stripped_md_lines(pages, info, outline)
+        else:
+            events = iter_md_lines(pages, outline)
+    builder = write_md_stream(None, path_md, line_events=events)
+    builder.empty_pages.extend(info.get("empty_pages", []))
+    builder.usable_chars = info.get("usable_chars", 0)
+    doc = builder.build(pathlib.Path(path_md).read_text(encoding="utf-8"))
+
+    if cache is not None:
+        cache.put(key, doc)
+    return doc
+
+
+# ============================
+#  Modelo de documento
+# ============================
+#  Los apuntes se convierten UNA vez y todas las etapas (prompt,
+#  troceado por secciones, validación, citas) trabajan sobre este
+#  modelo en vez de volver a parsear el Markdown.
+#
+#  - Un solo string (Documento.text) con el Markdown.
+#  - Todo lo demás son offsets (enteros) dentro de ese string,
+#    guardados en array('I') o en objetos con __slots__.
+# ============================
+class Seccion:
+    """
+    Una sección del documento: desde su título hasta el siguiente
+    título de nivel igual o superior.
+
+    - start/end: offsets en Documento.text (start = inicio del "# ...")
+    - page_start/page_end: páginas (base 1) que abarca
+    """
+
+    __slots__ = ("level", "title", "start", "end", "page_start", "page_end")
+
+    def __init__(self, level: int, title: str, start: int, end: int, page_start: int, page_end: int):
+        self.level = level
+        self.title = title
+        self.start = start
+        self.end = end
+        self.page_start = page_start
+        self.page_end = page_end
+
+    def __repr__(self):
+        return f"Seccion({self.level}, {self.title!r}, págs {self.page_start}-{self.page_end})"
+
+
+class Documento:
+    """
+    Apuntes ya convertidos: texto Markdown + índices por offset.
+
+    - text: el Markdown completo (lo que se guarda en _apuntes.md)
+    - sections: lista de Seccion, en orden
+    - page_nums/page_offsets: página N empieza en el offset dado
+      (donde está su marcador <!-- page: N -->)
+    - para_starts/para_ends: párrafos y viñetas
+    - empty_pages: páginas sin texto (escaneadas), estén o no en text
+    - usable_chars: letras y números de las páginas con texto
+    """
+
+    __slots__ = (
+        "text", "sections", "page_nums", "page_offsets", "para_starts", "para_ends",
+        "empty_pages", "usable_chars",
+    )
+
+    def __init__(
+        self, text: str, sections, page_nums, page_offsets, para_starts, para_ends,
+        empty_pages=(), usable_chars: int = 0,
+    ):
+        self.text = text
+        self.sections = list(sections)
+        self.page_nums = array("I", page_nums)
+        self.page_offsets = array("I", page_offsets)
+        self.para_starts = array("I", para_starts)
+        self.para_ends = array("I", para_ends)
+        self.empty_pages = array("I", empty_pages)
+        self.usable_chars = usable_chars
+
+    # ---- consultas (sin recorrer el texto)
+    def page_at(self, offset: int) -> int:
+        """Página (base 1) en la que cae un offset del texto (0 si no hay páginas)."""
+        k = bisect.bisect_right(self.page_offsets, offset) - 1
+        return self.page_nums[k] if k >= 0 else (self.page_nums[0] if self.page_nums else 0)
+
+    def section_at(self, offset: int):
+        """Sección más interna que contiene el offset (o None)."""
+        found = None
+        for sec in self.sections:
+            if sec.start > offset:
+                break
+            if offset < sec.end:
+                found = sec
+        return found
+
+    def section_text(self, sec) -> str:
+        return self.text[sec.start:sec.end]
+
+    def iter_paragraphs(self, start: int = 0, end: int = None):
+        """Genera (start, end) de los párrafos/viñetas dentro de [start, end)."""
+        end = len(self.text) if end is None else end
+        k = bisect.bisect_left(self.para_starts, start)
+        while k < len(self.para_starts) and self.para_starts[k] < end:
+            yield self.para_starts[k], self.para_ends[k]
+            k += 1
+
+    def slice(self, start: int, end: int):
+        """
+        Sub-documento con el texto [start, end) y sus índices desplazados
+        (para trabajar con una sección suelta como si fuera un Documento).
+        Solo entran las secciones cuyo título cae dentro del trozo.
+        """
+        end = min(end, len(self.text))
+        sections = [
+            Seccion(s.level, s.title, s.start - start, min(s.end, end) - start, s.page_start, s.page_end)
+            for s in self.sections if start <= s.start < end
+        ]
+        k0, k1 = bisect.bisect_left(self.page_offsets, start), bisect.bisect_left(self.page_offsets, end)
+        p0, p1 = bisect.bisect_left(self.para_starts, start), bisect.bisect_left(self.para_starts, end)
+        return Documento(
+            self.text[start:end],
+            sections,
+            self.page_nums[k0:k1],
+            [o - start for o in self.page_offsets[k0:k1]],
+            [o - start for o in self.para_starts[p0:p1]],
+            [min(o, end) - start for o in self.para_ends[p0:p1]],
+        )
+
+    def cite(self, fragment: str):
+        """
+        Busca un fragmento en los apuntes y devuelve (página, sección)
+        donde aparece, o None si no está.
+        """
+        pos = self.text.find(fragment)
+        if pos < 0:
+            return None
+        return self.page_at(pos), self.section_at(pos)
+
+    # ---- serialización (caché)
+    def to_dict(self) -> dict:
+        return {
+            "text": self.text,
+            "sections": [
+                [s.level, s.title, s.start, s.end, s.page_start, s.page_end] for s in self.sections
+            ],
+            "page_nums": self.page_nums.tolist(),
+            "page_offsets": self.page_offsets.tolist(),
+            "para_starts": self.para_starts.tolist(),
+            "para_ends": self.para_ends.tolist(),
+            "empty_pages": self.empty_pages.tolist(),
+            "usable_chars": self.usable_chars,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            data["text"],
+            [Seccion(*row) for row in data["sections"]],
+            data["page_nums"],
+            data["page_offsets"],
+            data["para_starts"],
+            data["para_ends"],
+            data["empty_pages"],
+            data["usable_chars"],
+        )
+
+
+def _content_end(text: str, start: int, end: int) -> int:
+    """
+    Final del contenido de text[start:end], sin los blancos ni los
+    marcadores <!-- page: N --> del final: si la sección siguiente empieza
+    arriba de una página, ese marcador ya es de la página siguiente.
+    """
+    while end > start:
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        mark = text.rfind("<!--", start, end) if text.endswith("-->", start, end) else -1
+        if mark < 0 or not _PAGE_MARK_RE.fullmatch(text, mark, end):
+            break
+        end = mark
+    return end
+
+class DocBuilder:
+    """
+    Recoge offsets mientras write_md_stream escribe el Markdown
+    (sin guardar el texto) y al final monta el Documento.
+    """
+
+    def __init__(self):
+        self.page_nums = array("I")
+        self.page_offsets = array("I")
+        self.para_starts = array("I")
+        self.para_ends = array("I")
+        self.headings = []  # (nivel, título, offset)
+        self.empty_pages = array("I")
+        self.usable_chars = 0
+
+    def add(self, kind: str, start: int, end: int, chunk: str):
+        """Registra un bloque escrito en [start, end)."""
+        if kind == "page":
+            self.page_nums.append(int(re.search(r"\d+", chunk).group()))
+            self.page_offsets.append(start)
+        elif kind == "heading":
+            marks, _, title = chunk.lstrip("\n").partition(" ")
+            self.headings.append((len(marks), title, start))
+        elif kind in ("para", "bullet"):
+            self.para_starts.append(start)
+            self.para_ends.append(end)
+
+    def build(self, text: str) -> Documento:
+        """Crea el Documento: calcula el final y las páginas de cada sección."""
+        doc = Documento(
+            text, [], self.page_nums, self.page_offsets, self.para_starts, self.para_ends,
+            self.empty_pages, self.usable_chars,
+        )
+        sections = []
+        for k, (level, title, start) in enumerate(self.headings):
+            end = len(text)
+            for level2, _title2, start2 in self.headings[k + 1:]:
+                if level2 <= level:
+                    end = start2
+                    break
+            page_end = doc.page_at(max(start, _content_end(text, start, end) - 1))
+            sections.append(Seccion(level, title, start, end, doc.page_at(start), page_end))
+        doc.sections = sections
+        return doc
+
+
+# ============================
+#  Caché PDF -> Markdown
+# ============================
+def _atomic_write_text(path: pathlib.Path, text: str):
+    """
+    Escribe un archivo de golpe: primero a un temporal en la misma
+    carpeta y luego os.replace (atómico). Nadie lee nunca medio archivo.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+class MdCache:
+    """
+    Caché en disco de conversiones PDF -> Markdown, por contenido.
+
+    - Clave: SHA-256 de los bytes del PDF + CONVERTER_VERSION.
+      (Si cambias el conversor, sube CONVERTER_VERSION y las entradas
+      antiguas dejan de usarse solas.)
+    - Cada entrada es un .json con el Documento (Markdown + secciones,
+      páginas y párrafos), ver Documento.to_dict.
+    - Tamaño limitado: al pasarse de max_bytes se borran las entradas
+      usadas hace más tiempo (LRU por fecha de modificación; cada
+      acierto "toca" el archivo).
+
+    Concurrencia:
+    - Varios hilos/trabajos pueden usar la misma instancia (lock interno).
+    - Las escrituras son atómicas (archivo temporal + os.replace), así
+      que otro proceso nunca lee una entrada a medias.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key_for(self, path_pdf: str, variant: str = "") -> str:
+        """
+        SHA-256 del PDF (leído por bloques) + versión del conversor.
+        variant distingue opciones que cambian la salida (p. ej. "h" =
+        sin cabeceras/pies).
+        """
+        h = hashlib.sha256()
+        with open(path_pdf, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return f"{h.hexdigest()}_{CONVERTER_VERSION}{variant}"
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        """Devuelve el Documento guardado o None si no está (o está corrupto)."""
+        path = self._path(key)
+        try:
+            entry = Documento.from_dict(json.loads(path.read_text(encoding="utf-8")))
+            os.utime(path)  # marcar como usada recientemente (LRU)
+        except (OSError, ValueError, KeyError, TypeError):
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key: str, doc):
+        """Guarda una conversión (Documento) de forma atómica y aplica el límite de tamaño."""
+        data = json.dumps(doc.to_dict(), ensure_ascii=False)
+        _atomic_write_text(self._path(key), data)
+        self._evict()
+
+    def _evict(self):
+        """Borra las entradas menos usadas hasta quedar por debajo de max_bytes."""
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue  # otro trabajo la borró entretanto
+                entries.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+                total -= size
+
+    def stats_text(self) -> str:
+        """Resumen para el log: aciertos / fallos."""
+        with self._lock:
+            return f"aciertos: {self.hits}, fallos: {self.misses}"
+
+
+class PageStore:
+    """
+    Almacén de páginas ya convertidas, por huella de página.
+
+    Sirve para PDFs que se revisan poco a poco: al llegar una versión
+    nueva de un PDF conocido (mismo nombre de archivo), las páginas cuya
+    huella (page_fingerprint) no ha cambiado se reutilizan sin extraer.
+
+    - Un .json por documento: {"version", "pages": {huella: página}},
+      con página = {"lines", "removed", "blocks"}.
+    - Cada conversión completa sustituye las páginas guardadas por las
+      de la versión actual (no crece sin límite). Con una selección de
+      páginas se conservan también las del resto del PDF.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = pathlib.Path(store_dir)
+
+    def doc_id(self, path_pdf: str, backend: str = "pypdf") -> str:
+        """
+        Identidad del documento: su nombre de archivo (sin extensión).
+        Cada extractor saca un texto distinto, así que va aparte.
+        """
+        stem = pathlib.Path(path_pdf).stem.lower()
+        doc_id = re.sub(r"[^\w.-]+", "_", stem)
+        return doc_id if backend == "pypdf" else f"{doc_id}@{backend}"
+
+    def _path(self, doc_id: str) -> pathlib.Path:
+        return self.store_dir / f"{doc_id}.json"
+
+    def load(self, doc_id: str) -> dict:
+        """Devuelve {huella: página} de la versión anterior (o {})."""
+        try:
+            data = json.loads(self._path(doc_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != CONVERTER_VERSION:
+            return {}
+        return data.get("pages", {})
+
+    def save(self, doc_id: str, pages: dict):
+        """Guarda {huella: página} de la versión actual (atómico)."""
+        data = json.dumps({"version": CONVERTER_VERSION, "pages": pages}, ensure_ascii=False)
+        _atomic_write_text(self._path(doc_id), data)
+
+
+# ============================
+#  Cliente HTTP de Ollama (conexiones reutilizadas)
+# ============================
+#  requests.post() a secas abre (y cierra) una conexión TCP por llamada.
+#  Con reintentos, continuaciones y el examen por secciones son muchas
+#  llamadas seguidas al mismo host: con una Session se reutilizan.
+#  (Las generaciones en streaming van por AsyncOllamaClient; esta sesión
+#  queda para las peticiones cortas: /api/show...)
+# ============================
+class OllamaClient:
+    """
+    Conexión con un host de Ollama: una requests.Session con un pool de
+    hasta OLLAMA_POOL_SIZE conexiones keep-alive.
+
+    Se comparte entre hilos (ollama_client(host) devuelve siempre el
+    mismo): urllib3 reparte las conexiones del pool con su propio
+    bloqueo y la sesión no guarda estado entre peticiones (Ollama no usa
+    cookies). Si hay más peticiones a la vez que conexiones en el pool,
+    las que sobran abren una conexión extra que se cierra al terminar.
+    """
+
+    def __init__(self, host: str, pool_size: int = OLLAMA_POOL_SIZE):
+        self.host = host.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path: str, **kwargs):
+        return self.session.get(self.host + path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.session.post(self.host + path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_ollama_clients = {}
+_ollama_clients_lock = threading.Lock()
+
+def ollama_client(host: str) -> OllamaClient:
+    """El OllamaClient de un host (se crea la primera vez)."""
+    key = host.rstrip("/")
+    with _ollama_clients_lock:
+        client = _ollama_clients.get(key)
+        if client is None:
+            client = _ollama_clients[key] = OllamaClient(key)
+        return client
+
+
+# ============================
+#  Ollama streaming + cancel
+# ============================
+OLLAMA_STATS_KEYS = (
+    "done_reason", "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration",
+)
+
+# Si el modelo sigue escribiendo después de las respuestas (notas,
+# explicaciones...), Ollama para al ver una de estas secuencias
+EXAM_STOP_SEQUENCES = ["\n## Notas", "\n### Notas", "\n**Nota", "\nNota:", "\n## Explicaci"]
+
+class CancelledByUser(Exception):
+    """
+    Excepción interna para cortar el proceso cuando el usuario pulsa "Cancelar".
+    """
+    pass
+
+class AnswerKeyWatcher:
+    """
+    Lee la salida según llega del stream y avisa en cuanto "## Respuestas"
+    tiene todas las respuestas esperadas (líneas "N. ..." ya terminadas).
+
+    Solo procesa las líneas nuevas de cada trozo, así que el coste es
+    lineal aunque la salida sea larga.
+
+    check: función opcional sobre todo el texto recibido (p. ej.
+    validate_output). Si se pasa, solo se avisa si lo escrito hasta ahí la
+    cumple; si no, ya no se avisa más y el stream acaba solo, así Ollama
+    devuelve el "context" que usan el relleno y el reintento.
+    """
+
+    def __init__(self, numbers, check=None):
+        self.pending = set(numbers)
+        self.in_answers = False
+        self.check = check
+        self.checked = False
+        self._line = ""
+        self._parts = [] if check else None
+
+    def feed(self, piece: str) -> bool:
+        """Añade un trozo; devuelve True si ya están todas las respuestas (y pasa check)."""
+        if self._parts is not None:
+            self._parts.append(piece)
+        self._line += piece
+        if "\n" not in piece:
+            return False
+        *lines, self._line = self._line.split("\n")
+        for line in lines:
+            if "## Respuestas" in line:
+                self.in_answers = True
+            elif self.in_answers:
+                m = re.match(r"\s*(\d+)\.\s+\S", line)
+                if m:
+                    self.pending.discard(int(m.group(1)))
+        if not self.in_answers or self.pending:
+            return False
+        if self.check is None:
+            return True
+        if self.checked:
+            return False  # ya se comprobó y no valía: que termine el stream
+        self.checked = True
+        return bool(self.check("".join(self._parts)))
+
+# Línea de token de /api/generate: {"model":..,"created_at":..,"response":"..","done":false}
+# Es casi todo el stream; solo hace falta sacar "response" (ver NDJSONDecoder)
+_TOKEN_LINE_RE = re.compile(
+    r'\{(?:"(?:model|created_at)":\s?"[^"\\]*",\s?)*"response":\s?"((?:[^"\\]|\\.)*)",\s?"done":\s?false\}'
+)
+_json_decode = json.JSONDecoder().decode
+
+class NDJSONDecoder:
+    """
+    Decodifica NDJSON (un JSON por línea) a partir de trozos de bytes tal
+    como llegan del socket, aunque corten una línea por la mitad.
+
+    - Con orjson: se parte el trozo por b"\\n" y cada línea va directa a
+      orjson.loads (sin pasar a str).
+    - Sin orjson: se pasa a str una vez por trozo y las líneas de token
+      ({"response": "...", "done": false}) se leen con una regex, sacando
+      solo "response"; el resto (la última, con estadísticas y context,
+      o un error) se decodifica entera con json.
+    Las líneas que no son JSON válido se saltan.
+    """
+
+    __slots__ = ("_tail", "lines")
+
+    def __init__(self):
+        self._tail = b""
+        self.lines = 0
+
+    def feed(self, data: bytes) -> list:
+        """Objetos de las líneas completas; lo que sobra espera al siguiente trozo."""
+        if self._tail:
+            data = self._tail + data
+        cut = data.rfind(b"\n") + 1
+        self._tail = data[cut:]
+        return self._decode(data[:cut]) if cut else []
+
+    def close(self) -> list:
+        """La última línea, si el cuerpo no acababa en salto de línea."""
+        data, self._tail = self._tail, b""
+        return self._decode(data)
+
+    def _decode(self, data: bytes) -> list:
+        out = []
+        if orjson is not None:
+            loads = orjson.loads
+            for line in data.split(b"\n"):
+                if line.strip():
+                    try:
+                        out.append(loads(line))
+                    except ValueError:
+                        continue
+        else:
+            # \n no aparece dentro de un carácter UTF-8 multibyte: cortar en líneas completas es seguro
+            match = _TOKEN_LINE_RE.fullmatch
+            for line in data.decode("utf-8", "replace").split("\n"):
+                m = match(line)
+                if m:
+                    piece = m.group(1)
+                    out.append({"response": _json_decode(f'"{piece}"') if "\\" in piece else piece, "done": False})
+                elif line.strip():
+                    try:
+                        out.append(_json_decode(line))
+                    except ValueError:
+                        continue
+        self.lines += len(out)
+        return out
+
+class OllamaError(Exception):
+    """
+    Ollama respondió con un error HTTP (modelo que no existe...) o no se
+    pudo conectar con él.
+    """
+    pass
+
+class ProgressEvent:
+    """
+    Lo que recibe on_progress:
+    - delta: texto nuevo desde el aviso anterior (no la salida entera)
+    - tokens: trozos (~tokens) recibidos hasta ahora
+    - elapsed: segundos desde que se mandó la petición
+    - tokens_per_s: velocidad de generación desde el primer token
+    - done: True en el último aviso de la llamada
+    """
+
+    __slots__ = ("delta", "tokens", "elapsed", "tokens_per_s", "done")
+
+    def __init__(self, delta: str, tokens: int, elapsed: float, tokens_per_s: float, done: bool = False):
+        self.delta = delta
+        self.tokens = tokens
+        self.elapsed = elapsed
+        self.tokens_per_s = tokens_per_s
+        self.done = done
+
+class ProgressChannel:
+    """
+    Entre el stream y on_progress: acumula los trozos y avisa como mucho
+    `hz` veces por segundo con lo nuevo (ProgressEvent). Cada trozo se
+    copia una sola vez, así el coste no crece con lo larga que sea la
+    salida (antes se rehacía el texto entero en cada token).
+    """
+
+    def __init__(self, callback, hz: float = DEFAULT_PROGRESS_HZ, start: float = None):
+        self.callback = callback
+        self.interval = 1.0 / hz if hz else 0.0
+        self.start = time.time() if start is None else start
+        self.tokens = 0
+        self._pending = []
+        self._first = None
+        self._last = 0.0
+
+    def feed(self, piece: str):
+        """Un trozo nuevo del stream; avisa si ya toca."""
+        now = time.time()
+        if self._first is None:
+            self._first = now
+        self.tokens += 1
+        self._pending.append(piece)
+        if now - self._last >= self.interval:
+            self._emit(now, False)
+
+    def close(self):
+        """Último aviso, con lo que quede pendiente."""
+        self._emit(time.time(), True)
+
+    def _emit(self, now: float, done: bool):
+        delta = "".join(self._pending)
+        self._pending.clear()
+        self._last = now
+        gen = now - self._first if self._first is not None else 0.0
+        self.callback(ProgressEvent(delta, self.tokens, now - self.start, self.tokens / gen if gen > 0 else 0.0, done))
+
+async def _cancel_watch(cancel_event: threading.Event, task):
+    """Cancela `task` en cuanto se active cancel_event (aunque no llegue nada del stream)."""
+    while not cancel_event.is_set():
+        await asyncio.sleep(CANCEL_POLL_SECONDS)
+    task.cancel()
+
+class AsyncOllamaClient:
+    """
+    Cliente asyncio (solo stdlib) para un host de Ollama: muchas
+    generaciones en streaming a la vez sobre un único event loop, en vez
+    de un hilo bloqueado por cada una.
+
+    - streams: semáforo con el máximo de peticiones en marcha a la vez
+      (OLLAMA_MAX_STREAMS); el resto espera su turno.
+    - Las conexiones que terminan bien se guardan abiertas (keep-alive,
+      hasta OLLAMA_POOL_SIZE) para la siguiente petición.
+
+    - https o un proxy (HTTP_PROXY/HTTPS_PROXY sin NO_PROXY para el
+      host): el HTTP de sockets no los sabe usar, así que esas peticiones
+      van por la Session de ollama_client(host), como antes.
+
+    Pertenece al event loop donde se usa (async_ollama_client lo crea
+    por loop y host).
+    """
+
+    def __init__(self, host: str, max_streams: int = None, pool_size: int = None):
+        url = host if "://" in host else f"http://{host}"
+        parts = urlsplit(url)
+        self.host = host.rstrip("/")
+        self._addr = (parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        self._ssl = True if parts.scheme == "https" else None
+        self._netloc = parts.netloc
+        self._pool_size = pool_size or OLLAMA_POOL_SIZE
+        self._idle = []
+        self.streams = asyncio.Semaphore(max_streams or OLLAMA_MAX_STREAMS)
+        self._via_session = parts.scheme == "https" or bool(
+            requests.utils.select_proxy(url, requests.utils.get_environ_proxies(url))
+        )
+
+    # ---- HTTP/1.1 mínimo
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(*self._addr, ssl=self._ssl), OLLAMA_CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise OllamaError(f"No se puede conectar con Ollama en {self.host}: {e}") from e
+
+    async def _send(self, path: str, body: bytes) -> tuple:
+        """
+        Manda un POST y lee la cabecera de la respuesta.
+        Devuelve (reader, writer, status, headers). Si una conexión
+        reutilizada resulta estar cerrada, se repite con una nueva.
+        """
+        request = (
+            f"POST {path} HTTP/1.1\r\nHost: {self._netloc}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n"
+        ).encode("latin-1") + body
+        while True:
+            reused = bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await self._connect()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError("Ollama cerró la conexión")
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                return reader, writer, int(status_line.split()[1]), headers
+            except (OSError, EOFError, IndexError, ValueError) as e:
+                writer.close()
+                if not reused:
+                    raise OllamaError(f"Respuesta no válida de Ollama en {self.host}: {e}") from e
+
+    @staticmethod
+    async def _body(reader, headers: dict):
+        """
+        Trozos (bytes) del cuerpo: chunked, Content-Length o hasta que se cierre.
+        En chunked se lee del socket de OLLAMA_READ_SIZE en OLLAMA_READ_SIZE
+        y se junta todo lo que haya llegado (Ollama manda un chunk por token).
+        """
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            buf = b""
+            while True:
+                parts = []
+                pos = 0
+                while (eol := buf.find(b"\r\n", pos)) != -1:
+                    size = int(buf[pos:eol].split(b";")[0], 16)
+                    if size == 0:
+                        end = buf.find(b"\r\n\r\n", eol)  # tras los trailers (si hay)
+                        if end == -1:
+                            break
+                        if parts:
+                            yield b"".join(parts)
+                        return
+                    if len(buf) < eol + size + 4:  # datos + "\r\n" aún sin llegar
+                        break
+                    parts.append(buf[eol + 2:eol + 2 + size])
+                    pos = eol + size + 4
+                if parts:
+                    yield b"".join(parts)
+                data = await reader.read(OLLAMA_READ_SIZE)
+                if not data:
+                    raise asyncio.IncompleteReadError(buf[pos:], None)
+                buf = buf[pos:] + data
+        elif "content-length" in headers:
+            size = int(headers["content-length"])
+            if size:
+                yield await reader.readexactly(size)
+        else:
+            while data := await reader.read(OLLAMA_READ_SIZE):
+                yield data
+
+    def _release(self, reader, writer, headers: dict):
+        """Devuelve la conexión al pool si se puede reutilizar; si no, la cierra."""
+        framed = "content-length" in headers or headers.get("transfer-encoding", "").lower() == "chunked"
+        if framed and headers.get("connection", "").lower() != "close" and len(self._idle) < self._pool_size:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    @staticmethod
+    def _error(status: int, raw: bytes) -> OllamaError:
+        try:
+            msg = json.loads(raw).get("error") or raw.decode("utf-8", "replace")
+        except (ValueError, AttributeError):
+            msg = raw.decode("utf-8", "replace")
+        return OllamaError(f"Ollama respondió {status}: {msg.strip()[:300]}")
+
+    async def post_json(self, path: str, payload: dict) -> dict:
+        """Petición normal (sin streaming): devuelve el JSON de la respuesta."""
+        result = {}
+        async for data in self.stream(path, payload):
+            result = data
+        return result
+
+    def stream(self, path: str, payload: dict):
+        """
+        POST con respuesta en NDJSON: genera cada objeto según llega.
+        Si se deja a medias (aclose), la conexión se cierra y Ollama deja
+        de generar.
+        """
+        if self._via_session:
+            return self._stream_session(path, payload)
+        return self._stream_socket(path, payload)
+
+    async def _stream_socket(self, path: str, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        async with self.streams:
+            reader, writer, status, headers = await self._send(path, body)
+            complete = False
+            try:
+                if status >= 400:
+                    raw = b"".join([data async for data in self._body(reader, headers)])
+                    complete = True
+                    raise self._error(status, raw)
+                decoder = NDJSONDecoder()
+                async for data in self._body(reader, headers):
+                    for obj in decoder.feed(data):
+                        yield obj
+                for obj in decoder.close():
+                    yield obj
+                complete = True
+            finally:
+                if complete:
+                    self._release(reader, writer, headers)
+                else:
+                    writer.close()
+
+    async def _stream_session(self, path: str, payload: dict):
+        """
+        stream() con la Session de requests (https, proxies): un hilo lee
+        la respuesta y pasa los trozos al loop. Si se deja a medias, el
+        hilo cierra la conexión al llegar el siguiente trozo.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stop = threading.Event()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:  # el loop ya está cerrado
+                stop.set()
+
+        def pump():
+            try:
+                with ollama_client(self.host).post(
+                    path, json=payload, stream=True, timeout=(OLLAMA_CONNECT_TIMEOUT, None)
+                ) as r:
+                    if r.status_code >= 400:
+                        raise self._error(r.status_code, r.content)
+                    for data in r.iter_content(None):  # cada trozo según llega
+                        if stop.is_set():
+                            return
+                        put(data)
+                put(None)
+            except requests.RequestException as e:
+                put(OllamaError(f"No se puede conectar con Ollama en {self.host}: {e}"))
+            except OllamaError as e:
+                put(e)
+
+        async with self.streams:
+            threading.Thread(target=pump, name="ollama-requests", daemon=True).start()
+            try:
+                decoder = NDJSONDecoder()
+                while (data := await chunks.get()) is not None:
+                    if isinstance(data, OllamaError):
+                        raise data
+                    for obj in decoder.feed(data):
+                        yield obj
+                for obj in decoder.close():
+                    yield obj
+            finally:
+                stop.set()
+
+    # ---- /api/generate
+    async def generate(
+        self,
+        prompt: str,
+        *,
+        model: str,
+        num_predict: int,
+        temperature: float,
+        cancel_event: threading.Event = None,
+        on_progress=None,
+        num_ctx: int = None,
+        context: list = None,
+        stop: list = None,
+        answer_key=None,
+        info: dict = None,
+        keep_alive=None,
+        progress_hz: float = DEFAULT_PROGRESS_HZ,
+        strip: bool = True,
+    ) -> str:
+        """Lo mismo que ollama_generate_stream, dentro de un event loop."""
+        payload = {
+            "model": model.strip(),
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                "num_predict": int(num_predict),
+                "temperature": float(temperature),
+            }
+        }
+        if num_ctx:
+            payload["options"]["num_ctx"] = int(num_ctx)
+        if context:
+            payload["context"] = context
+        if stop:
+            payload["options"]["stop"] = list(stop)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive_value(keep_alive)
+        if num_ctx and _last_num_ctx.get((self.host, payload["model"])) != int(num_ctx):
+            # escribe el JSON en otro hilo: el disco no debe frenar los demás streams del loop
+            asyncio.get_running_loop().run_in_executor(None, remember_num_ctx, self.host, payload["model"], num_ctx)
+
+        chunks = []
+        watcher = answer_key
+        if answer_key is not None and not isinstance(answer_key, AnswerKeyWatcher):
+            watcher = AnswerKeyWatcher(answer_key)
+
+        # Cancelar también mientras Ollama aún no manda nada (cargando el
+        # modelo, procesando un prompt largo...)
+        watch = None
+        if cancel_event is not None:
+            watch = asyncio.create_task(_cancel_watch(cancel_event, asyncio.current_task()))
+
+        stream = self.stream("/api/generate", payload)
+        try:
+            start = time.time()
+            progress = ProgressChannel(on_progress, progress_hz, start) if on_progress else None
+            # Ollama envía JSON por líneas (JSONL)
+            async for data in stream:
+                # Permite cancelar durante el stream
+                if cancel_event is not None and cancel_event.is_set():
+                    raise CancelledByUser()
+
+                # trozo del texto generado
+                piece = data.get("response", "")
+                if piece:
+                    if not chunks and info is not None:
+                        info["first_token_s"] = time.time() - start  # carga + prefill
+                    chunks.append(piece)
+                    # informar progreso (agrupado, como mucho progress_hz veces/s)
+                    if progress is not None:
+                        progress.feed(piece)
+
+                # corte anticipado: ya están todas las respuestas
+                if watcher is not None and piece and watcher.feed(piece) and not data.get("done"):
+                    if info is not None:
+                        info["stopped_early"] = True
+                        # sin el mensaje final no hay eval_count real: ~1 token por mensaje
+                        info["eval_count"] = len(chunks)
+                        info["eval_count_estimated"] = True
+                        info["num_predict"] = int(num_predict)
+                        info["done_reason"] = "answers"
+                    break
+
+                # fin del streaming
+                if data.get("done") is True:
+                    if info is not None:
+                        info.update({k: v for k, v in data.items() if k in OLLAMA_STATS_KEYS})
+                        if data.get("context"):
+                            info["context"] = data["context"]
+
+            if progress is not None:
+                progress.close()
+            text = "".join(chunks)
+            return text.strip() if strip else text
+
+        except asyncio.CancelledError:
+            if cancel_event is not None and cancel_event.is_set():
+                raise CancelledByUser() from None
+            raise
+
+        finally:
+            if watch is not None:
+                watch.cancel()
+            # Cierra la conexión si el stream se quedó a medias (cancelar / corte anticipado)
+            await stream.aclose()
+
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {host: AsyncOllamaClient}
+_last_num_ctx = {}  # (host, modelo) -> último num_ctx pedido (para precargar igual)
+_ctx_profile_lock = threading.Lock()
+
+def remember_num_ctx(host: str, model: str, num_ctx: int, profile_path=None):
+    """
+    Apunta el num_ctx pedido a un modelo (en memoria y en DEFAULT_CTX_PROFILE,
+    solo si cambia), para que la próxima precarga use el mismo.
+    """
+    host, model, num_ctx = host.rstrip("/"), model.strip(), int(num_ctx)
+    if _last_num_ctx.get((host, model)) == num_ctx:
+        return
+    _last_num_ctx[(host, model)] = num_ctx
+    profile_path = pathlib.Path(profile_path or DEFAULT_CTX_PROFILE)
+    with _ctx_profile_lock:
+        profile = dict(_load_json_profile(profile_path))
+        profile[host] = {**profile.get(host, {}), model: num_ctx}
+        try:
+            _atomic_write_text(profile_path, json.dumps(profile, indent=2))
+        except OSError:
+            pass
+
+def last_num_ctx(host: str, model: str, profile_path=None) -> int:
+    """Último num_ctx pedido a ese modelo: de esta sesión o de una anterior (None si nunca)."""
+    host, model = host.rstrip("/"), model.strip()
+    if (host, model) in _last_num_ctx:
+        return _last_num_ctx[(host, model)]
+    num_ctx = _load_json_profile(profile_path or DEFAULT_CTX_PROFILE).get(host, {}).get(model)
+    return int(num_ctx) if num_ctx else None
+
+def async_ollama_client(host: str) -> AsyncOllamaClient:
+    """El AsyncOllamaClient de un host en el event loop actual (se crea la primera vez)."""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    key = host.rstrip("/")
+    if key not in clients:
+        clients[key] = AsyncOllamaClient(key)
+    return clients[key]
+
+async def ollama_generate_async(prompt: str, *, host: str, **kwargs) -> str:
+    """
+    Versión asyncio de ollama_generate_stream (mismos parámetros).
+    Para lanzar muchas a la vez: asyncio.gather(...) en el mismo loop.
+    """
+    return await async_ollama_client(host).generate(prompt, **kwargs)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop():
+    """
+    Event loop compartido (en su propio hilo) donde corren las llamadas
+    síncronas: todas las generaciones del programa van por él, y así
+    comparten conexiones aunque las pidan hilos distintos.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="ollama-asyncio", daemon=True).start()
+        return _loop
+
+def run_async(coro):
+    """Ejecuta una corrutina en el loop compartido y espera su resultado (desde cualquier hilo)."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+def ollama_generate_stream(
+    prompt: str,
+    *,
+    model: str,
+    host: str,
+    num_predict: int,
+    temperature: float,
+    cancel_event: threading.Event,
+    on_progress=None,
+    num_ctx: int = None,
+    context: list = None,
+    stop: list = None,
+    answer_key=None,
+    info: dict = None,
+    keep_alive=None,
+    progress_hz: float = DEFAULT_PROGRESS_HZ,
+    strip: bool = True,
+) -> str:
+    """
+    Llama a Ollama /api/generate en modo streaming (stream=True).
+    Es un envoltorio síncrono de AsyncOllamaClient.generate: la
+    llamada corre en el event loop compartido y este hilo espera.
+
+    Ventajas:
+    - Podemos ir actualizando el tiempo transcurrido.
+    - Podemos cancelar sin esperar a que termine todo.
+
+    cancel_event:
+    - Si el usuario pulsa Cancelar, se activa el event y cortamos
+      (aunque Ollama todavía no haya empezado a responder).
+
+    on_progress:
+    - Callback opcional: on_progress(ProgressEvent) con el texto nuevo
+      (delta), tokens, tiempo y tokens/s; útil para mostrar el avance en
+      la GUI. Como mucho progress_hz avisos por segundo (ProgressChannel)
+      y uno final con done=True. Se llama desde el hilo del event loop:
+      tiene que ser rápido (p. ej. meter un mensaje en una cola).
+
+    num_ctx:
+    - Tamaño de la ventana de contexto (ver plan_token_budget).
+      None = el que tenga configurado Ollama.
+
+    context:
+    - El "context" que devolvió una llamada anterior (tokens de su prompt
+      + respuesta). Ollama sigue desde ahí sin volver a procesar ese
+      prompt: el nuevo prompt puede ser solo una instrucción corta.
+
+    stop:
+    - Secuencias de parada para Ollama (p. ej. EXAM_STOP_SEQUENCES).
+
+    answer_key:
+    - Números de respuesta esperados (p. ej. range(1, N + 1)). En cuanto
+      "## Respuestas" los tiene todos se cierra el stream sin esperar a
+      que el modelo acabe (AnswerKeyWatcher): lo que escribiera después
+      (comentarios, otro examen...) es tiempo de decodificación perdido.
+      info["stopped_early"] = True, info["eval_count"] = mensajes recibidos
+      (estimado: Ollama no manda el recuento si se corta; queda
+      info["eval_count_estimated"]) e info["num_predict"]. Al cortar
+      tampoco llega "context".
+      También acepta un AnswerKeyWatcher (ya alimentado con la salida
+      anterior para continuar una salida cortada, o con check).
+
+    info:
+    - dict opcional donde se copian las estadísticas del último mensaje
+      de Ollama (prompt_eval_count, eval_count, done_reason, duraciones,
+      load_duration = lo que tardó en cargar el modelo) y su "context",
+      para reutilizarlo en la siguiente llamada. Además "first_token_s":
+      segundos hasta el primer trozo (carga del modelo + prefill).
+
+    keep_alive:
+    - Cuánto mantiene Ollama el modelo en memoria después (keep_alive_value).
+      None = lo que tenga configurado Ollama (5 min por defecto).
+
+    strip:
+    - False = devolver el texto tal cual (sin quitar blancos de los
+      extremos), para poder unirlo con su continuación (join_continuation).
+    """
+    return run_async(ollama_generate_async(
+        prompt,
+        host=host,
+        model=model,
+        num_predict=num_predict,
+        temperature=temperature,
+        cancel_event=cancel_event,
+        on_progress=on_progress,
+        num_ctx=num_ctx,
+        context=context,
+        stop=stop,
+        answer_key=answer_key,
+        info=info,
+        keep_alive=keep_alive,
+        progress_hz=progress_hz,
+        strip=strip,
+    ))
+
+def keep_alive_value(text):
+    """
+    keep_alive para Ollama desde el texto de la GUI: un número va como
+    segundos (-1 = siempre, 0 = descargar ya); "30m", "2h"... tal cual.
+    """
+    text = str(text).strip()
+    try:
+        return int(text)
+    except ValueError:
+        return text or DEFAULT_KEEP_ALIVE
+
+def preload_model(model: str, host: str, keep_alive=DEFAULT_KEEP_ALIVE, num_ctx: int = None, info: dict = None) -> float:
+    """
+    Carga el modelo en memoria sin generar nada (/api/generate con el
+    prompt vacío) y lo deja cargado keep_alive. Devuelve los segundos de
+    carga (load_duration; ~0 si ya estaba cargado).
+
+    num_ctx: si cambia, Ollama vuelve a cargar el modelo en la siguiente
+    petición. Por defecto se usa el último que se pidió para ese modelo
+    (last_num_ctx, guardado entre ejecuciones; el de Ollama si nunca se
+    ha usado). Queda en info["num_ctx"].
+    """
+    model = model.strip()
+    num_ctx = num_ctx or last_num_ctx(host, model)
+    payload = {"model": model, "prompt": "", "stream": False, "keep_alive": keep_alive_value(keep_alive)}
+    if num_ctx:
+        payload["options"] = {"num_ctx": int(num_ctx)}
+
+    async def load():
+        return await async_ollama_client(host).post_json("/api/generate", payload)
+
+    data = run_async(load())
+    if info is not None:
+        info.update({k: v for k, v in data.items() if k in OLLAMA_STATS_KEYS})
+        info["num_ctx"] = num_ctx
+    return data.get("load_duration", 0) / 1e9
+
+
+# ============================
+#  Apuntes para el prompt (forma compacta)
+# ============================
+#  El Markdown de pdf_to_md está pensado para leerlo una persona: lleva
+#  un <!-- page: N --> por página (~10 tokens cada uno), "###" en los
+#  títulos, líneas en blanco entre párrafos y a veces ligaduras (ﬁ, ﬂ)
+#  o espacios raros del PDF que el tokenizador parte en trozos.
+#  Al modelo se le manda una forma mínima y las páginas quedan aparte
+#  (PromptNotes.page_offsets), por si hay que citar o depurar.
+# ============================
+_LIGATURES = str.maketrans({
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\ufb05": "st", "\ufb06": "st",
+    "\u00a0": " ", "\u2007": " ", "\u2009": " ", "\u202f": " ", "\t": " ",
+    "\u00ad": None, "\u200b": None, "\ufeff": None,
+})
+_PAGE_MARK_RE = re.compile(r"<!--\s*page:\s*(\d+)\s*-->")
+_HEADING_MARK_RE = re.compile(r"^#{2,6}\s+")
+_SPACES_RE = re.compile(r" {2,}")
+
+class PromptNotes:
+    """
+    Apuntes tal como se mandan al modelo (serialize_notes).
+
+    - text: texto compacto, una línea por título/párrafo/viñeta
+    - page_nums/page_offsets: la página N empieza en ese offset de text
+      (lo que antes decían los <!-- page: N -->)
+    """
+
+    __slots__ = ("text", "page_nums", "page_offsets")
+
+    def __init__(self, text: str, page_nums, page_offsets):
+        self.text = text
+        self.page_nums = array("I", page_nums)
+        self.page_offsets = array("I", page_offsets)
+
+    def page_at(self, offset: int) -> int:
+        """Página (base 1) en la que cae un offset de text (0 si no hay páginas)."""
+        k = bisect.bisect_right(self.page_offsets, offset) - 1
+        return self.page_nums[k] if k >= 0 else (self.page_nums[0] if self.page_nums else 0)
+
+    def cite(self, fragment: str) -> int:
+        """Página donde aparece un fragmento del texto enviado (0 si no está)."""
+        pos = self.text.find(fragment)
+        return self.page_at(pos) if pos >= 0 else 0
+
+def serialize_notes(apuntes, model: str = None, info: dict = None) -> PromptNotes:
+    """
+    Forma compacta de los apuntes (Markdown o Documento) para el prompt:
+
+    - Sin <!-- page: N -->: la página pasa a PromptNotes.page_offsets.
+    - Títulos con un solo "#" (el nivel ya lo dice su numeración).
+    - Ligaduras (ﬁ -> fi), espacios raros y guiones blandos normalizados;
+      un solo espacio entre palabras.
+    - Un salto de línea entre bloques (sin líneas en blanco).
+
+    info (opcional): notes_tokens_before / notes_tokens_after /
+    page_markers.
+    """
+    text = apuntes.text if isinstance(apuntes, Documento) else apuntes
+    out = []
+    page_nums, page_offsets = array("I"), array("I")
+    pos = 0
+    for raw in text.split("\n"):
+        m = _PAGE_MARK_RE.fullmatch(raw.strip())
+        if m:
+            if page_offsets and page_offsets[-1] == pos:
+                page_nums[-1] = int(m.group(1))  # la página anterior no tenía texto
+            else:
+                page_nums.append(int(m.group(1)))
+                page_offsets.append(pos)
+            continue
+        line = _SPACES_RE.sub(" ", raw.translate(_LIGATURES)).strip()
+        if not line:
+            continue
+        line = _HEADING_MARK_RE.sub("# ", line)
+        out.append(line)
+        pos += len(line) + 1
+
+    notes = PromptNotes("\n".join(out), page_nums, page_offsets)
+    if info is not None:
+        info["notes_tokens_before"] = estimate_tokens(text, model) if text else 0
+        info["notes_tokens_after"] = estimate_tokens(notes.text, model) if notes.text else 0
+        info["page_markers"] = len(page_nums)
+    return notes
+
+
+# ============================
+#  Prompt builder (corto)
+# ============================
+PROMPT_NOTES_HEADER = "Eres profesor/a. Vas a crear un examen basado SOLO en estos apuntes.\n\nAPUNTES:"
+
+def format_spec(n_vf: int, n_short: int) -> str:
+    """
+    Descripción del "formato" en texto para guiar al modelo
+    (la usan build_prompt y build_repair_prompt).
+    """
+    total = n_vf + n_short
+    sections = ["## Examen"]
+
+    if n_vf > 0:
+        sections.append("### Verdadero o falso")
+        sections.append(f"- Escribe {n_vf} enunciados numerados del 1 al {n_vf}.")
+        sections.append("- Cada línea debe empezar con: `N. (V/F) ...` (obligatorio).")
+
+    if n_short > 0:
+        start = 1 if n_vf == 0 else (n_vf + 1)
+        end = total
+        sections.append("### Respuesta corta")
+        sections.append(f"- Escribe {n_short} preguntas numeradas del {start} al {end}.")
+        sections.append("- Deben ser preguntas reales (idealmente con `?`).")
+        sections.append("- No copies frases literales del apunte ni metas pistas obvias en el enunciado.")
+
+    sections.append("## Respuestas")
+    sections.append(f"- Da {total} respuestas numeradas del 1 al {total}.")
+
+    if n_vf > 0:
+        sections.append(f"- Para 1..{n_vf}: SOLO `V` o `F` (sin explicación).")
+    if n_short > 0:
+        start = 1 if n_vf == 0 else (n_vf + 1)
+        sections.append(f"- Para {start}..{total}: una sola frase corta (NO puede ser `V`/`F`).")
+
+    return "\n".join(sections)
+
+def build_prompt(apuntes_md, n_vf: int, n_short: int) -> str:
+    """
+    Construye un prompt breve (para que sea rápido) pero con directrices claras:
+    - Repartir preguntas entre diferentes secciones/temas del texto.
+    - Evitar meter pistas obvias en el enunciado de respuesta corta.
+    - Mantener formato fijo para poder validar.
+
+    Formato objetivo:
+    ## Examen
+    ### Verdadero o falso
+    1. (V/F) ...
+    ...
+    ### Respuesta corta
+    5. ¿...?
+    ...
+    ## Respuestas
+    1. V
+    2. F
+    ...
+    10. ...
+
+    apuntes_md puede ser el Markdown (str), el Documento de pdf_to_doc o
+    unos PromptNotes ya compactados; se manda la forma compacta
+    (serialize_notes).
+    """
+    if not isinstance(apuntes_md, PromptNotes):
+        apuntes_md = serialize_notes(apuntes_md)
+    apuntes_md = apuntes_md.text
+    total = n_vf + n_short
+    fmt = format_spec(n_vf, n_short)
+
+    # Los apuntes van PRIMERO y lo que cambia (cantidades, formato) al final:
+    # así dos peticiones sobre los mismos apuntes comparten el principio del
+    # prompt y Ollama reutiliza su caché (KV) en vez de volver a leerlo todo.
+    requisitos = dedent(f"""
+    Requisitos:
+    - Total preguntas: {total}
+    - Verdadero/Falso: {n_vf}
+    - Respuesta corta: {n_short}
+    - Reparte las preguntas entre distintos temas/secciones del texto (no te centres en un solo apartado).
+    - NO uses internet ni conocimientos externos.
+    - En `## Examen` SOLO van preguntas/enunciados. En `## Respuestas` SOLO van respuestas.
+
+    Formato obligatorio (Markdown):
+    """).strip()
+
+    prompt = (
+        f"{PROMPT_NOTES_HEADER}\n---\n{apuntes_md.strip()}\n---\n\n"
+        f"{requisitos}\n{fmt}"
+    )
+
+    return prompt
+
+
+# ============================
+#  Presupuesto de tokens (num_ctx)
+# ============================
+_TOKEN_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|\S")
+_model_ctx_cache = {}
+_profile_cache = {}  # ruta -> ((mtime_ns, tamaño), datos)
+
+def _load_json_profile(profile_path=None) -> dict:
+    """
+    Lee un perfil JSON de ~/.ollama_test_gen (tokens.json si no se da
+    ruta; {} si no existe o está roto). Se recuerda por
+    (ruta, mtime, tamaño): estimate_tokens lo consulta en cada párrafo y
+    así solo se vuelve a leer si el archivo cambia. El dict es compartido:
+    para modificarlo, copiarlo antes.
+    """
+    profile_path = pathlib.Path(profile_path or DEFAULT_TOKEN_PROFILE)
+    try:
+        st = profile_path.stat()
+    except OSError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _profile_cache.get(profile_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        data = json.loads(profile_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        data = {}
+    _profile_cache[profile_path] = (stamp, data)
+    return data
+
+def estimate_tokens(text: str, model: str = None, profile_path=None) -> int:
+    """
+    Estimación de tokens algo más fina que len(text) // 4:
+
+    - Palabras: 1 token hasta 5 letras y 1 más por cada 5 letras extra
+      (los tokenizadores parten las palabras largas: "indemnización").
+    - Números: 1 token por cada 3 cifras.
+    - Signos y marcas Markdown ("#", "-", "<!--"...): 1 por carácter.
+
+    Si se pasa model, se corrige con el factor aprendido de las cuentas
+    reales de Ollama para ese modelo (calibrate_tokens).
+    """
+    n = 0
+    for piece in _TOKEN_PIECE_RE.findall(text):
+        if piece[0].isdigit():
+            n += -(-len(piece) // 3)
+        elif piece[0].isalpha():
+            n += 1 + (len(piece) - 1) // 5
+        else:
+            n += 1
+    if model:
+        n *= _load_json_profile(profile_path).get(model.strip(), 1.0)
+    return max(1, int(n))
+
+def calibrate_tokens(model: str, estimated: int, real: int, profile_path=None):
+    """
+    Ajusta el factor de estimate_tokens para un modelo con el
+    prompt_eval_count que devolvió Ollama (media móvil, se guarda en JSON).
+
+    Si Ollama reutilizó parte del prompt de su caché, prompt_eval_count
+    sale mucho más bajo de lo real: esas medidas se descartan.
+    """
+    if not model or estimated <= 0 or not real or real < estimated * 0.5:
+        return
+    profile_path = pathlib.Path(profile_path or DEFAULT_TOKEN_PROFILE)
+    profile = dict(_load_json_profile(profile_path))
+    old = profile.get(model.strip(), 1.0)
+    # estimated ya viene corregido con el factor viejo
+    profile[model.strip()] = round(0.7 * old + 0.3 * old * real / estimated, 4)
+    try:
+        _atomic_write_text(profile_path, json.dumps(profile, indent=2))
+    except OSError:
+        pass
+
+# ============================
+#  num_predict adaptativo
+# ============================
+def _solve_linear(a: list, b: list) -> list:
+    """Resuelve a·x = b (sistema pequeño, eliminación gaussiana con pivote)."""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        piv = max(range(col, n), key=lambda i: abs(m[i][col]))
+        m[col], m[piv] = m[piv], m[col]
+        for i in range(col + 1, n):
+            f = m[i][col] / m[col][col]
+            for j in range(col, n + 1):
+                m[i][j] -= f * m[col][j]
+    x = [0.0] * n
+    for i in range(n - 1, -1, -1):
+        x[i] = (m[i][n] - sum(m[i][j] * x[j] for j in range(i + 1, n))) / m[i][i]
+    return x
+
+def output_token_rates(model: str, profile_path=None) -> dict:
+    """
+    Tokens de salida aprendidos para un modelo: {"base", "vf", "short",
+    "samples"}. Mínimos cuadrados sobre su historial, tirando hacia
+    OUTPUT_TOKENS_PRIOR (pesa como OUTPUT_PRIOR_WEIGHT exámenes), así con
+    0-2 exámenes guardados sale algo razonable.
+    """
+    samples = _load_json_profile(profile_path or DEFAULT_OUTPUT_PROFILE).get((model or "").strip(), [])
+    keys = ("base", "vf", "short")
+    prior = [float(OUTPUT_TOKENS_PRIOR[k]) for k in keys]
+    a = [[OUTPUT_PRIOR_WEIGHT if i == j else 0.0 for j in range(3)] for i in range(3)]
+    b = [OUTPUT_PRIOR_WEIGHT * w for w in prior]
+    for n_vf, n_short, tokens in samples:
+        x = (1.0, n_vf, n_short)
+        for i in range(3):
+            b[i] += x[i] * tokens
+            for j in range(3):
+                a[i][j] += x[i] * x[j]
+    rates = {k: max(0.0, w) for k, w in zip(keys, _solve_linear(a, b))}
+    rates["samples"] = len(samples)
+    return rates
+
+def predict_num_predict(model: str, n_vf: int, n_short: int, profile_path=None) -> int:
+    """num_predict para este examen: tokens esperados + NUM_PREDICT_MARGIN."""
+    rates = output_token_rates(model, profile_path)
+    need = rates["base"] + rates["vf"] * n_vf + rates["short"] * n_short
+    return max(MIN_NUM_PREDICT, min(MAX_NUM_PREDICT, math.ceil(need * (1 + NUM_PREDICT_MARGIN))))
+
+_output_profile_lock = threading.Lock()
+
+def record_output_tokens(model: str, n_vf: int, n_short: int, tokens: int, profile_path=None):
+    """
+    Guarda los tokens de salida reales (eval_count) de un examen válido.
+    Solo cuenta la generación que dio el examen (primera llamada +
+    continuaciones), no las reparaciones (ver exam_output_tokens).
+    """
+    if not model or tokens <= 0 or n_vf + n_short <= 0:
+        return
+    profile_path = pathlib.Path(profile_path or DEFAULT_OUTPUT_PROFILE)
+    with _output_profile_lock:  # los trozos del examen por secciones acaban a la vez
+        profile = dict(_load_json_profile(profile_path))
+        samples = profile.get(model.strip(), []) + [[n_vf, n_short, int(tokens)]]
+        profile[model.strip()] = samples[-OUTPUT_HISTORY:]
+        try:
+            _atomic_write_text(profile_path, json.dumps(profile))
+        except OSError:
+            pass
+
+def model_ctx_limit(model: str, host: str = None) -> int:
+    """
+    Contexto máximo del modelo. Primero se pregunta a Ollama
+    (/api/show -> "<arquitectura>.context_length"); si no contesta,
+    MODEL_CTX_LIMITS o DEFAULT_MODEL_CTX. Se recuerda por (host, modelo).
+    """
+    model = model.strip()
+    key = (host, model)
+    if key in _model_ctx_cache:
+        return _model_ctx_cache[key]
+
+    limit = None
+    if host:
+        try:
+            r = ollama_client(host).post("/api/show", json={"model": model}, timeout=(3, 10))
+            r.raise_for_status()
+            for k, v in (r.json().get("model_info") or {}).items():
+                if k.endswith(".context_length") and isinstance(v, int):
+                    limit = v
+                    break
+        except (requests.RequestException, ValueError):
+            pass
+    if not limit:
+        limit = MODEL_CTX_LIMITS.get(model, DEFAULT_MODEL_CTX)
+    _model_ctx_cache[key] = limit
+    return limit
+
+def plan_token_budget(fixed_tokens: int, notes_tokens: int, num_predict: int, ctx_limit: int) -> dict:
+    """
+    Decide num_ctx y cuántos tokens de apuntes caben.
+
+    - fixed_tokens: el prompt sin apuntes (instrucciones + formato)
+    - notes_tokens: los apuntes
+    - num_predict: tokens reservados para la respuesta
+    - ctx_limit: contexto máximo del modelo (model_ctx_limit)
+
+    Devuelve un dict con: limit, num_ctx, notes_tokens, notes_budget,
+    prompt_tokens (con los apuntes que caben), num_predict y trimmed.
+    """
+    limit = max(MIN_NUM_CTX, min(ctx_limit, MAX_NUM_CTX))
+    usable = int(limit / (1 + CTX_SAFETY_MARGIN))
+    notes_budget = max(0, usable - fixed_tokens - num_predict)
+    kept = min(notes_tokens, notes_budget)
+
+    need = int((fixed_tokens + kept + num_predict) * (1 + CTX_SAFETY_MARGIN))
+    num_ctx = MIN_NUM_CTX
+    while num_ctx < need:
+        num_ctx *= 2
+
+    return {
+        "limit": limit,
+        "num_ctx": min(num_ctx, limit),
+        "notes_tokens": notes_tokens,
+        "notes_budget": notes_budget,
+        "prompt_tokens": fixed_tokens + kept,
+        "num_predict": num_predict,
+        "trimmed": notes_tokens > notes_budget,
+    }
+
+def trim_notes(doc, max_tokens: int, model: str = None) -> str:
+    """
+    Recorta los apuntes a ~max_tokens sin quedarse solo con el principio:
+    cada página conserva su marcador y sus títulos, y de sus párrafos
+    se queda con los primeros hasta su parte proporcional del presupuesto.
+    Así el examen puede seguir repartiéndose entre todos los temas.
+    """
+    text = doc.text
+    total = estimate_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    ratio = max_tokens / total
 
-        # línea normal => acumular
-        paragraph.append(line)
+    bounds = list(doc.page_offsets) or [0]
+    bounds.append(len(text))
+    heading_starts = [sec.start for sec in doc.sections]
+
+    out = []
+    for a, b in zip(bounds, bounds[1:]):
+        # marcador <!-- page: N --> y títulos: siempre
+        keep = []
+        starts = ([a] if a in doc.page_offsets else []) + [h for h in heading_starts if a <= h < b]
+        for h in starts:
+            end = text.find("\n", h, b)
+            keep.append((h, b if end < 0 else end))
+
+        quota = ratio * estimate_tokens(text[a:b], model)
+        used = 0
+        for p_start, p_end in doc.iter_paragraphs(a, b):
+            t = estimate_tokens(text[p_start:p_end], model)
+            if used + t > quota:
+                break
+            used += t
+            keep.append((p_start, p_end))
+
+        out.extend(text[s:e].strip() for s, e in sorted(keep))
 
-    flush_paragraph()
+    return "\n\n".join(x for x in out if x) + "\n"
 
-    md_text = "\n".join(out)
-    md_text = re.sub(r"\n{3,}", "\n\n", md_text).strip() + "\n"
-    pathlib.Path(path_md).write_text(md_text, encoding="utf-8")
-    return md_text
+def fit_prompt(doc, n_vf: int, n_short: int, model: str, num_predict: int, host: str = None) -> tuple:
+    """
+    Construye el prompt ajustado a la ventana del modelo.
+    Devuelve (prompt, budget) con budget = plan_token_budget(...);
+    "estimated" y "prompt_tokens" pasan a ser los del prompt final.
+    Los apuntes van en forma compacta (serialize_notes): budget["notes"]
+    son esos PromptNotes (con el mapa de páginas) y
+    budget["notes_tokens_before"] lo que costaría el Markdown tal cual.
+    """
+    fixed = estimate_tokens(build_prompt("", n_vf, n_short), model)
+    lean_info = {}
+    notes = serialize_notes(doc, model, info=lean_info)
+    budget = plan_token_budget(fixed, lean_info["notes_tokens_after"], num_predict, model_ctx_limit(model, host))
+
+    if budget["trimmed"]:
+        notes = serialize_notes(trim_notes(doc, budget["notes_budget"], model))
+    prompt = build_prompt(notes, n_vf, n_short)
+    budget["estimated"] = budget["prompt_tokens"] = estimate_tokens(prompt, model)
+    budget["notes"] = notes
+    budget["notes_tokens_before"] = lean_info["notes_tokens_before"]
+    return prompt, budget
+
+def budget_text(budget: dict) -> str:
+    """Resumen de una decisión de presupuesto para el log."""
+    return (
+        f"prompt ~{budget['prompt_tokens']} tokens (apuntes ~{budget['notes_tokens']}) + "
+        f"salida {budget['num_predict']} -> num_ctx {budget['num_ctx']} (límite {budget['limit']})"
+    )
 
 
 # ============================
-#  Ollama streaming + cancel
+#  Generación + reintento
 # ============================
-class CancelledByUser(Exception):
+STRICT_RETRY_RULE = (
+    "\n\nREGLA FINAL: NO pongas respuestas en '## Examen'. Responde SOLO en '## Respuestas'. "
+    "Respeta numeración 1..N."
+)
+
+# Reintento sobre el "context" de la primera llamada: los apuntes ya están
+# procesados, así que basta con una instrucción corta
+STRICT_RETRY_FOLLOWUP = (
+    "Tu respuesta anterior NO cumple el formato obligatorio. Escribe otra vez el examen "
+    "COMPLETO desde `## Examen`, con el formato y las cantidades pedidas."
+    + STRICT_RETRY_RULE
+)
+
+# Continuación de una salida cortada por num_predict (done_reason "length"):
+# va sobre el context de esa llamada, que ya tiene el prompt y lo generado
+CONTINUE_FOLLOWUP = (
+    "Te has cortado. Continúa EXACTAMENTE donde lo dejaste, sin repetir nada de lo "
+    "anterior, hasta terminar `## Respuestas`."
+)
+CONTINUE_MAX_ROUNDS = 3
+
+def build_repair_prompt(md: str, problems: list, n_vf: int, n_short: int) -> str:
     """
-    Excepción interna para cortar el proceso cuando el usuario pulsa "Cancelar".
+    Prompt de reparación: SOLO la salida mal formada + la lista exacta de
+    problemas (output_problems). No lleva los apuntes, así que es una
+    fracción del prompt original.
     """
-    pass
+    errores = "\n".join(f"- {p}" for p in problems)
+    return (
+        "Este examen en Markdown tiene errores de FORMATO. Corrígelos sin cambiar el contenido "
+        "de las preguntas ni de las respuestas que ya están bien.\n\n"
+        f"Errores:\n{errores}\n\n"
+        f"Formato obligatorio (Markdown):\n{format_spec(n_vf, n_short)}\n\n"
+        f"EXAMEN A CORREGIR:\n---\n{md.strip()}\n---\n\n"
+        "Devuelve SOLO el examen corregido, desde `## Examen`."
+    )
+
+def build_fill_prompt(missing: list, items: dict, n_vf: int, n_short: int) -> str:
+    """
+    Instrucción para regenerar SOLO las preguntas `missing`, con su
+    número, sin repetir las que ya están bien (items).
+    Va detrás del context de la primera llamada o del prompt original,
+    así que los apuntes ya están "leídos".
+    """
+    vf = [k for k in missing if k <= n_vf]
+    short = [k for k in missing if k > n_vf]
+    nums = ", ".join(str(k) for k in missing)
+
+    lines = [f"Del examen faltan (o están mal) las preguntas {nums}. Escribe SOLO esas, con su mismo número.", ""]
+    if items:
+        lines.append("No repitas estas, que ya están:")
+        lines += [f"- {q}" for _k, (q, _a) in sorted(items.items())]
+        lines.append("")
+    lines.append("Formato obligatorio (Markdown):")
+    lines.append("## Examen")
+    if vf:
+        lines.append("### Verdadero o falso")
+        lines.append(f"- Enunciados {', '.join(map(str, vf))}: cada línea `N. (V/F) ...`.")
+    if short:
+        lines.append("### Respuesta corta")
+        lines.append(f"- Preguntas {', '.join(map(str, short))}: `N. ¿...?`.")
+    lines.append("## Respuestas")
+    if vf:
+        lines.append(f"- Para {', '.join(map(str, vf))}: SOLO `V` o `F`.")
+    if short:
+        lines.append(f"- Para {', '.join(map(str, short))}: una sola frase corta (NO puede ser `V`/`F`).")
+    return "\n".join(lines)
+
+def prefill_text(info: dict) -> str:
+    """Resumen del prefill de una llamada (tokens de prompt procesados y tiempo)."""
+    secs = info.get("prompt_eval_duration", 0) / 1e9
+    return f"prefill {info.get('prompt_eval_count', 0)} tokens en {secs:.1f}s"
+
+_LINE_START_RE = re.compile(r"\s*(#+|\d+\.)(?=\s|$)")
+
+def join_continuation(prev: str, more: str) -> str:
+    """
+    Une una salida cortada con su continuación, las dos tal cual
+    (strip=False: si el corte cayó a mitad de palabra, no se mete un
+    espacio).
+
+    - Si el modelo vuelve a empezar la última línea (a medias) con el
+      mismo "N." o título, esa línea a medias se quita de prev.
+    - Si repite el final de la última línea, se quita el solape.
+    - Si empieza una línea nueva (título o "N.") tras una línea con
+      texto, la pone aparte; si no, se pega sin más.
+    """
+    if not more.strip():
+        return prev
+    last = prev.rpartition("\n")[2]
+    head = _LINE_START_RE.match(last)
+    again = _LINE_START_RE.match(more)
+    if head and again and head.group(1) == again.group(1):
+        return prev[:len(prev) - len(last)] + more.lstrip()
+    for k in range(min(len(last), len(more)), 3, -1):
+        if last.endswith(more[:k]):
+            return prev + more[k:]
+    if prev[-1:].isspace() or more[:1].isspace():
+        return prev + more
+    if last.strip() and re.match(r"(#|\d+\.\s)", more):
+        return prev + "\n" + more
+    return prev + more
+
+def continue_truncated(
+    result: str, stats: dict, answers, *, num_ctx: int = None, info: list = None, check=None, **call
+) -> str:
+    """
+    Si la salida se cortó por num_predict (done_reason == "length"),
+    pide al modelo que siga donde lo dejó (CONTINUE_FOLLOWUP) sobre el
+    context de esa llamada, hasta que "## Respuestas" tiene todas las
+    respuestas (answers) o CONTINUE_MAX_ROUNDS. Ni el prompt ni lo ya
+    generado se vuelven a pagar.
+
+    num_ctx: el context ya ocupa casi todo el de la llamada cortada, así
+    que se duplica lo necesario para que quepa otro num_predict (sin
+    pasar del límite del modelo; si no cabe, se deja como está).
+    info: lista opcional; se añaden las estadísticas de cada continuación.
+    check: el de AnswerKeyWatcher (cortar solo si el examen ya es válido).
+    result: la salida cortada tal cual (strip=False); se devuelve igual,
+    sin quitar blancos de los extremos.
+    call: model, host, num_predict, temperature, cancel_event, on_progress.
+    """
+    rounds = [] if info is None else info
+    limit = min(model_ctx_limit(call["model"], call["host"]), MAX_NUM_CTX)
+
+    while stats.get("done_reason") == "length" and stats.get("context") and len(rounds) < CONTINUE_MAX_ROUNDS:
+        watcher = AnswerKeyWatcher(answers)
+        if watcher.feed(result + "\n"):
+            break
+
+        context = stats["context"]
+        need = len(context) + estimate_tokens(CONTINUE_FOLLOWUP) + int(call["num_predict"])
+        cont_ctx = num_ctx
+        while cont_ctx and need > cont_ctx:
+            cont_ctx *= 2
+        if cont_ctx and cont_ctx > max(limit, num_ctx):
+            break
+
+        watcher = AnswerKeyWatcher(answers, check)
+        watcher.feed(result)  # la última línea (a medias) queda pendiente
+        stats = {}
+        rounds.append(stats)
+        more = ollama_generate_stream(
+            CONTINUE_FOLLOWUP,
+            num_ctx=cont_ctx,
+            context=context,
+            info=stats,
+            stop=EXAM_STOP_SEQUENCES,
+            answer_key=watcher,
+            strip=False,
+            **call,
+        )
+        result = join_continuation(result, more)
+    return result
 
-def ollama_generate_stream(
+def generate_exam(
     prompt: str,
+    n_vf: int,
+    n_short: int,
     *,
-    model: str,
-    host: str,
-    num_predict: int,
-    temperature: float,
-    cancel_event: threading.Event,
-    on_progress=None,
+    num_ctx: int = None,
+    info: dict = None,
+    log=None,
+    **call,
 ) -> str:
     """
-    Llama a Ollama /api/generate en modo streaming (stream=True).
-
-    Ventajas:
-    - Podemos ir actualizando el tiempo transcurrido.
-    - Podemos cancelar sin esperar a que termine todo.
-
-    cancel_event:
-    - Si el usuario pulsa Cancelar, se activa el event y cortamos.
-
-    on_progress:
-    - Callback opcional: on_progress(texto_actual, elapsed_seconds)
-      útil para mostrar tiempo en GUI.
-    """
-    url = f"{host}/api/generate"
-    payload = {
-        "model": model.strip(),
-        "prompt": prompt,
-        "stream": True,
-        "options": {
-            "num_predict": int(num_predict),
-            "temperature": float(temperature),
-        }
-    }
-
-    response = None
-    chunks = []
-    start = None
+    Genera un examen y, si validate_output falla:
+
+    0) Si cada pregunta está bien por separado (exam_items) y solo falla
+       la estructura, se rehace el Markdown aquí mismo, sin llamar al
+       modelo. Si faltan o están mal unas pocas (<= PARTIAL_MAX_FRACTION),
+       se piden SOLO esas (build_fill_prompt) y se encajan en su número.
+    1) Reparación: se manda SOLO la salida mal formada + la lista de
+       problemas (build_repair_prompt), sin los apuntes. Suele bastar
+       cuando el fallo es de formato (numeración, V/F en una respuesta
+       corta, falta "## Respuestas"...) y cuesta segundos.
+    2) Si sigue mal, reintento estricto (temperature 0.0) del examen
+       entero. Tampoco reenvía los apuntes: sigue sobre el "context" de
+       la primera llamada con una instrucción corta
+       (STRICT_RETRY_FOLLOWUP), así Ollama se salta casi todo el
+       prefill. Si no hay context (o no cabe en num_ctx junto con otra
+       respuesta), reenvía el prompt + la regla al final: como el
+       principio es el mismo, Ollama reutiliza su caché igual.
+
+    Si la primera salida (o la del reintento) se corta por num_predict,
+    antes de nada se continúa sobre su context (continue_truncated).
+
+    Todas las llamadas cortan el stream en cuanto "## Respuestas" está
+    completo (answer_key + EXAM_STOP_SEQUENCES): lo que el modelo
+    escribiera después no se decodifica. La primera (y sus
+    continuaciones) solo si lo escrito ya pasa validate_output: si no,
+    se deja terminar para tener el context del relleno y el reintento.
+
+    call: model, host, num_predict, temperature, cancel_event, on_progress
+    (los de ollama_generate_stream).
+    info: dict opcional; se rellena con "first" y (si hubo) "problems",
+    "continue" (lista), "fill" (+ "fill_items"), "repair" y "retry", cada
+    uno con las estadísticas de su llamada ("mode" en "fill" y "retry": "context"
+    o "prompt" si hubo que reenviar los apuntes), y "saved_tokens" (estimación:
+    tokens que no se llegaron a generar por los cortes anticipados).
+    """
+    log = log or (lambda _msg: None)
+    info = {} if info is None else info
+    total = n_vf + n_short
+    answers = range(1, total + 1)
+    valid = lambda text: validate_output(text, n_vf, n_short)
 
+    first = info["first"] = {}
     try:
-        # timeout=(connect_timeout, read_timeout)
-        # read_timeout=None => sin límite (evita "Read timed out" en modelos lentos)
-        response = requests.post(url, json=payload, stream=True, timeout=(10, None))
-        response.raise_for_status()
-
-        start = time.time()
-
-        # Ollama envía JSON por líneas (JSONL)
-        for line in response.iter_lines(decode_unicode=True):
-            # Permite cancelar durante el stream
-            if cancel_event.is_set():
-                raise CancelledByUser()
-
-            if not line:
-                continue
+        # sin strip: si hay que continuarla, el corte puede caer a mitad de palabra
+        result = ollama_generate_stream(
+            prompt, num_ctx=num_ctx, info=first, stop=EXAM_STOP_SEQUENCES,
+            answer_key=AnswerKeyWatcher(answers, valid), strip=False, **call
+        )
+        if first.get("done_reason") == "length":
+            log("⏩ Salida cortada por num_predict: continuando donde se quedó...")
+            result = continue_truncated(
+                result, first, answers, num_ctx=num_ctx, info=info.setdefault("continue", []), check=valid, **call
+            )
+        return _generate_exam_fix(prompt, result.strip(), n_vf, n_short, num_ctx, info, log, call)
+    finally:
+        info["saved_tokens"] = saved_tokens(info)
 
-            try:
-                data = json.loads(line)
-            except json.JSONDecodeError:
-                continue
 
-            # trozo del texto generado
-            piece = data.get("response", "")
-            if piece:
-                chunks.append(piece)
+def saved_tokens(info: dict) -> int:
+    """
+    Suma, para las llamadas de generate_exam que se cortaron al completar
+    las respuestas, los tokens que quedaban de num_predict: una
+    estimación (eval_count es el nº de mensajes recibidos y num_predict
+    solo es el tope de lo que el modelo habría seguido escribiendo).
+    """
+    total = 0
+    calls = [info.get(key) or {} for key in ("first", "fill", "repair", "retry")]
+    for stats in calls + info.get("continue", []):
+        if stats.get("stopped_early"):
+            total += max(0, stats.get("num_predict", 0) - stats.get("eval_count", 0))
+    return total
 
-            # informar progreso (tiempo)
-            if on_progress:
-                elapsed = time.time() - start
-                on_progress("".join(chunks), elapsed)
 
-            # fin del streaming
-            if data.get("done") is True:
-                break
+def exam_output_tokens(info: dict) -> int:
+    """
+    Tokens de salida que necesitó el examen (primera llamada +
+    continuaciones) si salió bien a la primera; 0 si hubo que repararlo
+    (entonces no dice nada de cuánto escribe el modelo).
+    """
+    if info.get("problems") or "first" not in info:
+        return 0
+    return sum(c.get("eval_count", 0) for c in [info["first"]] + info.get("continue", []))
 
-        return "".join(chunks).strip()
 
-    except CancelledByUser:
-        # Cerramos conexión para no dejarla colgada
-        try:
-            if response is not None:
-                response.close()
-        except Exception:
-            pass
-        raise
+def _generate_exam_fix(prompt, result, n_vf, n_short, num_ctx, info, log, call) -> str:
+    """Pasos 0-2 de generate_exam sobre la primera salida."""
+    # si se continuó una salida cortada, el context bueno es el de la última continuación
+    first = (info.get("continue") or [info["first"]])[-1]
+    problems = info["problems"] = output_problems(result, n_vf, n_short)
+    if not problems:
+        return result
 
-    finally:
-        # Asegurar cierre del response pase lo que pase
-        try:
-            if response is not None:
-                response.close()
-        except Exception:
-            pass
+    total = n_vf + n_short
+    answers = range(1, total + 1)
+    stop = EXAM_STOP_SEQUENCES
+    items = exam_items(result, n_vf, n_short)
+    missing = broken_items(items, n_vf, n_short)
+    if not missing:
+        log("🩹 Preguntas correctas pero estructura rara: examen rehecho sin llamar al modelo.")
+        return render_items(items, n_vf, n_short)
+
+    if items and len(missing) <= total * PARTIAL_MAX_FRACTION:
+        log(f"🩹 Regenerando solo las preguntas {', '.join(map(str, missing))}...")
+        fill = info["fill"] = {}
+        info["fill_items"] = missing
+        fill_prompt = build_fill_prompt(missing, items, n_vf, n_short)
+        fill_call = {
+            **call,
+            "num_predict": int(call["num_predict"]) * len(missing) // total + MAP_PART_EXTRA_PREDICT,
+        }
+        context = first.get("context")
+        need = len(context or ()) + estimate_tokens(fill_prompt) + fill_call["num_predict"]
+        if context and (not num_ctx or need <= num_ctx):
+            extra = ollama_generate_stream(
+                fill_prompt, num_ctx=num_ctx, context=context, info=fill,
+                stop=stop, answer_key=missing, **fill_call,
+            )
+            fill["mode"] = "context"
+        else:
+            extra = ollama_generate_stream(
+                prompt + "\n\n" + fill_prompt, num_ctx=num_ctx, info=fill,
+                stop=stop, answer_key=missing, **fill_call,
+            )
+            fill["mode"] = "prompt"
+
+        for k, item in exam_items(extra, n_vf, n_short).items():
+            if k in missing:
+                items[k] = item
+        still = broken_items(items, n_vf, n_short)
+        if not still:
+            return render_items(items, n_vf, n_short)
+        log(f"⚠️ La regeneración parcial no completó el examen (siguen mal: {', '.join(map(str, still))}).")
+
+    # Mismo num_ctx que la primera llamada si cabe: si cambia, Ollama recarga el modelo.
+    # Si hay que ampliarlo, sin pasar del límite del modelo (como continue_truncated)
+    repair_prompt = build_repair_prompt(result, problems, n_vf, n_short)
+    need = estimate_tokens(repair_prompt, call["model"]) + int(call["num_predict"])
+    repair_ctx = num_ctx
+    if repair_ctx:
+        limit = max(min(model_ctx_limit(call["model"], call["host"]), MAX_NUM_CTX), num_ctx)
+        while need > repair_ctx and repair_ctx < limit:
+            repair_ctx = min(repair_ctx * 2, limit)
+    if repair_ctx and need > repair_ctx:
+        log(f"⚠️ La reparación (~{need} tokens) no cabe en el contexto del modelo ({repair_ctx}): se pasa al reintento.")
+    else:
+        log("🩹 Formato incorrecto, reparando (sin reenviar apuntes): " + " ".join(problems))
+        repair = info["repair"] = {}
+        repaired = ollama_generate_stream(
+            repair_prompt, num_ctx=repair_ctx, info=repair, stop=stop, answer_key=answers,
+            **{**call, "temperature": 0.0},
+        )
+        if validate_output(repaired, n_vf, n_short):
+            return repaired
+
+    log("⚠️ Salida rara. Reintento 1 vez (estricto + temp 0.0)...")
+    retry = info["retry"] = {}
+    call["temperature"] = 0.0
+
+    context = first.get("context")
+    need = len(context or ()) + estimate_tokens(STRICT_RETRY_FOLLOWUP) + int(call["num_predict"])
+    if context and (not num_ctx or need <= num_ctx):
+        result = ollama_generate_stream(
+            STRICT_RETRY_FOLLOWUP, num_ctx=num_ctx, context=context, info=retry,
+            stop=stop, answer_key=answers, strip=False, **call,
+        )
+        retry["mode"] = "context"
+    else:
+        result = ollama_generate_stream(
+            prompt + STRICT_RETRY_RULE, num_ctx=num_ctx, info=retry,
+            stop=stop, answer_key=answers, strip=False, **call,
+        )
+        retry["mode"] = "prompt"
+    if retry.get("done_reason") == "length":
+        result = continue_truncated(
+            result, retry, answers, num_ctx=num_ctx, info=info.setdefault("continue", []), **call
+        )
+    return result.strip()
 
 
 # ============================
-#  Prompt builder (corto)
+#  Examen por secciones (map-reduce)
+# ============================
+#  Con apuntes largos, un único prompt enorme es lento (el prefill
+#  crece con el tamaño) y el modelo tiende a preguntar solo del
+#  principio. Aquí:
+#  1) map:    se parten los apuntes por temas y se reparte el nº de
+#             preguntas en proporción al tamaño de cada trozo
+#  2)         se pide un mini-examen por trozo, varios a la vez
+#  3) reduce: se juntan y se renumeran en un examen con el formato
+#             de siempre (el que comprueba validate_output)
 # ============================
-def build_prompt(apuntes_md: str, n_vf: int, n_short: int) -> str:
+def _section_units(doc) -> list:
     """
-    Construye un prompt breve (para que sea rápido) pero con directrices claras:
-    - Repartir preguntas entre diferentes secciones/temas del texto.
-    - Evitar meter pistas obvias en el enunciado de respuesta corta.
-    - Mantener formato fijo para poder validar.
+    Unidades indivisibles para repartir: [(título, inicio, fin)].
+    - Temas de primer nivel si hay al menos 2
+    - Si no, páginas
+    - Si tampoco, el documento entero
+    """
+    if doc.sections:
+        top = min(sec.level for sec in doc.sections)
+        heads = [sec for sec in doc.sections if sec.level == top]
+        if len(heads) >= 2:
+            starts = [0] + [sec.start for sec in heads[1:]]
+            ends = starts[1:] + [len(doc.text)]
+            return [(sec.title, a, b) for sec, a, b in zip(heads, starts, ends)]
+
+    if len(doc.page_offsets) >= 2:
+        starts = [0] + list(doc.page_offsets[1:])
+        ends = starts[1:] + [len(doc.text)]
+        return [(f"Página {n}", a, b) for n, a, b in zip(doc.page_nums, starts, ends)]
+
+    return [("Apuntes", 0, len(doc.text))]
+
+def _largest_remainder(n: int, weights: list) -> list:
+    """Reparte n unidades en proporción a weights (método del resto mayor)."""
+    total = sum(weights)
+    if n <= 0 or total <= 0:
+        return [0] * len(weights)
+    quotas = [n * w / total for w in weights]
+    counts = [int(q) for q in quotas]
+    order = sorted(range(len(weights)), key=lambda k: (counts[k] - quotas[k], k))
+    for k in order[:n - sum(counts)]:
+        counts[k] += 1
+    return counts
+
+def plan_sections(doc, n_vf: int, n_short: int, max_parts: int = MAP_MAX_PARTS) -> list:
+    """
+    Parte el documento en trozos contiguos de tamaño parecido y reparte
+    las preguntas de cada tipo en proporción al tamaño de cada trozo.
 
-    Formato objetivo:
-    ## Examen
-    ### Verdadero o falso
-    1. (V/F) ...
-    ...
-    ### Respuesta corta
-    5. ¿...?
-    ...
-    ## Respuestas
-    1. V
-    2. F
-    ...
-    10. ...
+    Devuelve [{"title", "start", "end", "n_vf", "n_short"}, ...] solo con
+    los trozos que tienen alguna pregunta.
+    """
+    units = _section_units(doc)
+    k = max(1, min(max_parts, n_vf + n_short, len(units)))
+
+    # cortes donde el tamaño acumulado se acerca más a g/k del total
+    size = len(doc.text) or 1
+    ends = [b for _t, _a, b in units]
+    cuts = []
+    for g in range(1, k):
+        lo = cuts[-1] + 1 if cuts else 1
+        hi = len(units) - (k - g)
+        best = min(range(lo, hi + 1), key=lambda j: abs(ends[j - 1] - g * size / k))
+        cuts.append(best)
+
+    groups = []
+    for a, b in zip([0] + cuts, cuts + [len(units)]):
+        groups.append({"title": units[a][0], "start": units[a][1], "end": units[b - 1][2]})
+
+    sizes = [grp["end"] - grp["start"] for grp in groups]
+    for grp, vf, sh in zip(groups, _largest_remainder(n_vf, sizes), _largest_remainder(n_short, sizes)):
+        grp["n_vf"], grp["n_short"] = vf, sh
+    return [grp for grp in groups if grp["n_vf"] + grp["n_short"] > 0]
+
+def parse_exam(md: str, n_vf: int, n_short: int) -> dict:
+    """
+    Saca las preguntas y respuestas de un examen con el formato de
+    build_prompt: {"vf": [(enunciado, respuesta)], "short": [...]}.
+    Es tolerante: si algo falta, la respuesta queda como "".
+    """
+    exam_part, _, ans_part = md.partition("## Respuestas")
+    answers = {}
+    for k, content in re.findall(r"(?m)^\s*(\d+)\.\s+(.+)$", ans_part):
+        answers.setdefault(int(k), content.strip())
+
+    vf, short = [], []
+    m = re.search(r"(?is)###\s+Verdadero\s+o\s+falso\s*(.*?)(###\s+Respuesta\s+corta|$)", exam_part)
+    if n_vf > 0 and m:
+        for k, q in re.findall(r"(?m)^\s*(\d+)\.\s*\(V/F\)\s+(.+)$", m.group(1)):
+            vf.append((q.strip(), answers.get(int(k), "")))
+    m = re.search(r"(?is)###\s+Respuesta\s+corta\s*(.*)$", exam_part)
+    if n_short > 0 and m:
+        for k, q in re.findall(r"(?m)^\s*(\d+)\.\s+(?!\(V/F\))(.+)$", m.group(1)):
+            short.append((q.strip(), answers.get(int(k), "")))
+    return {"vf": vf[:n_vf], "short": short[:n_short]}
+
+def merge_exams(parts: list) -> str:
     """
+    Junta varios parse_exam(...) en un solo examen renumerado:
+    primero todas las V/F, luego todas las de respuesta corta.
+    """
+    vf = [item for part in parts for item in part["vf"]]
+    short = [item for part in parts for item in part["short"]]
+
+    out = ["## Examen", ""]
+    n = 0
+    if vf:
+        out.append("### Verdadero o falso")
+        for q, _a in vf:
+            n += 1
+            out.append(f"{n}. (V/F) {q}")
+        out.append("")
+    if short:
+        out.append("### Respuesta corta")
+        for q, _a in short:
+            n += 1
+            out.append(f"{n}. {q}")
+        out.append("")
+
+    out += ["## Respuestas", ""]
+    for n, (_q, a) in enumerate(vf + short, start=1):
+        out.append(f"{n}. {a}")
+    return "\n".join(out) + "\n"
+
+def generate_exam_by_sections(
+    doc,
+    n_vf: int,
+    n_short: int,
+    *,
+    model: str,
+    host: str,
+    num_predict: int = None,
+    temperature: float,
+    cancel_event: threading.Event,
+    concurrency: int = DEFAULT_MAP_CONCURRENCY,
+    on_progress=None,
+    log=None,
+    keep_alive=None,
+) -> str:
+    """
+    Genera el examen trozo a trozo (plan_sections) con hasta
+    `concurrency` peticiones a Ollama a la vez, y devuelve el examen
+    ya unido y renumerado (merge_exams).
+
+    num_predict: total para el examen (se reparte por preguntas) o None
+    para predecir el de cada trozo (predict_num_predict).
+
+    Cada trozo lleva su propio presupuesto de tokens (fit_prompt) y se
+    reintenta 1 vez en modo estricto si su salida no tiene el formato
+    (generate_exam).
+    log: callback opcional log(texto) para ir informando.
+    keep_alive: el de ollama_generate_stream.
+    """
+    log = log or (lambda _msg: None)
     total = n_vf + n_short
+    plan = plan_sections(doc, n_vf, n_short)
+    for grp in plan:
+        log(f"🧩 {grp['title'][:60]}: {grp['n_vf']} V/F + {grp['n_short']} cortas")
+
+    def run_part(grp):
+        q = grp["n_vf"] + grp["n_short"]
+        if num_predict is None:
+            predict = predict_num_predict(model, grp["n_vf"], grp["n_short"])
+        else:
+            predict = int(num_predict * q / total) + MAP_PART_EXTRA_PREDICT
+        part = doc.slice(grp["start"], grp["end"])
+        prompt, budget = fit_prompt(part, grp["n_vf"], grp["n_short"], model, predict, host)
+        part_log = lambda msg: log(f"{msg} [{grp['title'][:40]}]")
+        gen_info = {}
+        result = generate_exam(
+            prompt,
+            grp["n_vf"],
+            grp["n_short"],
+            model=model,
+            host=host,
+            num_predict=predict,
+            temperature=temperature,
+            cancel_event=cancel_event,
+            on_progress=on_progress,
+            num_ctx=budget["num_ctx"],
+            info=gen_info,
+            log=part_log,
+            keep_alive=keep_alive,
+        )
+        if gen_info.get("saved_tokens"):
+            part_log(f"⏹️ Corte anticipado: ~{gen_info['saved_tokens']} tokens ahorrados como mucho (estimado)")
+        record_output_tokens(model, grp["n_vf"], grp["n_short"], exam_output_tokens(gen_info))
+        return parse_exam(result, grp["n_vf"], grp["n_short"])
 
-    # Descripción del "formato" en texto para guiar al modelo
-    sections = ["## Examen"]
-
-    if n_vf > 0:
-        sections.append("### Verdadero o falso")
-        sections.append(f"- Escribe {n_vf} enunciados numerados del 1 al {n_vf}.")
-        sections.append("- Cada línea debe empezar con: `N. (V/F) ...` (obligatorio).")
-
-    if n_short > 0:
-        start = 1 if n_vf == 0 else (n_vf + 1)
-        end = total
-        sections.append("### Respuesta corta")
-        sections.append(f"- Escribe {n_short} preguntas numeradas del {start} al {end}.")
-        sections.append("- Deben ser preguntas reales (idealmente con `?`).")
-        sections.append("- No copies frases literales del apunte ni metas pistas obvias en el enunciado.")
-
-    sections.append("## Respuestas")
-    sections.append(f"- Da {total} respuestas numeradas del 1 al {total}.")
-
-    if n_vf > 0:
-        sections.append(f"- Para 1..{n_vf}: SOLO `V` o `F` (sin explicación).")
-    if n_short > 0:
-        start = 1 if n_vf == 0 else (n_vf + 1)
-        sections.append(f"- Para {start}..{total}: una sola frase corta (NO puede ser `V`/`F`).")
-
-    fmt = "\n".join(sections)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        parts = list(pool.map(run_part, plan))
+    return merge_exams(parts)
 
-    prompt = dedent(f"""
-    Eres profesor/a. Crea un examen basado SOLO en los apuntes.
 
-    Requisitos:
-    - Total preguntas: {total}
-    - Verdadero/Falso: {n_vf}
-    - Respuesta corta: {n_short}
-    - Reparte las preguntas entre distintos temas/secciones del texto (no te centres en un solo apartado).
-    - NO uses internet ni conocimientos externos.
-    - En `## Examen` SOLO van preguntas/enunciados. En `## Respuestas` SOLO van respuestas.
+# ============================
+#  Compresión extractiva de apuntes
+# ============================
+#  Antes de mandar los apuntes al modelo se pueden quitar las frases
+#  menos informativas de cada tema (TF-IDF, sin LLM, en milisegundos):
+#  - Se puntúa cada frase por lo "propias del tema" que son sus palabras
+#    (frecuencia en la sección x rareza en el documento).
+#  - Cada tema conserva su parte proporcional del objetivo de tokens.
+#  - Títulos, marcadores de página y definiciones se conservan siempre.
+#  - Es determinista: empates -> gana la frase que va antes.
+# ============================
+SPANISH_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde donde dos
+durante e el ella ellas ellos en entre era eran es esa esas ese eso esos esta estas este esto
+estos está están fue fueron ha han hasta hay la las le les lo los mas más me mi mis mucho muy
+nada ni no nos o otra otras otro otros para pero poco por porque que qué se sea sean según ser
+si sido sin sobre son su sus también tan tanto te tiene tienen todo todos tu tus un una unas
+uno unos y ya cada puede pueden debe deben hace hacer así bien sino aunque dicha dicho dichos
+mismo misma mismos mismas cual cuyo cuya donde mientras tras vez veces etc
+""".split())
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+(?=[¿¡\"(A-ZÁÉÍÓÚÑ0-9])")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_DEFINITION_RE = re.compile(
+    r"(?i)\b(se define|se denomina|se llama|se conoce como|se entiende por|consiste en|"
+    r"es (el|la|un|una|aquel|aquella|lo que)|son (los|las|aquellos|aquellas))\b"
+    r"|^[^\W\d_][\w ]{2,40}:\s"
+)
+
+def _terms(text: str) -> list:
+    """
+    Palabras con contenido: minúsculas, sin stopwords ni palabras de
+    1-2 letras, cortadas a 6 letras (raíz barata: "trabajadores" y
+    "trabajador" cuentan como la misma palabra).
+    """
+    return [
+        w[:6] for w in (m.group().casefold() for m in _WORD_RE.finditer(text))
+        if len(w) > 2 and w not in SPANISH_STOPWORDS
+    ]
 
-    Formato obligatorio (Markdown):
-    {fmt}
+def is_definition(sentence: str) -> bool:
+    """Frases tipo "X es el/la...", "se denomina...", "Término: ..."."""
+    return bool(_DEFINITION_RE.search(sentence))
 
-    APUNTES:
-    ---
-    {apuntes_md}
-    ---
-    """).strip()
+def compress_doc(doc, keep: float = DEFAULT_COMPRESS_KEEP, max_tokens: int = None, model: str = None, info: dict = None):
+    """
+    Devuelve un Documento nuevo con solo las frases más informativas
+    de cada tema (keep = fracción de tokens a conservar, 0-1).
 
-    return prompt
+    - max_tokens (opcional): objetivo absoluto; se usa el más pequeño
+      de los dos.
+    - info (opcional): compress_tokens_before / compress_tokens_after /
+      compress_ratio / compress_ms.
+    """
+    t0 = time.perf_counter()
+    text = doc.text
+    before = estimate_tokens(text, model)
+    if max_tokens:
+        keep = min(keep, max_tokens / before)
+    keep = max(0.0, min(1.0, keep))
+
+    # 1) Frases de cada párrafo (las viñetas van enteras)
+    sentences = []  # [offset_párrafo, nº_párrafo, texto, términos]
+    for k, (a, b) in enumerate(doc.iter_paragraphs()):
+        para = text[a:b]
+        parts = [para] if para.startswith("- ") else _SENTENCE_SPLIT_RE.split(para)
+        for part in parts:
+            sentences.append([a, k, part, _terms(part)])
+
+    # 2) IDF sobre todas las frases del documento
+    df = {}
+    for s in sentences:
+        for t in set(s[3]):
+            df[t] = df.get(t, 0) + 1
+    n = len(sentences) + 1
+    idf = {t: math.log(n / (c + 1)) + 1.0 for t, c in df.items()}
+
+    # 3) Por tema: TF de la sección x IDF, y se eligen frases hasta su cupo
+    kept = set()
+    units = _section_units(doc)
+    unit_starts = [a for _t, a, _b in units]
+    by_unit = [[] for _ in units]
+    for idx, s in enumerate(sentences):
+        by_unit[bisect.bisect_right(unit_starts, s[0]) - 1].append(idx)
+
+    for members in by_unit:
+        tf = {}
+        for idx in members:
+            for t in sentences[idx][3]:
+                tf[t] = tf.get(t, 0) + 1
+        cost = {idx: estimate_tokens(sentences[idx][2], model) for idx in members}
+        quota = keep * sum(cost.values())
+
+        used = 0
+        ranked = []
+        for idx in members:
+            terms = sentences[idx][3]
+            if is_definition(sentences[idx][2]):
+                kept.add(idx)
+                used += cost[idx]
+            elif terms:
+                score = sum(tf[t] * idf[t] for t in set(terms)) / math.sqrt(len(terms))
+                ranked.append((-score, idx))
+        for _score, idx in sorted(ranked):
+            if used + cost[idx] <= quota:
+                kept.add(idx)
+                used += cost[idx]
+
+    # 4) Reconstruir en orden: marcadores, títulos y frases conservadas
+    items = [(off, "page", text[off:text.find("\n", off)]) for off in doc.page_offsets]
+    for sec in doc.sections:
+        end = text.find("\n", sec.start)
+        items.append((sec.start, "heading", text[sec.start:end if end >= 0 else len(text)]))
+    paras = {}
+    for idx in sorted(kept):
+        a, k, part, _terms_ = sentences[idx]
+        paras.setdefault(k, [a, []])[1].append(part)
+    for a, parts in paras.values():
+        body = " ".join(parts)
+        items.append((a, "bullet" if body.startswith("- ") else "para", body))
+
+    builder = DocBuilder()
+    out = []
+    n_chars = 0
+    for _off, kind, chunk in sorted(items, key=lambda x: x[0]):
+        if out:
+            out.append("\n\n")
+            n_chars += 2
+        builder.add(kind, n_chars, n_chars + len(chunk), chunk)
+        out.append(chunk)
+        n_chars += len(chunk)
+    builder.empty_pages.extend(doc.empty_pages)
+    builder.usable_chars = doc.usable_chars
+    small = builder.build("".join(out) + "\n")
+
+    if info is not None:
+        after = estimate_tokens(small.text, model)
+        info["compress_tokens_before"] = before
+        info["compress_tokens_after"] = after
+        info["compress_ratio"] = after / before
+        info["compress_ms"] = (time.perf_counter() - t0) * 1000
+    return small
 
 
 # ============================
@@ -453,17 +3603,31 @@ def validate_output(md: str, n_vf: int, n_short: int) -> bool:
 
     Esto NO valida contenido semántico (si está “bien” o “mal”),
     solo el formato para evitar outputs raros.
+    Para saber QUÉ falla: output_problems.
     """
-    if "## Examen" not in md or "## Respuestas" not in md:
-        return False
+    return not output_problems(md, n_vf, n_short)
+
+def output_problems(md: str, n_vf: int, n_short: int) -> list:
+    """
+    Mismas comprobaciones que validate_output, pero devuelve la lista de
+    problemas encontrados (en texto, para enseñárselos al modelo al
+    pedirle que repare el formato). Lista vacía = salida válida.
+    """
+    problems = []
+    if "## Examen" not in md:
+        problems.append("Falta el título `## Examen`.")
+    if "## Respuestas" not in md:
+        problems.append("Falta la sección `## Respuestas` (las respuestas van ahí, numeradas).")
+    if problems:
+        return problems
 
     total = n_vf + n_short
 
     # Si el usuario pidió 0 en una sección, no debería aparecer
     if n_vf == 0 and re.search(r"(?mi)^###\s+Verdadero\s+o\s+falso\b", md):
-        return False
+        problems.append("Sobra la sección `### Verdadero o falso`: no se pidieron preguntas V/F.")
     if n_short == 0 and re.search(r"(?mi)^###\s+Respuesta\s+corta\b", md):
-        return False
+        problems.append("Sobra la sección `### Respuesta corta`: no se pidieron preguntas de respuesta corta.")
 
     exam_part, ans_part = md.split("## Respuestas", 1)
 
@@ -471,43 +3635,50 @@ def validate_output(md: str, n_vf: int, n_short: int) -> bool:
     if n_vf > 0:
         m = re.search(r"(?is)###\s+Verdadero\s+o\s+falso\s*(.*?)(###\s+Respuesta\s+corta|$)", exam_part)
         if not m:
-            return False
-        vf_block = m.group(1).strip()
-
-        # líneas: "1. (V/F) ..."
-        vf_lines = re.findall(r"(?m)^\s*(\d+)\.\s*\(V/F\)\s+.+$", vf_block)
-        if len(vf_lines) != n_vf:
-            return False
-        nums = sorted(int(x) for x in vf_lines)
-        if nums != list(range(1, n_vf + 1)):
-            return False
+            problems.append("Falta la sección `### Verdadero o falso` dentro de `## Examen`.")
+        else:
+            vf_block = m.group(1).strip()
+
+            # líneas: "1. (V/F) ..."
+            vf_lines = re.findall(r"(?m)^\s*(\d+)\.\s*\(V/F\)\s+.+$", vf_block)
+            nums = sorted(int(x) for x in vf_lines)
+            if len(vf_lines) != n_vf:
+                problems.append(
+                    f"En `### Verdadero o falso` hay {len(vf_lines)} líneas `N. (V/F) ...` y deben ser {n_vf}."
+                )
+            elif nums != list(range(1, n_vf + 1)):
+                problems.append(f"Los enunciados V/F deben ir numerados del 1 al {n_vf} (ahora: {nums}).")
 
     # ---- Validar bloque Respuesta corta
     if n_short > 0:
         m = re.search(r"(?is)###\s+Respuesta\s+corta\s*(.*)$", exam_part)
         if not m:
-            return False
-        sh_block = m.group(1).strip()
-
-        # líneas: "N. ..." pero no deben empezar con "(V/F)"
-        sh_lines = re.findall(r"(?m)^\s*(\d+)\.\s+(?!\(V/F\)).+$", sh_block)
-        if len(sh_lines) != n_short:
-            return False
-
-        start = 1 if n_vf == 0 else (n_vf + 1)
-        nums = sorted(int(x) for x in sh_lines)
-        if nums != list(range(start, total + 1)):
-            return False
+            problems.append("Falta la sección `### Respuesta corta` dentro de `## Examen`.")
+        else:
+            sh_block = m.group(1).strip()
+
+            # líneas: "N. ..." pero no deben empezar con "(V/F)"
+            sh_lines = re.findall(r"(?m)^\s*(\d+)\.\s+(?!\(V/F\)).+$", sh_block)
+            start = 1 if n_vf == 0 else (n_vf + 1)
+            nums = sorted(int(x) for x in sh_lines)
+            if len(sh_lines) != n_short:
+                problems.append(
+                    f"En `### Respuesta corta` hay {len(sh_lines)} preguntas numeradas y deben ser {n_short}."
+                )
+            elif nums != list(range(start, total + 1)):
+                problems.append(f"Las preguntas de respuesta corta deben ir del {start} al {total} (ahora: {nums}).")
 
     # ---- Validar respuestas
     ans_lines = re.findall(r"(?m)^\s*(\d+)\.\s+(.+)$", ans_part.strip())
     if len(ans_lines) < total:
-        return False
+        problems.append(f"En `## Respuestas` hay {len(ans_lines)} respuestas numeradas y deben ser {total}.")
 
     nums_present = {int(k) for k, _ in ans_lines}
-    if not all(i in nums_present for i in range(1, total + 1)):
-        return False
+    missing = [i for i in range(1, total + 1) if i not in nums_present]
+    if missing:
+        problems.append(f"Faltan las respuestas número: {format_page_ranges(missing)}.")
 
+    bad_vf, bad_short = [], []
     for k_str, content in ans_lines:
         k = int(k_str)
         c = content.strip().lower()
@@ -515,14 +3686,67 @@ def validate_output(md: str, n_vf: int, n_short: int) -> bool:
         # respuestas V/F
         if 1 <= k <= n_vf:
             if c not in ("v", "f", "verdadero", "falso"):
-                return False
+                bad_vf.append(k)
 
         # respuestas cortas (no pueden ser V/F)
         if n_vf < k <= total:
             if c in ("v", "f", "verdadero", "falso"):
-                return False
+                bad_short.append(k)
 
-    return True
+    if bad_vf:
+        problems.append(f"Respuestas {format_page_ranges(bad_vf)}: son de V/F, deben ser SOLO `V` o `F`.")
+    if bad_short:
+        problems.append(
+            f"Respuestas {format_page_ranges(bad_short)}: son de respuesta corta, no pueden ser `V`/`F`."
+        )
+
+    return problems
+
+def exam_items(md: str, n_vf: int, n_short: int) -> dict:
+    """
+    Preguntas que están BIEN, una a una: {nº: (enunciado, respuesta)}.
+
+    Es más tolerante que validate_output con la estructura (títulos que
+    faltan, orden...) y más estricto por pregunta: una pregunta vale si
+    tiene enunciado del tipo que toca en su número y una respuesta válida
+    (V/F en 1..n_vf, frase en el resto). Se queda la primera aparición.
+    """
+    total = n_vf + n_short
+    exam_part, _, ans_part = md.partition("## Respuestas")
+
+    questions = {}
+    for k_str, text in re.findall(r"(?m)^\s*(\d+)\.\s+(.+)$", exam_part):
+        k = int(k_str)
+        if not 1 <= k <= total or k in questions:
+            continue
+        is_vf = re.match(r"\(V/F\)\s+", text)
+        if (k <= n_vf) != bool(is_vf):
+            continue
+        questions[k] = text[is_vf.end():].strip() if is_vf else text.strip()
+
+    answers = {}
+    for k_str, text in re.findall(r"(?m)^\s*(\d+)\.\s+(.+)$", ans_part):
+        answers.setdefault(int(k_str), text.strip())
+
+    items = {}
+    for k, q in questions.items():
+        a = answers.get(k, "")
+        is_vf_answer = a.lower() in ("v", "f", "verdadero", "falso")
+        if q and a and (k <= n_vf) == is_vf_answer:
+            items[k] = (q, a)
+    return items
+
+def broken_items(items: dict, n_vf: int, n_short: int) -> list:
+    """Números de pregunta (1..N) que faltan o están mal en items (de exam_items)."""
+    return [k for k in range(1, n_vf + n_short + 1) if k not in items]
+
+def render_items(items: dict, n_vf: int, n_short: int) -> str:
+    """Examen con el formato de siempre a partir de {nº: (enunciado, respuesta)}."""
+    total = n_vf + n_short
+    return merge_exams([{
+        "vf": [items[k] for k in range(1, n_vf + 1) if k in items],
+        "short": [items[k] for k in range(n_vf + 1, total + 1) if k in items],
+    }])
 
 
 # ============================
@@ -556,7 +3780,7 @@ class App(BaseWindow):
             super().__init__()
 
         self.title("Generador de examen (PDF -> Markdown + Ollama)")
-        self.geometry("900x610")
+        self.geometry("900x700")
 
         # Cancelación para streaming
         self.cancel_event = threading.Event()
@@ -569,14 +3793,27 @@ class App(BaseWindow):
         # Variables de estado (UI)
         # ----------------------------
         self.pdf_path = tk.StringVar(value="")
+        self.page_spec = tk.StringVar(value="")
         self.out_dir = tk.StringVar(value=str(pathlib.Path.cwd()))
         self.host = tk.StringVar(value=DEFAULT_HOST)
         self.model = tk.StringVar(value="qwen2.5-coder:7b")
-        self.num_predict = tk.StringVar(value=str(DEFAULT_NUM_PREDICT))
+        self.num_predict = tk.StringVar(value="")  # vacío = automático (predict_num_predict)
         self.temperature = tk.StringVar(value=str(DEFAULT_TEMPERATURE))
+        self.keep_alive = tk.StringVar(value=DEFAULT_KEEP_ALIVE)
+        self.extract_workers = tk.StringVar(value=str(DEFAULT_EXTRACT_WORKERS))
+        self.extractor = tk.StringVar(value=DEFAULT_EXTRACTOR)
 
         self.do_archive = tk.BooleanVar(value=True)
         self.save_apuntes_md = tk.BooleanVar(value=True)
+        self.use_md_cache = tk.BooleanVar(value=True)
+        self.strip_headers = tk.BooleanVar(value=False)  # cambia el Markdown: que lo active quien quiera
+        self.skip_empty_pages = tk.BooleanVar(value=False)
+        self.compress_notes = tk.BooleanVar(value=False)
+        self.compress_keep = tk.StringVar(value=str(int(DEFAULT_COMPRESS_KEEP * 100)))
+
+        # Caché compartida por todos los trabajos de esta ventana
+        self.md_cache = MdCache(DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_MB * 1024 * 1024)
+        self.page_store = PageStore(DEFAULT_PAGE_STORE_DIR)
 
         self.use_vf = tk.BooleanVar(value=False)
         self.use_short = tk.BooleanVar(value=True)
@@ -585,6 +3822,10 @@ class App(BaseWindow):
         self.n_vf = tk.StringVar(value="0")
         self.n_short = tk.StringVar(value="10")
 
+        # Examen por secciones (varias peticiones a Ollama a la vez)
+        self.by_sections = tk.BooleanVar(value=False)
+        self.map_concurrency = tk.StringVar(value=str(DEFAULT_MAP_CONCURRENCY))
+
         # Tema UI (solo si ttkbootstrap está instalado)
         self.ui_theme = tk.StringVar(value=DEFAULT_THEME)
 
@@ -598,6 +3839,10 @@ class App(BaseWindow):
         self._poll_queue()
         self._update_total()
 
+        # Cargar ya el modelo en Ollama (en segundo plano) para que la
+        # primera generación no tenga que esperar a la carga
+        self.after(300, self._preload_model)
+
     # ------------------------------------------------------
     # UI: construcción
     # ------------------------------------------------------
@@ -617,6 +3862,14 @@ class App(BaseWindow):
         ttk.Button(row, text="Seleccionar PDF...", command=self.pick_pdf).pack(side="left")
         ttk.Label(row, textvariable=self.pdf_path, wraplength=760).pack(side="left", padx=10)
 
+        row1b = ttk.Frame(f1)
+        row1b.pack(fill="x", padx=10, pady=(0, 8))
+
+        ttk.Label(row1b, text="Páginas / temas:").pack(side="left")
+        ttk.Entry(row1b, textvariable=self.page_spec, width=40).pack(side="left", padx=6)
+        ttk.Button(row1b, text="Ver índice", command=self.show_outline).pack(side="left", padx=6)
+        ttk.Label(row1b, text="(vacío = todo. Ej: 3-5, 12, Tema 4)").pack(side="left", padx=6)
+
         # --- 2) Salida
         f2 = ttk.LabelFrame(frm, text="2) Salida")
         f2.pack(fill="x", **pad)
@@ -632,6 +3885,9 @@ class App(BaseWindow):
 
         ttk.Checkbutton(row2b, text="Archivar (copiar) el PDF en /archivados", variable=self.do_archive).pack(side="left")
         ttk.Checkbutton(row2b, text="Guardar también Apuntes .md", variable=self.save_apuntes_md).pack(side="left", padx=12)
+        ttk.Checkbutton(row2b, text="Usar caché (PDF y páginas)", variable=self.use_md_cache).pack(side="left")
+        ttk.Checkbutton(row2b, text="Quitar cabeceras/pies repetidos", variable=self.strip_headers).pack(side="left", padx=12)
+        ttk.Checkbutton(row2b, text="Excluir páginas sin texto", variable=self.skip_empty_pages).pack(side="left")
 
         # --- 3) Ollama + Tema
         f3 = ttk.LabelFrame(frm, text="3) Ollama + UI")
@@ -644,7 +3900,9 @@ class App(BaseWindow):
         ttk.Entry(row3, textvariable=self.host, width=26).pack(side="left", padx=6)
 
         ttk.Label(row3, text="Modelo:").pack(side="left", padx=(10, 0))
-        ttk.Combobox(row3, textvariable=self.model, values=MODELOS_DISPONIBLES, state="readonly", width=22).pack(side="left", padx=6)
+        cb_model = ttk.Combobox(row3, textvariable=self.model, values=MODELOS_DISPONIBLES, state="readonly", width=22)
+        cb_model.pack(side="left", padx=6)
+        cb_model.bind("<<ComboboxSelected>>", self._preload_model)
 
         # Selector de tema (solo si ttkbootstrap está instalado)
         if TTKBOOTSTRAP_AVAILABLE:
@@ -658,12 +3916,30 @@ class App(BaseWindow):
         row3b = ttk.Frame(f3)
         row3b.pack(fill="x", padx=10, pady=6)
 
-        ttk.Label(row3b, text="num_predict:").pack(side="left")
+        ttk.Label(row3b, text="num_predict (vacío = auto):").pack(side="left")
         ttk.Entry(row3b, textvariable=self.num_predict, width=10).pack(side="left", padx=6)
 
         ttk.Label(row3b, text="temperature:").pack(side="left", padx=(10, 0))
         ttk.Entry(row3b, textvariable=self.temperature, width=10).pack(side="left", padx=6)
 
+        ttk.Label(row3b, text="Mantener cargado:").pack(side="left", padx=(10, 0))
+        ttk.Combobox(row3b, textvariable=self.keep_alive, values=KEEP_ALIVE_OPTIONS, width=6).pack(side="left", padx=6)
+
+        ttk.Label(row3b, text="Procesos PDF:").pack(side="left", padx=(10, 0))
+        ttk.Entry(row3b, textvariable=self.extract_workers, width=6).pack(side="left", padx=6)
+
+        ttk.Label(row3b, text="Extractor:").pack(side="left", padx=(10, 0))
+        ttk.Combobox(
+            row3b, textvariable=self.extractor, values=["auto"] + available_extractors(), state="readonly", width=10
+        ).pack(side="left", padx=6)
+
+        row3c = ttk.Frame(f3)
+        row3c.pack(fill="x", padx=10, pady=6)
+
+        ttk.Checkbutton(row3c, text="Comprimir apuntes (quitar frases menos importantes)", variable=self.compress_notes).pack(side="left")
+        ttk.Label(row3c, text="Conservar %:").pack(side="left", padx=(10, 0))
+        ttk.Entry(row3c, textvariable=self.compress_keep, width=6).pack(side="left", padx=6)
+
         # --- 4) Preguntas
         f4 = ttk.LabelFrame(frm, text=f"4) Tipos y cantidad (máximo {MAX_PREGUNTAS} en total)")
         f4.pack(fill="x", **pad)
@@ -682,6 +3958,12 @@ class App(BaseWindow):
         self.lbl_total = ttk.Label(grid, text="Total: 0/10")
         self.lbl_total.grid(row=0, column=2, padx=20, rowspan=2, sticky="w")
 
+        ttk.Checkbutton(
+            grid, text="Por secciones (un mini-examen por tema, en paralelo)", variable=self.by_sections
+        ).grid(row=0, column=3, columnspan=2, sticky="w")
+        ttk.Label(grid, text="Peticiones a la vez:").grid(row=1, column=3, sticky="w", pady=(6, 0))
+        ttk.Spinbox(grid, from_=1, to=8, textvariable=self.map_concurrency, width=6).grid(row=1, column=4, padx=8, pady=(6, 0))
+
         self._toggle_inputs()
 
         # --- 5) Acciones
@@ -727,6 +4009,29 @@ class App(BaseWindow):
     # ------------------------------------------------------
     # Eventos y validaciones de inputs
     # ------------------------------------------------------
+    def _preload_model(self, _evt=None):
+        """
+        Precarga el modelo elegido en un hilo aparte (preload_model), con
+        el keep_alive de la GUI. Si keep_alive es 0 no tiene sentido.
+        """
+        model, host, keep = self.model.get(), self.host.get(), self.keep_alive.get()
+        if keep_alive_value(keep) == 0:
+            return
+        threading.Thread(target=self._worker_preload, args=(model, host, keep), daemon=True).start()
+
+    def _worker_preload(self, model: str, host: str, keep: str):
+        info = {}
+        try:
+            secs = preload_model(model, host, keep, info=info)
+        except Exception as e:
+            self.msg_queue.put(("log", f"⚠️ No se pudo precargar {model}: {e}"))
+            return
+        ctx = f"num_ctx {info['num_ctx']}" if info.get("num_ctx") else "num_ctx de Ollama"
+        if secs >= 0.5:
+            self.msg_queue.put(("log", f"🧠 Modelo {model} cargado en memoria en {secs:0.1f}s ({ctx}, keep_alive {keep})"))
+        else:
+            self.msg_queue.put(("log", f"🧠 Modelo {model} ya estaba cargado ({ctx}, keep_alive {keep})"))
+
     def _wire_events(self):
         """
         Conecta trazas para recalcular el total al escribir/cambiar checks.
@@ -773,6 +4078,32 @@ class App(BaseWindow):
         if path:
             self.pdf_path.set(path)
 
+    def show_outline(self):
+        """
+        Muestra en el log el índice del PDF con el rango de páginas de
+        cada sección (para elegir qué temas entran en el examen).
+        Solo lee el índice: no extrae texto.
+        """
+        pdf = self.pdf_path.get().strip()
+        if not pdf:
+            messagebox.showwarning("Falta PDF", "Selecciona un PDF primero.")
+            return
+        try:
+            reader = PdfReader(pdf)
+            n_pages = len(reader.pages)
+            spans = outline_spans(read_outline(reader), n_pages)
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo leer el PDF: {e}")
+            return
+
+        if not spans:
+            self.log(f"📑 El PDF no tiene índice ({n_pages} páginas). Usa rangos: 3-5, 12")
+            return
+        self.log(f"📑 Índice del PDF ({n_pages} páginas):")
+        for lvl, title, a, b in spans:
+            pages = f"{a + 1}-{b + 1}" if b > a else f"{a + 1}"
+            self.log(f"{'   ' * (lvl - 1)}• {title}  (págs. {pages})")
+
     def pick_out_dir(self):
         """
         Diálogo para seleccionar carpeta de salida.
@@ -924,8 +4255,60 @@ class App(BaseWindow):
 
             # --- PDF -> Markdown
             self.msg_queue.put(("status", "Convirtiendo PDF -> Markdown..."))
-            apuntes_md = pdf_to_md(str(pdf_src), str(md_apuntes_path))
-            self.msg_queue.put(("log", f"✅ Apuntes MD generado: {md_apuntes_path} ({len(apuntes_md)} chars)"))
+            workers = max(1, safe_int(self.extract_workers.get(), DEFAULT_EXTRACT_WORKERS))
+            cache = self.md_cache if self.use_md_cache.get() else None
+            page_store = self.page_store if self.use_md_cache.get() else None
+            conv_info = {}
+            doc = pdf_to_doc(
+                str(pdf_src),
+                str(md_apuntes_path),
+                workers=workers,
+                cache=cache,
+                page_store=page_store,
+                strip_headers=self.strip_headers.get(),
+                skip_empty=self.skip_empty_pages.get(),
+                backend=self.extractor.get(),
+                page_spec=self.page_spec.get(),
+                info=conv_info,
+            )
+            apuntes_md = doc.text
+            self.msg_queue.put((
+                "log",
+                f"✅ Apuntes MD generado: {md_apuntes_path} ({len(apuntes_md)} chars, "
+                f"{len(doc.page_nums)} págs, {len(doc.sections)} secciones)"
+            ))
+            self.msg_queue.put(("log", f"🔧 Extractor de texto: {conv_info.get('backend')}"))
+            if "pages_selected" in conv_info:
+                self.msg_queue.put((
+                    "log",
+                    f"📄 Selección: {conv_info['pages_selected']} de {conv_info['pages_total']} páginas "
+                    f"({format_page_ranges(doc.page_nums)})"
+                ))
+            if cache is not None:
+                estado = "acierto (sin extraer)" if conv_info.get("cache") == "hit" else "fallo (convertido y guardado)"
+                self.msg_queue.put(("log", f"🗃️ Caché PDF->MD: {estado} | {cache.stats_text()}"))
+            if conv_info.get("header_lines_removed"):
+                ejemplos = " | ".join(conv_info["header_samples"])
+                self.msg_queue.put((
+                    "log",
+                    f"✂️ Cabeceras/pies quitados: {conv_info['header_lines_removed']} líneas "
+                    f"(~{conv_info['header_tokens_removed']} tokens menos en el prompt). Ej: {ejemplos}"
+                ))
+            if conv_info.get("outline_sections"):
+                self.msg_queue.put(("log", f"📑 Títulos tomados del índice del PDF: {conv_info['outline_sections']}"))
+            if "pages_reused" in conv_info:
+                self.msg_queue.put((
+                    "log",
+                    f"♻️ Páginas reutilizadas: {conv_info['pages_reused']} | "
+                    f"reextraídas: {conv_info['pages_extracted']}"
+                ))
+            if len(doc.empty_pages):
+                accion = "excluidas" if self.skip_empty_pages.get() else "incluidas"
+                self.msg_queue.put((
+                    "log",
+                    f"🖼️ Páginas sin texto ({len(doc.empty_pages)}): "
+                    f"{format_page_ranges(doc.empty_pages)} ({accion})"
+                ))
 
             # Si el usuario no quiere guardar el md, lo borramos
             if not self.save_apuntes_md.get():
@@ -935,50 +4318,152 @@ class App(BaseWindow):
                 except Exception:
                     pass
 
+            # --- Cortar aquí si el PDF no tiene texto (no gastamos CPU en el modelo)
+            check_usable_text(doc, self.skip_empty_pages.get())
+
+            # --- Compresión extractiva (opcional): solo afecta al prompt, no al .md
+            if self.compress_notes.get():
+                keep = min(100, safe_int(self.compress_keep.get(), int(DEFAULT_COMPRESS_KEEP * 100))) / 100
+                comp_info = {}
+                doc = compress_doc(doc, keep, model=self.model.get(), info=comp_info)
+                self.msg_queue.put((
+                    "log",
+                    f"🗜️ Apuntes comprimidos: ~{comp_info['compress_tokens_before']} -> "
+                    f"~{comp_info['compress_tokens_after']} tokens ({comp_info['compress_ratio']:.0%}) "
+                    f"en {comp_info['compress_ms']:.0f} ms"
+                ))
+
             # --- Preparar llamada a Ollama
             self.msg_queue.put(("status", "Generando examen con Ollama..."))
 
             model = self.model.get()
             host = self.host.get()
-            num_predict = safe_int(self.num_predict.get(), DEFAULT_NUM_PREDICT)
+            keep_alive = self.keep_alive.get()
+            load_secs = 0.0
+            # num_predict: el del campo si se escribió uno; si no, el aprendido del historial
+            num_predict = safe_int(self.num_predict.get(), 0) or None
 
             try:
                 temperature = float((self.temperature.get() or "").strip() or DEFAULT_TEMPERATURE)
             except Exception:
                 temperature = DEFAULT_TEMPERATURE
 
-            prompt = build_prompt(apuntes_md, n_vf, n_short)
-
             start = time.time()
 
-            # Callback de progreso: solo mostramos tiempo
-            def on_prog(_text, elapsed):
-                self.msg_queue.put(("elapsed", f"Tiempo: {elapsed:0.1f}s"))
-
-            # --- Llamada a Ollama
-            result = ollama_generate_stream(
-                prompt,
-                model=model,
-                host=host,
-                num_predict=num_predict,
-                temperature=temperature,
-                cancel_event=self.cancel_event,
-                on_progress=on_prog
-            )
-
-            # --- Validación simple de formato (reintento 1 vez)
-            if not validate_output(result, n_vf, n_short):
-                self.msg_queue.put(("log", "⚠️ Salida rara. Reintento 1 vez (estricto + temp 0.0)..."))
-                prompt2 = prompt + "\n\nREGLA FINAL: NO pongas respuestas en '## Examen'. Responde SOLO en '## Respuestas'. Respeta numeración 1..N."
-                result = ollama_generate_stream(
-                    prompt2,
+            # Callback de progreso: tiempo, tokens y velocidad (ya llega a ~10 avisos/s)
+            def on_prog(ev):
+                self.msg_queue.put((
+                    "elapsed", f"Tiempo: {ev.elapsed:0.1f}s | {ev.tokens} tokens ({ev.tokens_per_s:0.1f}/s)"
+                ))
+
+            concurrency = max(1, safe_int(self.map_concurrency.get(), DEFAULT_MAP_CONCURRENCY))
+            by_sections = self.by_sections.get() and len(plan_sections(doc, n_vf, n_short)) > 1
+
+            if by_sections:
+                # --- Un mini-examen por tema, varios a la vez, y se juntan
+                self.msg_queue.put(("log", f"🧩 Examen por secciones ({concurrency} peticiones a la vez)"))
+                result = generate_exam_by_sections(
+                    doc,
+                    n_vf,
+                    n_short,
+                    model=model,
+                    host=host,
+                    num_predict=num_predict,
+                    temperature=temperature,
+                    cancel_event=self.cancel_event,
+                    concurrency=concurrency,
+                    on_progress=on_prog,
+                    log=lambda msg: self.msg_queue.put(("log", msg)),
+                    keep_alive=keep_alive,
+                )
+            else:
+                if num_predict is None:
+                    num_predict = predict_num_predict(model, n_vf, n_short)
+                    rates = output_token_rates(model)
+                    self.msg_queue.put((
+                        "log",
+                        f"🎯 num_predict automático: {num_predict} "
+                        f"(~{rates['vf']:.0f} tokens por V/F, ~{rates['short']:.0f} por corta; "
+                        f"{rates['samples']} exámenes de {model})"
+                    ))
+
+                # --- Presupuesto de tokens: num_ctx justo (y recorte si no cabe)
+                prompt, budget = fit_prompt(doc, n_vf, n_short, model, num_predict, host)
+                self.msg_queue.put(("log", f"🧮 Tokens: {budget_text(budget)}"))
+                self.msg_queue.put((
+                    "log",
+                    f"🪶 Apuntes en forma compacta: ~{budget['notes_tokens_before']} -> ~{budget['notes_tokens']} tokens "
+                    f"({len(budget['notes'].page_nums)} marcadores de página fuera del prompt, en un mapa aparte)"
+                ))
+                if budget["trimmed"]:
+                    self.msg_queue.put((
+                        "log",
+                        f"✂️ Los apuntes no caben en el contexto: recortados de ~{budget['notes_tokens']} "
+                        f"a ~{budget['notes_budget']} tokens (todas las páginas, menos párrafos por página)."
+                    ))
+
+                # --- Llamada a Ollama + validación simple de formato (reintento 1 vez)
+                gen_info = {}
+                result = generate_exam(
+                    prompt,
+                    n_vf,
+                    n_short,
                     model=model,
                     host=host,
                     num_predict=num_predict,
-                    temperature=0.0,
+                    temperature=temperature,
                     cancel_event=self.cancel_event,
-                    on_progress=on_prog
+                    on_progress=on_prog,
+                    num_ctx=budget["num_ctx"],
+                    info=gen_info,
+                    log=lambda msg: self.msg_queue.put(("log", msg)),
+                    keep_alive=keep_alive,
                 )
+                first = gen_info["first"]
+                load_secs = first.get("load_duration", 0) / 1e9
+                if "load_duration" in first:
+                    self.msg_queue.put((
+                        "log",
+                        f"⏱️ Carga del modelo: {load_secs:0.1f}s | generación: "
+                        f"{(first.get('total_duration', 0) - first['load_duration']) / 1e9:0.1f}s"
+                    ))
+                elif first.get("first_token_s") is not None:
+                    self.msg_queue.put((
+                        "log", f"⏱️ Primer token a los {first['first_token_s']:0.1f}s (carga del modelo + lectura de apuntes)"
+                    ))
+                if first.get("prompt_eval_count"):
+                    self.msg_queue.put((
+                        "log",
+                        f"🧮 Tokens reales: prompt {first['prompt_eval_count']} (estimado ~{budget['estimated']}), "
+                        f"salida {first.get('eval_count', 0)} | {prefill_text(first)}"
+                    ))
+                    calibrate_tokens(model, budget["estimated"], first["prompt_eval_count"])
+                record_output_tokens(model, n_vf, n_short, exam_output_tokens(gen_info))
+                if gen_info.get("continue"):
+                    rounds = gen_info["continue"]
+                    self.msg_queue.put((
+                        "log",
+                        f"⏩ Continuada {len(rounds)} vez/veces sobre el contexto: "
+                        f"{prefill_text(rounds[-1])}, +{sum(c.get('eval_count', 0) for c in rounds)} tokens de salida"
+                    ))
+                if "fill" in gen_info:
+                    self.msg_queue.put((
+                        "log",
+                        f"🩹 Regeneradas {len(gen_info['fill_items'])} preguntas "
+                        f"({'sobre el contexto anterior' if gen_info['fill']['mode'] == 'context' else 'reenviando el prompt'}): "
+                        f"{prefill_text(gen_info['fill'])}, salida {gen_info['fill'].get('eval_count', 0)} tokens"
+                    ))
+                if "repair" in gen_info:
+                    self.msg_queue.put(("log", f"🩹 Reparación de formato: {prefill_text(gen_info['repair'])}"))
+                if "retry" in gen_info:
+                    modo = "sobre el contexto anterior" if gen_info["retry"]["mode"] == "context" else "reenviando el prompt"
+                    self.msg_queue.put(("log", f"🔁 Reintento {modo}: {prefill_text(gen_info['retry'])}"))
+                if gen_info.get("saved_tokens"):
+                    self.msg_queue.put((
+                        "log",
+                        f"⏹️ Corte anticipado al completar las respuestas: ~{gen_info['saved_tokens']} tokens "
+                        "ahorrados como mucho (estimado)"
+                    ))
 
             if not validate_output(result, n_vf, n_short):
                 # Guardamos igual (modo debug) para que puedas verlo
@@ -989,7 +4474,8 @@ class App(BaseWindow):
             self.msg_queue.put(("log", f"✅ Examen guardado: {examen_path}"))
 
             elapsed_total = time.time() - start
-            self.msg_queue.put(("done", f"Listo. Examen generado en {elapsed_total:0.1f}s"))
+            load_text = f" ({load_secs:0.1f}s de ellos cargando el modelo)" if load_secs >= 0.5 else ""
+            self.msg_queue.put(("done", f"Listo. Examen generado en {elapsed_total:0.1f}s{load_text}"))
 
         except CancelledByUser:
             # Si cancelaste, no lo tratamos como error
@@ -1019,8 +4505,140 @@ class App(BaseWindow):
 
 
 # ==========================================================
-#  Entry point
+#  Línea de comandos
 # ==========================================================
-if __name__ == "__main__":
+def bench_extract(path_pdf: str, max_pages: int = 0):
+    """
+    Compara los extractores instalados sobre un PDF:
+    velocidad (páginas/s) y tamaño de la salida (texto y Markdown).
+
+    Las velocidades medidas se guardan en DEFAULT_EXTRACTOR_PROFILE,
+    que es lo que usa el modo "auto" para elegir extractor.
+    """
+    n_pages = len(PdfReader(path_pdf).pages)
+    indices = list(range(min(max_pages, n_pages) if max_pages else n_pages))
+
+    print(f"{pathlib.Path(path_pdf).name}: {len(indices)} de {n_pages} páginas")
+    print(f"{'extractor':>10} {'seg':>8} {'pág/s':>9} {'texto':>10} {'markdown':>10}")
+
+    speeds = {}
+    for name, cls in EXTRACTORES.items():
+        if not cls.available():
+            print(f"{name:>10}   (no instalado)")
+            continue
+        try:
+            t0 = time.perf_counter()
+            texts = cls(path_pdf).extract(indices)
+            secs = time.perf_counter() - t0
+        except Exception as e:
+            print(f"{name:>10}   (error: {e})")
+            continue
+
+        pages = zip((i + 1 for i in indices), texts)
+        md_chars = sum(len(chunk) for _kind, chunk in iter_md_chunks(iter_md_blocks(iter_md_lines(pages))))
+        speeds[name] = len(indices) / secs if secs > 0 else float("inf")
+        print(f"{name:>10} {secs:>8.2f} {speeds[name]:>9.1f} {sum(len(t) for t in texts):>10} {md_chars:>10}")
+
+    if speeds:
+        best = max(speeds, key=speeds.get)
+        print(f"Más rápido en esta máquina: {best}")
+        try:
+            _atomic_write_text(pathlib.Path(DEFAULT_EXTRACTOR_PROFILE), json.dumps(speeds, indent=2))
+        except OSError:
+            pass
+
+def print_outline(path_pdf: str):
+    """Imprime el índice del PDF con el rango de páginas de cada sección."""
+    reader = PdfReader(path_pdf)
+    n_pages = len(reader.pages)
+    spans = outline_spans(read_outline(reader), n_pages)
+    print(f"{pathlib.Path(path_pdf).name}: {n_pages} páginas")
+    if not spans:
+        print("(sin índice: selecciona por rangos, p. ej. --paginas 3-5,12)")
+    for lvl, title, a, b in spans:
+        print(f"{'  ' * (lvl - 1)}{title}  [{a + 1}-{b + 1}]")
+
+def convert_cli(args):
+    """Subcomando convertir: PDF (o una parte) -> Markdown, sin GUI."""
+    path_md = args.salida or str(pathlib.Path(args.pdf).with_suffix("")) + "_apuntes.md"
+    info = {}
+    t0 = time.perf_counter()
+    doc = pdf_to_doc(
+        args.pdf,
+        path_md,
+        workers=max(1, args.procesos),
+        strip_headers=args.quitar_cabeceras,
+        backend=args.extractor,
+        page_spec=args.paginas,
+        info=info,
+    )
+    if args.comprimir:
+        doc = compress_doc(doc, args.comprimir, info=info)
+        pathlib.Path(path_md).write_text(doc.text, encoding="utf-8")
+    secs = time.perf_counter() - t0
+    if args.comprimir:
+        print(
+            f"Comprimido: ~{info['compress_tokens_before']} -> ~{info['compress_tokens_after']} tokens "
+            f"({info['compress_ratio']:.0%}) en {info['compress_ms']:.0f} ms"
+        )
+    print(
+        f"{path_md}: {len(doc.text)} chars, {len(doc.page_nums)} págs "
+        f"({format_page_ranges(doc.page_nums)}), {len(doc.sections)} secciones, "
+        f"~{estimate_tokens(doc.text)} tokens | {secs:.2f}s, extractor {info.get('backend')}"
+    )
+
+def main(argv=None):
+    """
+    Sin argumentos abre la GUI. Subcomandos:
+    - gui                      (igual que sin argumentos)
+    - indice PDF               muestra el índice con páginas por sección
+    - convertir PDF            PDF (o --paginas "3-5, Tema 4") -> Markdown
+    - bench-extract PDF        compara extractores de texto
+    """
+    parser = argparse.ArgumentParser(description="Generador de exámenes (PDF -> Markdown -> Ollama)")
+    sub = parser.add_subparsers(dest="cmd")
+    sub.add_parser("gui", help="Abre la interfaz gráfica (por defecto)")
+
+    p_idx = sub.add_parser("indice", help="Muestra el índice del PDF (sin extraer texto)")
+    p_idx.add_argument("pdf", help="PDF de apuntes")
+
+    p_conv = sub.add_parser("convertir", help="Convierte un PDF (o parte) a Markdown")
+    p_conv.add_argument("pdf", help="PDF de apuntes")
+    p_conv.add_argument("--paginas", default="", help='Páginas/temas, p. ej. "3-5, 12, Tema 4" (vacío = todo)')
+    p_conv.add_argument("--salida", default="", help="Ruta del .md (por defecto <pdf>_apuntes.md)")
+    p_conv.add_argument("--extractor", default=DEFAULT_EXTRACTOR, choices=["auto"] + list(EXTRACTORES))
+    p_conv.add_argument("--procesos", type=int, default=DEFAULT_EXTRACT_WORKERS, help="Procesos para extraer")
+    p_conv.add_argument("--quitar-cabeceras", action="store_true", help="Quitar cabeceras/pies repetidos (como el check de la GUI)")
+    p_conv.add_argument(
+        "--comprimir", type=float, default=0, metavar="FRACCION",
+        help="Compresión extractiva: fracción de tokens a conservar (p. ej. 0.6; 0 = sin comprimir)",
+    )
+
+    p_bench = sub.add_parser("bench-extract", help="Compara extractores de texto sobre un PDF")
+    p_bench.add_argument("pdf", help="PDF a medir")
+    p_bench.add_argument("--paginas", type=int, default=0, help="Medir solo las N primeras páginas (0 = todas)")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "bench-extract":
+        bench_extract(args.pdf, args.paginas)
+        return
+    if args.cmd == "indice":
+        print_outline(args.pdf)
+        return
+    if args.cmd == "convertir":
+        try:
+            convert_cli(args)
+        except (ValueError, FileNotFoundError) as e:
+            parser.exit(2, f"Error: {e}\n")
+        return
+
     app = App()
     app.mainloop()
+
+
+# ==========================================================
+#  Entry point
+# ==========================================================
+if __name__ == "__main__":
+    main()